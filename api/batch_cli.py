@@ -0,0 +1,96 @@
+# api/batch_cli.py
+"""
+Пакетный прогон вопросов через /query/batch.
+
+    python -m api.batch_cli --api http://localhost:8000 --assistant dental \\
+        --email qa@example.com --password secret questions.txt --out answers.jsonl
+
+Вопросы — текстовый файл (один вопрос на строку) или JSONL с полем "query";
+"-" читает stdin. Ответы пишутся в NDJSON по мере готовности, в том же формате,
+что отдает API, с исходным порядком в поле "index". Большие файлы уходят
+пачками по --batch-size вопросов. Код выхода 1, если хотя бы один вопрос упал.
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Iterator, List, TextIO
+
+import httpx
+
+
+def read_queries(fh: TextIO) -> List[str]:
+    queries = []
+    for line in fh:
+        line = line.strip()
+        if not line:
+            continue
+        queries.append(json.loads(line)["query"] if line.startswith("{") else line)
+    return queries
+
+
+def login(client: httpx.Client, email: str, password: str) -> str:
+    response = client.post("/auth/login", data={"username": email, "password": password})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+def run_batch(client: httpx.Client, token: str, payload: dict) -> Iterator[dict]:
+    """Строки NDJSON ответа /query/batch по мере прихода."""
+    headers = {"Authorization": f"Bearer {token}"}
+    with client.stream("POST", "/query/batch", json=payload, headers=headers) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if line:
+                yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a file of questions through /query/batch")
+    parser.add_argument("questions", help="файл с вопросами (txt или jsonl), - для stdin")
+    parser.add_argument("--api", default=os.getenv("API_URL", "http://localhost:8000"))
+    parser.add_argument("--assistant", required=True)
+    parser.add_argument("--email", default=os.getenv("BATCH_USER_EMAIL"))
+    parser.add_argument("--password", default=os.getenv("BATCH_USER_PASSWORD"))
+    parser.add_argument("--batch-size", type=int, default=500, help="вопросов в одном запросе")
+    parser.add_argument("--concurrency", type=int, help="одновременных генераций (не больше лимита сервера)")
+    parser.add_argument("--use-history", action="store_true", help="читать и сохранять историю диалога")
+    parser.add_argument("--out", help="файл для ответов (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    if not args.email or not args.password:
+        parser.error("--email/--password (or BATCH_USER_EMAIL/BATCH_USER_PASSWORD) are required")
+    if args.questions == "-":
+        queries = read_queries(sys.stdin)
+    else:
+        with open(args.questions, encoding="utf-8") as fh:
+            queries = read_queries(fh)
+
+    out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+    errors = 0
+    # Генерация сотен ответов идет минутами: ждем без таймаута на чтение
+    with httpx.Client(base_url=args.api, timeout=httpx.Timeout(30.0, read=None)) as client:
+        token = login(client, args.email, args.password)
+        for offset in range(0, len(queries), args.batch_size):
+            payload = {
+                "assistant": args.assistant,
+                "queries": queries[offset:offset + args.batch_size],
+                "use_history": args.use_history,
+                "concurrency": args.concurrency,
+            }
+            for result in run_batch(client, token, payload):
+                if result.get("done"):
+                    errors += result["errors"]
+                    print(f"Batch {offset // args.batch_size + 1}: {result['count']} queries, "
+                          f"{result['errors']} errors, {result['total_ms'] / 1000:.1f}s", file=sys.stderr)
+                    continue
+                result["index"] += offset
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+    if out is not sys.stdout:
+        out.close()
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
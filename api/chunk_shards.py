@@ -0,0 +1,230 @@
+# api/chunk_shards.py
+import asyncio
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import Column, Integer, MetaData, String, Table, Text, bindparam, create_engine, insert, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .db import DOCUMENT_DELETED, DocumentChunk
+from .db_routing import CORPUS, DatabaseRouter, db_router
+
+# Чанки ассистентов в отдельных базах: "dental=postgresql://...,legal=postgresql://...".
+# Ассистенты без своей базы (и документы пользователей в них) хранятся в основной.
+CHUNK_SHARDS = os.getenv("CHUNK_SHARDS", "")
+# Сколько секунд кэшируется список документов ассистента для поиска по его шарду
+CHUNK_SHARDS_DOCUMENTS_TTL = float(os.getenv("CHUNK_SHARDS_DOCUMENTS_TTL", "1"))
+
+# Вектор чанка для модели вопроса. Во время миграции модели у части чанков он лежит
+# в теневой колонке embedding_next; чанки без вектора этой модели в поиск не попадают.
+_ACTIVE_VECTOR = "c.embedding"
+_EITHER_VECTOR = "(CASE WHEN c.embedding_model = :model THEN c.embedding ELSE c.embedding_next END)"
+_ACTIVE_FILTER = "c.embedding_model = :model"
+_EITHER_FILTER = ":model IN (c.embedding_model, c.embedding_next_model)"
+
+
+def _search_sql(sharded: bool, shadow: bool):
+    """
+    Поиск без ORM: только нужные колонки, без 1536-мерного embedding в ответе.
+    Ищем только в документах ассистента; чанки удаленных документов исключаются сразу,
+    до фоновой очистки. В шарде нет таблицы documents (и одна база может хранить
+    нескольких ассистентов), поэтому живые документы ассистента передаются списком id.
+    """
+    vector = _EITHER_VECTOR if shadow else _ACTIVE_VECTOR
+    where = [_EITHER_FILTER if shadow else _ACTIVE_FILTER]
+    if sharded:
+        source = "document_chunks c"
+        where.append("c.document_id = ANY(CAST(:documents AS INTEGER[]))")
+    else:
+        source = "document_chunks c JOIN documents d ON d.id = c.document_id"
+        where += ["d.assistant = :assistant", f"d.status <> '{DOCUMENT_DELETED}'"]
+    return text(
+        f"""
+        SELECT c.id, c.document_id, c.content, {vector} <=> :embedding AS distance
+        FROM {source}
+        WHERE {" AND ".join(where)}
+        ORDER BY {vector} <=> :embedding
+        LIMIT :top_k
+        """
+    ).bindparams(bindparam("embedding", type_=Vector(1536)))
+
+
+_SEARCH_SQL = {(sharded, shadow): _search_sql(sharded, shadow) for sharded in (False, True) for shadow in (False, True)}
+
+# Таблица чанков в шарде: та же, что в основной базе, но без внешнего ключа на documents
+shard_metadata = MetaData()
+shard_chunks = Table(
+    "document_chunks",
+    shard_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("document_id", Integer, nullable=False, index=True),
+    Column("content", Text),
+    Column("embedding", Vector(1536)),
+    Column("embedding_model", String),
+    Column("embedding_next", Vector(1536)),
+    Column("embedding_next_model", String),
+)
+
+
+class RetrievedChunk(NamedTuple):
+    chunk_id: int
+    document_id: int
+    content: str
+    distance: float  # косинусное расстояние: 0 — совпадение, 2 — противоположность
+
+
+class ChunkShards:
+    """
+    Шардирование document_chunks по ассистенту. Документы (метаданные, владельцы,
+    статусы) остаются в основной базе, в шард уходят только чанки с эмбеддингами.
+    Поиск идет по корпусу одного ассистента: в его шард или, если шарда нет,
+    в основную базу через реплики DatabaseRouter.
+    """
+
+    def __init__(
+        self,
+        shards: Optional[Dict[str, Engine]] = None,
+        router: DatabaseRouter = db_router,
+        documents_ttl: float = CHUNK_SHARDS_DOCUMENTS_TTL,
+    ):
+        self.shards = shards or {}
+        self.router = router
+        self.documents_ttl = documents_ttl
+        # assistant -> (когда прочитан, id живых документов)
+        self._documents: Dict[str, Tuple[float, List[int]]] = {}
+        self.failures = 0
+
+    @classmethod
+    def from_env(cls, spec: str = CHUNK_SHARDS) -> "ChunkShards":
+        engines: Dict[str, Engine] = {}
+        shards: Dict[str, Engine] = {}
+        for item in spec.split(","):
+            if not item.strip():
+                continue
+            assistant, url = item.split("=", 1)
+            # Несколько ассистентов в одной базе делят один пул соединений
+            url = url.strip()
+            if url not in engines:
+                engines[url] = create_engine(url, pool_pre_ping=True)
+            shards[assistant.strip()] = engines[url]
+        return cls(shards)
+
+    def engines(self) -> List[Engine]:
+        """Базы шардов без повторов (основная база сюда не входит)."""
+        return list({id(e): e for e in self.shards.values()}.values())
+
+    def engine_for(self, assistant: str) -> Optional[Engine]:
+        """База чанков ассистента; None — основная."""
+        return self.shards.get(assistant)
+
+    def ensure_schema(self) -> None:
+        for shard in self.engines():
+            with shard.begin() as connection:
+                connection.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+            shard_metadata.create_all(bind=shard)
+            with shard.begin() as connection:
+                for column, column_type in (
+                    ("embedding_model", "VARCHAR"), ("embedding_next", "vector(1536)"), ("embedding_next_model", "VARCHAR")
+                ):
+                    connection.execute(text(f"ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS {column} {column_type}"))
+
+    def count_chunks(self, db: Session, assistant: str, document_id: int) -> int:
+        shard = self.engine_for(assistant)
+        if shard is None:
+            return db.execute(
+                text("SELECT count(*) FROM document_chunks WHERE document_id = :id"), {"id": document_id}
+            ).scalar()
+        with shard.connect() as connection:
+            return connection.execute(
+                text("SELECT count(*) FROM document_chunks WHERE document_id = :id"), {"id": document_id}
+            ).scalar()
+
+    def write_chunks(self, db: Session, assistant: str, rows: List[dict]) -> None:
+        """
+        Пишет чанки документа. В основной базе — в сессию вызывающего (коммит вместе
+        со статусом документа), в шарде — сразу отдельной транзакцией.
+        """
+        if not rows:
+            return
+        shard = self.engine_for(assistant)
+        if shard is None:
+            db.execute(insert(DocumentChunk), rows)
+            return
+        with shard.begin() as connection:
+            connection.execute(insert(shard_chunks), rows)
+        self.forget_documents(assistant)
+
+    def delete_chunks(self, assistant: str, document_id: int) -> None:
+        """Чанки документа, удаленного во время загрузки: в шарде их не снимет ON DELETE CASCADE."""
+        shard = self.engine_for(assistant)
+        if shard is not None:
+            with shard.begin() as connection:
+                connection.execute(text("DELETE FROM document_chunks WHERE document_id = :id"), {"id": document_id})
+
+    def _assistant_documents(self, assistant: str) -> List[int]:
+        """Id неудаленных документов ассистента (кэш на documents_ttl секунд)."""
+        now = time.monotonic()
+        cached = self._documents.get(assistant)
+        if cached is None or now - cached[0] > self.documents_ttl:
+            with self.router.read_session(CORPUS) as session:
+                ids = list(session.execute(
+                    text("SELECT id FROM documents WHERE assistant = :assistant AND status <> :deleted"),
+                    {"assistant": assistant, "deleted": DOCUMENT_DELETED},
+                ).scalars())
+            cached = self._documents[assistant] = (now, ids)
+        return cached[1]
+
+    def forget_documents(self, assistant: Optional[str] = None) -> None:
+        """Следующий поиск перечитает список документов (после загрузки или удаления)."""
+        if assistant is None:
+            self._documents.clear()
+        else:
+            self._documents.pop(assistant, None)
+
+    def _search_primary(
+        self, assistant: str, embedding: List[float], top_k: int, model: str, shadow: bool
+    ) -> List[RetrievedChunk]:
+        with self.router.read_session(CORPUS) as session:
+            rows = session.execute(
+                _SEARCH_SQL[(False, shadow)],
+                {"embedding": embedding, "top_k": top_k, "model": model, "assistant": assistant},
+            ).all()
+        return [RetrievedChunk(*row) for row in rows]
+
+    def _search_shard(
+        self, shard: Engine, assistant: str, embedding: List[float], top_k: int, model: str, shadow: bool
+    ) -> List[RetrievedChunk]:
+        documents = self._assistant_documents(assistant)
+        if not documents:
+            return []
+        with shard.connect() as connection:
+            rows = connection.execute(
+                _SEARCH_SQL[(True, shadow)],
+                {"embedding": embedding, "top_k": top_k, "model": model, "documents": documents},
+            ).all()
+        return [RetrievedChunk(*row) for row in rows]
+
+    async def search(
+        self, assistant: str, embedding: List[float], top_k: int, model: str, shadow: bool = False
+    ) -> List[RetrievedChunk]:
+        """
+        Поиск по чанкам ассистента: в его шарде или в основной базе. shadow — идет
+        миграция модели, вектор чанка берется из той колонки, где лежит вектор модели вопроса.
+        """
+        shard = self.engine_for(assistant)
+        if shard is None:
+            return await asyncio.to_thread(self._search_primary, assistant, embedding, top_k, model, shadow)
+        try:
+            return await asyncio.to_thread(self._search_shard, shard, assistant, embedding, top_k, model, shadow)
+        except Exception:
+            self.failures += 1
+            raise
+
+    def stats(self) -> dict:
+        return {"shards": len(self.engines()), "assistants": sorted(self.shards), "failures": self.failures}
+
+
+chunk_shards = ChunkShards.from_env()
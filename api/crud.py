@@ -1,3 +1,6 @@
+import base64
+from typing import Optional, Tuple
+
 from sqlalchemy.orm import Session
 from . import db as models
 from . import schemas
@@ -17,3 +20,46 @@ def create_user(db: Session, user: schemas.UserCreate, hashed_password: str):
     db.commit()
     db.refresh(db_user)
     return db_user
+
+
+def encode_cursor(document_id: int) -> str:
+    return base64.urlsafe_b64encode(str(document_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Курсор непрозрачен для клиента; внутри — id последнего документа страницы."""
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return int(base64.urlsafe_b64decode(padded.encode()).decode())
+
+
+def list_documents(
+    db: Session,
+    user_id: int,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    assistant: Optional[str] = None,
+    status: Optional[str] = None,
+    prefix: Optional[str] = None,
+) -> Tuple[list, Optional[str]]:
+    """
+    Страница документов пользователя, новые первыми, и курсор следующей страницы.
+    Keyset по id вместо OFFSET: каждая страница — один проход по индексу (user_id, id).
+    """
+    Document = models.Document
+    query = db.query(
+        Document.id, Document.filename, Document.upload_date, Document.status,
+        Document.assistant, Document.chunk_count, Document.byte_size,
+    ).filter(Document.user_id == user_id, Document.status != models.DOCUMENT_DELETED)
+    if cursor:
+        query = query.filter(Document.id < decode_cursor(cursor))
+    if assistant:
+        query = query.filter(Document.assistant == assistant)
+    if status:
+        query = query.filter(Document.status == status)
+    if prefix:
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.filter(Document.filename.like(f"{escaped}%", escape="\\"))
+
+    rows = query.order_by(Document.id.desc()).limit(limit + 1).all()
+    next_cursor = encode_cursor(rows[limit - 1].id) if len(rows) > limit else None
+    return rows[:limit], next_cursor
@@ -1,4 +1,5 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, func, ForeignKey, JSON
+from sqlalchemy import create_engine, BigInteger, Column, Integer, String, Text, DateTime, func, ForeignKey, JSON, Identity, Index, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker, declarative_base, relationship
 from pgvector.sqlalchemy import Vector
 from datetime import datetime
@@ -17,6 +18,9 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# Удаленный документ: сразу исключается из поиска, строки чистит фоновая задача (api/document_purge.py)
+DOCUMENT_DELETED = "deleted"
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
@@ -32,21 +36,36 @@ class User(Base):
 class Document(Base):
     """Модель для хранения документов."""
     __tablename__ = 'documents'
+    # Список документов листается по ключу (user_id, id); поиск по префиксу имени — по второму индексу
+    __table_args__ = (
+        Index("ix_documents_owner", "user_id", "id"),
+        Index("ix_documents_owner_filename", "user_id", "filename", postgresql_ops={"filename": "text_pattern_ops"}),
+    )
     id = Column(Integer, primary_key=True)
     filename = Column(String, index=True)
     upload_date = Column(DateTime, default=datetime.utcnow)
     status = Column(String, default="uploaded")
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    assistant = Column(String, nullable=False, server_default="general")
+    # Счетчики пишутся при загрузке, чтобы список не считал чанки запросом на каждый документ
+    chunk_count = Column(Integer, nullable=False, server_default="0")
+    byte_size = Column(BigInteger, nullable=False, server_default="0")
     owner = relationship("User", back_populates="documents")
-    chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
+    # Чанки удаляет сама база (ON DELETE CASCADE): ORM не загружает их ради удаления
+    chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan", passive_deletes=True)
 
 class DocumentChunk(Base):
     """Модель для хранения чанков документов в БД."""
     __tablename__ = 'document_chunks'
     id = Column(Integer, primary_key=True)
-    document_id = Column(Integer, ForeignKey('documents.id'))
+    document_id = Column(Integer, ForeignKey('documents.id', ondelete="CASCADE"), index=True)
     content = Column(Text)
     embedding = Column(Vector(1536))
+    # Какой моделью посчитан embedding: поиск сравнивает вопрос только с векторами той же модели
+    embedding_model = Column(String)
+    # Теневая колонка миграции на новую модель (api/embedding_migration.py)
+    embedding_next = Column(Vector(1536))
+    embedding_next_model = Column(String)
     document = relationship("Document", back_populates="chunks")
 
 def get_db():
@@ -58,25 +77,121 @@ def get_db():
 
 
 class Message(Base):
-    """Модель для хранения истории сообщений."""
+    """
+    Модель для хранения истории сообщений.
+    В Postgres таблица секционирована по месяцам created_at (см. api/partitions.py),
+    поэтому created_at входит в первичный ключ.
+    """
     __tablename__ = 'messages'
-    id = Column(Integer, primary_key=True, autoincrement=True)
+    # Диалог — пара (user_id, assistant); история читается по индексу с конца
+    __table_args__ = (
+        Index("ix_messages_conversation", "user_id", "assistant", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
+    id = Column(Integer, Identity(), primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    assistant = Column(String, nullable=False, server_default="general")
     role = Column(String)  # 'user' or 'assistant'
     content = Column(Text)
-    created_at = Column(DateTime, default=func.now())
+    created_at = Column(DateTime, primary_key=True, default=func.now())
     user = relationship("User", back_populates="messages")
 
 
-def save_message(session, chat_id, role, content):
+class ConversationSummary(Base):
+    """
+    Сводка диалога отдельно от сообщений: суммаризация не удаляет строки,
+    а история читает только сообщения новее summarized_until.
+    """
+    __tablename__ = 'conversation_summaries'
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    assistant = Column(String, primary_key=True)
+    content = Column(Text, nullable=False)
+    summarized_until = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+
+class EmbeddingState(Base):
+    """
+    Одна строка: активная модель эмбеддингов и ход миграции на target_model.
+    Переключение модели — обновление этой строки, все реплики API видят его сразу.
+    """
+    __tablename__ = 'embedding_state'
+    id = Column(Integer, primary_key=True, default=1)
+    active_model = Column(String, nullable=False)
+    target_model = Column(String, nullable=True)
+    phase = Column(String, nullable=False, default="idle")
+    total = Column(Integer, nullable=False, default=0)
+    done = Column(Integer, nullable=False, default=0)
+    started_at = Column(DateTime, nullable=True)
+    switched_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+
+def ensure_schema(connection):
+    """Идемпотентно добавляет в существующую базу то, что create_all не меняет в готовых таблицах."""
+    connection.execute(text("ALTER TABLE messages ADD COLUMN IF NOT EXISTS assistant VARCHAR NOT NULL DEFAULT 'general'"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_messages_conversation ON messages (user_id, assistant, created_at)"
+    ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_document_chunks_document_id ON document_chunks (document_id)"
+    ))
+    for column, column_type in (("embedding_model", "VARCHAR"), ("embedding_next", "vector(1536)"), ("embedding_next_model", "VARCHAR")):
+        connection.execute(text(f"ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS {column} {column_type}"))
+    has_counters = connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'documents' AND column_name = 'chunk_count')"
+    )).scalar()
+    if not has_counters:
+        connection.execute(text("ALTER TABLE documents ADD COLUMN IF NOT EXISTS assistant VARCHAR NOT NULL DEFAULT 'general'"))
+        connection.execute(text("ALTER TABLE documents ADD COLUMN chunk_count INTEGER NOT NULL DEFAULT 0"))
+        connection.execute(text("ALTER TABLE documents ADD COLUMN byte_size BIGINT NOT NULL DEFAULT 0"))
+        # Однократное заполнение одним агрегатом; размер старых документов — по тексту их чанков
+        connection.execute(text(
+            "UPDATE documents d SET chunk_count = s.chunks, byte_size = s.bytes "
+            "FROM (SELECT document_id, count(*) AS chunks, sum(octet_length(content)) AS bytes "
+            "FROM document_chunks GROUP BY document_id) s WHERE d.id = s.document_id"
+        ))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_documents_owner ON documents (user_id, id)"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_documents_owner_filename ON documents (user_id, filename text_pattern_ops)"
+    ))
+    # Внешний ключ из старых баз (без каскада) пересоздается один раз
+    on_delete = connection.execute(text(
+        "SELECT confdeltype FROM pg_constraint WHERE conname = 'document_chunks_document_id_fkey'"
+    )).scalar()
+    if on_delete != "c":
+        connection.execute(text("ALTER TABLE document_chunks DROP CONSTRAINT IF EXISTS document_chunks_document_id_fkey"))
+        connection.execute(text(
+            "ALTER TABLE document_chunks ADD CONSTRAINT document_chunks_document_id_fkey "
+            "FOREIGN KEY (document_id) REFERENCES documents (id) ON DELETE CASCADE"
+        ))
+
+
+def get_or_create_telegram_user(session, telegram_id) -> "User":
+    """Пользователь по telegram_id; создается при первом обращении."""
+    user = session.query(User).filter(User.telegram_id == str(telegram_id)).first()
+    if not user:
+        user = User(telegram_id=str(telegram_id))
+        session.add(user)
+        try:
+            session.commit()
+        except IntegrityError:
+            # Параллельный запрос успел создать того же пользователя
+            session.rollback()
+            return session.query(User).filter(User.telegram_id == str(telegram_id)).one()
+        session.refresh(user)
+    return user
+
+
+def save_message(session, chat_id, role, content, assistant="general"):
     """Находит пользователя по telegram_id, создает его при необходимости и сохраняет сообщение."""
     user = session.query(User).filter(User.telegram_id == str(chat_id)).first()
     if not user:
         user = User(telegram_id=str(chat_id))
         session.add(user)
-        session.commit()
-        session.refresh(user)
+        session.flush()  # получаем user.id без отдельного коммита
 
-    msg = Message(user_id=user.id, role=role, content=content)
+    msg = Message(user_id=user.id, assistant=assistant, role=role, content=content)
     session.add(msg)
     session.commit()
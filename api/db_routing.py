@@ -0,0 +1,181 @@
+# api/db_routing.py
+import asyncio
+import itertools
+import os
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from loguru import logger
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from .db import SessionLocal, engine
+
+# Реплики для чтения (поиск, история) через запятую; пусто — все читается с основной базы
+DB_REPLICA_URLS = os.getenv("DB_REPLICA_URLS", "")
+# Реплика, отставшая больше чем на столько секунд, не получает запросов
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+# Как часто опрашивать позицию WAL основной базы и реплик, сек
+DB_REPLICA_POLL_INTERVAL = float(os.getenv("DB_REPLICA_POLL_INTERVAL", "0.5"))
+# Сколько помнить позицию последней записи ключа: позже ее догоняет любая живая реплика
+DB_WRITE_MEMORY = float(os.getenv("DB_WRITE_MEMORY", "60"))
+
+# Ключ read-your-writes для документов и чанков (поиск идет по всему корпусу)
+CORPUS = ("corpus",)
+# Позиция, которую не догонит ни одна реплика: если LSN записи узнать не удалось, читаем с основной
+_UNKNOWN_LSN = 1 << 64
+
+
+def history_key(user_id, assistant: str) -> Tuple:
+    return ("history", user_id, assistant)
+
+
+def parse_lsn(value: Optional[str]) -> int:
+    """pg_lsn вида '16/B374D848' -> число, чтобы позиции можно было сравнивать."""
+    if not value:
+        return 0
+    high, low = str(value).split("/")
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+class Replica:
+    """Реплика и ее последнее известное состояние (обновляется DatabaseRouter.poll)."""
+
+    def __init__(self, name: str, replica_engine: Engine):
+        self.name = name
+        self.engine = replica_engine
+        self.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+        self.replay_lsn = 0
+        self.lag = float("inf")
+        self.healthy = False
+        self.reads = 0
+
+
+class DatabaseRouter:
+    """
+    Направляет чтения на реплики, записи всегда идут в основную базу.
+
+    Read-your-writes: после записи note_write() запоминает позицию WAL основной базы
+    (pg_current_wal_lsn) для ключа — диалога или корпуса документов. Чтение по ключу
+    уходит только на реплику, которая уже проиграла эту позицию и отстает не больше
+    max_lag; если такой нет, читаем с основной. Состояние реплик опрашивается в фоне
+    (monitor), поэтому выбор реплики не стоит лишнего запроса.
+    """
+
+    def __init__(
+        self,
+        primary_engine: Engine = engine,
+        primary_session_factory: Callable[[], Session] = SessionLocal,
+        replicas: Optional[List[Replica]] = None,
+        max_lag: float = DB_REPLICA_MAX_LAG,
+        write_memory: float = DB_WRITE_MEMORY,
+    ):
+        self.primary_engine = primary_engine
+        self.primary_session_factory = primary_session_factory
+        self.replicas = replicas or []
+        self.max_lag = max_lag
+        self.write_memory = write_memory
+        self.primary_lsn = 0
+        self.primary_reads = 0
+        # ключ -> (LSN записи, время записи)
+        self._writes: Dict[Hashable, Tuple[int, float]] = {}
+        self._next = itertools.count()
+
+    @classmethod
+    def from_env(cls, urls: str = DB_REPLICA_URLS) -> "DatabaseRouter":
+        replicas = [
+            Replica(f"replica{i}", create_engine(url.strip(), pool_pre_ping=True))
+            for i, url in enumerate(urls.split(","))
+            if url.strip()
+        ]
+        return cls(replicas=replicas)
+
+    def note_write(self, session, *keys: Hashable) -> None:
+        """Вызывается после commit записи: чтения этих ключей не уйдут на отстающую реплику."""
+        if not self.replicas or not keys:
+            return
+        try:
+            lsn = parse_lsn(session.execute(text("SELECT pg_current_wal_lsn()")).scalar())
+        except Exception as e:
+            logger.warning(f"Failed to read WAL position, reads stay on primary: {e}")
+            lsn = _UNKNOWN_LSN
+        now = time.monotonic()
+        for key in keys:
+            self._writes[key] = (lsn, now)
+        if len(self._writes) > 10000:
+            self._forget(now)
+
+    def _forget(self, now: float) -> None:
+        expired = [key for key, (_, at) in self._writes.items() if now - at > self.write_memory]
+        for key in expired:
+            del self._writes[key]
+
+    def required_lsn(self, key: Optional[Hashable]) -> int:
+        entry = self._writes.get(key) if key is not None else None
+        if entry is None or time.monotonic() - entry[1] > self.write_memory:
+            return 0
+        return entry[0]
+
+    def pick_replica(self, key: Optional[Hashable] = None) -> Optional[Replica]:
+        """Свежая реплика для чтения ключа (по кругу) или None — читать с основной."""
+        if not self.replicas:
+            return None
+        needed = self.required_lsn(key)
+        eligible = [
+            replica for replica in self.replicas
+            if replica.healthy and replica.lag <= self.max_lag and replica.replay_lsn >= needed
+        ]
+        if not eligible:
+            return None
+        return eligible[next(self._next) % len(eligible)]
+
+    def read_session(self, key: Optional[Hashable] = None) -> Session:
+        replica = self.pick_replica(key)
+        if replica is None:
+            self.primary_reads += 1
+            return self.primary_session_factory()
+        replica.reads += 1
+        return replica.session_factory()
+
+    def poll(self) -> None:
+        """Позиция WAL основной базы и реплик. Реплика, догнавшая основную, считается без отставания."""
+        with self.primary_engine.connect() as connection:
+            self.primary_lsn = parse_lsn(connection.execute(text("SELECT pg_current_wal_lsn()")).scalar())
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as connection:
+                    lsn, lag = connection.execute(text(
+                        "SELECT pg_last_wal_replay_lsn(), "
+                        "EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())"
+                    )).one()
+            except Exception as e:
+                if replica.healthy:
+                    logger.warning(f"Replica {replica.name} is unavailable: {e}")
+                replica.healthy = False
+                continue
+            replica.replay_lsn = parse_lsn(lsn)
+            # Без новых транзакций на основной replay_timestamp стареет, хотя реплика не отстает
+            replica.lag = 0.0 if replica.replay_lsn >= self.primary_lsn else float(lag or 0.0)
+            replica.healthy = lsn is not None
+
+    async def monitor(self, interval: float = DB_REPLICA_POLL_INTERVAL) -> None:
+        """Фоновый опрос реплик, пока работает API."""
+        while True:
+            try:
+                await asyncio.to_thread(self.poll)
+            except Exception:
+                logger.exception("Replica poll failed.")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict:
+        return {
+            "primary_reads": self.primary_reads,
+            "replicas": [
+                {"name": r.name, "healthy": r.healthy, "lag": round(r.lag, 3) if r.healthy else None, "reads": r.reads}
+                for r in self.replicas
+            ],
+        }
+
+
+db_router = DatabaseRouter.from_env()
@@ -0,0 +1,120 @@
+# api/document_purge.py
+import asyncio
+import os
+from typing import Optional, Sequence, Tuple
+
+from loguru import logger
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Connection, Engine
+
+from .db import DOCUMENT_DELETED
+
+# Чанки удаленных документов удаляются пачками: короткие транзакции без долгих блокировок
+DOCUMENT_PURGE_BATCH = int(os.getenv("DOCUMENT_PURGE_BATCH", "5000"))
+# Страховочный проход по расписанию (например, для документов, удаленных перед перезапуском)
+DOCUMENT_PURGE_INTERVAL = float(os.getenv("DOCUMENT_PURGE_INTERVAL", "600"))
+# Если удалено столько чанков или больше — VACUUM (ANALYZE), иначе достаточно ANALYZE
+DOCUMENT_VACUUM_MIN_ROWS = int(os.getenv("DOCUMENT_VACUUM_MIN_ROWS", "1000"))
+
+_wakeup: Optional[asyncio.Event] = None
+
+_DELETE_DOCUMENTS_SQL = text("DELETE FROM documents WHERE status = :deleted")
+_DELETE_LISTED_DOCUMENTS_SQL = text(
+    "DELETE FROM documents WHERE status = :deleted AND id IN :ids"
+).bindparams(bindparam("ids", expanding=True))
+
+
+def purge_chunks_batch(connection: Connection, batch_size: int = DOCUMENT_PURGE_BATCH) -> int:
+    """Одним DELETE удаляет до batch_size чанков удаленных документов, возвращает число строк."""
+    result = connection.execute(text(
+        "DELETE FROM document_chunks WHERE id IN ("
+        "SELECT c.id FROM document_chunks c JOIN documents d ON d.id = c.document_id "
+        "WHERE d.status = :deleted LIMIT :batch)"
+    ), {"deleted": DOCUMENT_DELETED, "batch": batch_size})
+    return result.rowcount
+
+
+def purge_shard_batch(connection: Connection, document_ids: Sequence[int], batch_size: int = DOCUMENT_PURGE_BATCH) -> int:
+    """То же для шарда чанков: таблицы documents там нет, удаленные документы передаются списком."""
+    result = connection.execute(text(
+        "DELETE FROM document_chunks WHERE id IN ("
+        "SELECT id FROM document_chunks WHERE document_id = ANY(CAST(:ids AS INTEGER[])) LIMIT :batch)"
+    ), {"ids": list(document_ids), "batch": batch_size})
+    return result.rowcount
+
+
+def purge_deleted(
+    engine: Engine, batch_size: int = DOCUMENT_PURGE_BATCH, shards: Sequence[Engine] = ()
+) -> Tuple[int, int]:
+    """Удаляет чанки пачками (сначала в шардах), затем сами документы. Возвращает (документов, чанков)."""
+    chunks = 0
+    deleted = None
+    if shards:
+        # Документы удаляются только после шардов: иначе потерялся бы список, чьи чанки чистить
+        with engine.connect() as connection:
+            deleted = list(connection.execute(
+                text("SELECT id FROM documents WHERE status = :deleted"), {"deleted": DOCUMENT_DELETED}
+            ).scalars())
+        for shard in shards if deleted else ():
+            while True:
+                with shard.begin() as connection:
+                    removed = purge_shard_batch(connection, deleted, batch_size)
+                chunks += removed
+                if removed < batch_size:
+                    break
+    while True:
+        with engine.begin() as connection:
+            removed = purge_chunks_batch(connection, batch_size)
+        chunks += removed
+        if removed < batch_size:
+            break
+    with engine.begin() as connection:
+        # Чанки, дописанные после последней пачки, снимет ON DELETE CASCADE. С шардами удаляем
+        # только прочитанные выше документы: удаленные во время прохода ждут следующего,
+        # иначе их чанки в шардах остались бы без строки documents и вернулись бы в поиск.
+        if deleted is None:
+            documents = connection.execute(_DELETE_DOCUMENTS_SQL, {"deleted": DOCUMENT_DELETED}).rowcount
+        else:
+            documents = connection.execute(
+                _DELETE_LISTED_DOCUMENTS_SQL, {"deleted": DOCUMENT_DELETED, "ids": deleted}
+            ).rowcount
+    return documents, chunks
+
+
+def maintain_index(engine: Engine, removed_chunks: int, vacuum_min_rows: int = DOCUMENT_VACUUM_MIN_ROWS) -> None:
+    """После крупного удаления освобождает место в таблице и индексах и обновляет статистику планировщика."""
+    statement = "VACUUM (ANALYZE) document_chunks" if removed_chunks >= vacuum_min_rows else "ANALYZE document_chunks"
+    # VACUUM нельзя выполнять внутри транзакции
+    with engine.connect() as connection:
+        connection.execution_options(isolation_level="AUTOCOMMIT").execute(text(statement))
+
+
+def purge(engine: Engine, shards: Sequence[Engine] = ()) -> None:
+    documents, chunks = purge_deleted(engine, shards=shards)
+    if documents or chunks:
+        logger.info(f"Purged {documents} deleted documents and {chunks} chunks.")
+        for database in (engine, *shards):
+            maintain_index(database, chunks)
+
+
+def request_purge() -> None:
+    """Будит фоновую задачу сразу после удаления документа."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def run_purge(engine: Engine, interval: float = DOCUMENT_PURGE_INTERVAL, shards: Sequence[Engine] = ()) -> None:
+    """Фоновая очистка удаленных документов, пока работает API."""
+    global _wakeup
+    _wakeup = asyncio.Event()
+    while True:
+        # Сбрасываем до прохода: удаление во время прохода запустит следующий
+        _wakeup.clear()
+        try:
+            await asyncio.to_thread(purge, engine, shards)
+        except Exception:
+            logger.exception("Document purge failed.")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=interval)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,322 @@
+# api/embedding_migration.py
+import asyncio
+import os
+import time
+from datetime import datetime
+from typing import Callable, List, Optional, Sequence
+
+from loguru import logger
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import bindparam, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from .chunk_shards import chunk_shards
+from .db import EmbeddingState, engine
+from .document_purge import maintain_index
+from .openai_scheduler import BACKGROUND, scheduling
+from .retriever import (
+    EMBEDDING_DIMENSIONS,
+    EMBEDDING_MODEL,
+    EMBEDDING_STATE_POLL,
+    embedding_models,
+    get_openai_embeddings,
+)
+
+# Чанков в одной пачке переэмбеддинга (один запрос к OpenAI и один UPDATE)
+EMBEDDING_MIGRATION_BATCH = int(os.getenv("EMBEDDING_MIGRATION_BATCH", "256"))
+# Не больше стольких чанков в секунду: миграция не съедает бюджет OpenAI и ввод-вывод базы
+EMBEDDING_MIGRATION_RATE = float(os.getenv("EMBEDDING_MIGRATION_RATE", "200"))
+# Пауза после переключения: все экземпляры API успевают перечитать активную модель
+EMBEDDING_MIGRATION_GRACE = float(os.getenv("EMBEDDING_MIGRATION_GRACE", str(EMBEDDING_STATE_POLL * 3)))
+# Как часто писать ход миграции в лог, сек
+EMBEDDING_MIGRATION_LOG_INTERVAL = float(os.getenv("EMBEDDING_MIGRATION_LOG_INTERVAL", "10"))
+
+# Ключ advisory lock: миграцию выполняет один экземпляр API
+_LOCK_KEY = 0x656D6264
+
+_PENDING_SQL = text(
+    "SELECT id, content FROM document_chunks "
+    "WHERE embedding_model IS DISTINCT FROM :target AND embedding_next_model IS DISTINCT FROM :target "
+    "ORDER BY id LIMIT :batch"
+)
+_COUNT_PENDING_SQL = text(
+    "SELECT count(*) FROM document_chunks "
+    "WHERE embedding_model IS DISTINCT FROM :target AND embedding_next_model IS DISTINCT FROM :target"
+)
+_WRITE_SHADOW_SQL = text(
+    "UPDATE document_chunks SET embedding_next = :embedding, embedding_next_model = :model WHERE id = :id"
+).bindparams(bindparam("embedding", type_=Vector(EMBEDDING_DIMENSIONS)))
+# Обмен колонками одним UPDATE: правая часть SET читает строку до изменения.
+# Старые векторы остаются в теневой колонке для запросов, посчитанных старой моделью.
+_PROMOTE_SQL = text(
+    "UPDATE document_chunks SET embedding = embedding_next, embedding_model = embedding_next_model, "
+    "embedding_next = embedding, embedding_next_model = embedding_model "
+    "WHERE id IN (SELECT id FROM document_chunks "
+    "WHERE embedding_next_model = :active AND embedding_model IS DISTINCT FROM :active LIMIT :batch)"
+)
+_CLEANUP_SQL = text(
+    "UPDATE document_chunks SET embedding_next = NULL, embedding_next_model = NULL "
+    "WHERE id IN (SELECT id FROM document_chunks WHERE embedding_next_model IS NOT NULL LIMIT :batch)"
+)
+
+
+def ensure_embedding_state(engine: Engine, shards: Sequence[Engine] = (), configured_model: str = EMBEDDING_MODEL) -> None:
+    """
+    При старте: создает строку embedding_state, подписывает моделью чанки без нее
+    (записанные до этой колонки — считаем, что активной моделью) и, если в окружении
+    указана другая модель, начинает миграцию на нее. Поиск остается на старой модели.
+    """
+    with Session(engine) as session:
+        state = session.get(EmbeddingState, 1)
+        if state is None:
+            state = EmbeddingState(id=1, active_model=configured_model, phase="idle", total=0, done=0)
+            session.add(state)
+            session.commit()
+        for database in (engine, *shards):
+            with database.begin() as connection:
+                connection.execute(
+                    text("UPDATE document_chunks SET embedding_model = :model "
+                         "WHERE embedding_model IS NULL AND embedding IS NOT NULL"),
+                    {"model": state.active_model},
+                )
+        if state.target_model is None and configured_model != state.active_model:
+            logger.warning(
+                f"Embedding model changed from {state.active_model} to {configured_model}: "
+                f"search keeps {state.active_model} until all chunks are re-embedded."
+            )
+            state.target_model = configured_model
+            state.phase = "reembedding"
+            state.total = state.done = 0
+            state.started_at = datetime.utcnow()
+            state.switched_at = None
+            session.commit()
+        elif state.target_model is None and _has_foreign_vectors((engine, *shards), state.active_model):
+            # Например, чанки, дописанные старой моделью после прошлой миграции: дотягиваем до активной
+            logger.warning(f"Some chunks have no {state.active_model} vectors, re-embedding them.")
+            state.target_model = state.active_model
+            state.phase = "promoting"
+            state.total = state.done = 0
+            state.started_at = datetime.utcnow()
+            session.commit()
+        elif state.target_model is not None and configured_model != state.target_model:
+            logger.warning(
+                f"Embedding migration to {state.target_model} is in progress; "
+                f"OPENAI_EMBEDDING_MODEL={configured_model} is ignored until it finishes."
+            )
+        embedding_models.refresh(session)
+
+
+def _has_foreign_vectors(databases: Sequence[Engine], model: str) -> bool:
+    for database in databases:
+        with database.connect() as connection:
+            if connection.execute(
+                text("SELECT 1 FROM document_chunks WHERE embedding_model IS DISTINCT FROM :model LIMIT 1"),
+                {"model": model},
+            ).first():
+                return True
+    return False
+
+
+class EmbeddingMigration:
+    """
+    Переэмбеддинг корпуса новой моделью без простоя.
+
+    1. reembedding: чанки пачками эмбеддятся моделью target_model в теневую колонку
+       embedding_next (в основной базе и шардах), не быстрее rate чанков в секунду.
+       Прогресс хранится в самих строках, поэтому после перезапуска задача продолжает.
+    2. Когда у всех чанков есть вектор новой модели, одна строка embedding_state
+       переключает активную модель: новые вопросы эмбеддятся ею, поиск берет вектор
+       из той колонки, где лежит вектор модели вопроса.
+    3. promoting: дописываются чанки, записанные старой моделью до переключения,
+       затем колонки меняются местами; теневая колонка очищается в конце.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        shards: Sequence[Engine] = (),
+        batch_size: int = EMBEDDING_MIGRATION_BATCH,
+        rate: float = EMBEDDING_MIGRATION_RATE,
+        grace: float = EMBEDDING_MIGRATION_GRACE,
+        embed: Callable = get_openai_embeddings,
+    ):
+        self.engine = engine
+        self.databases = [engine, *shards]
+        self.batch_size = batch_size
+        self.rate = rate
+        self.grace = grace
+        self.embed = embed
+        self.total = 0
+        self.done = 0
+        self._run_started: Optional[float] = None
+        self._run_done = 0
+        self._logged_at = 0.0
+        self.running = False
+
+    def _state(self) -> Optional[EmbeddingState]:
+        with Session(self.engine, expire_on_commit=False) as session:
+            return session.get(EmbeddingState, 1)
+
+    def _update_state(self, **values) -> None:
+        with Session(self.engine) as session:
+            session.query(EmbeddingState).filter(EmbeddingState.id == 1).update(values, synchronize_session=False)
+            session.commit()
+
+    def count_pending(self, target: str) -> int:
+        total = 0
+        for database in self.databases:
+            with database.connect() as connection:
+                total += connection.execute(_COUNT_PENDING_SQL, {"target": target}).scalar()
+        return total
+
+    def _fetch(self, database: Engine, target: str) -> List[tuple]:
+        with database.connect() as connection:
+            return connection.execute(_PENDING_SQL, {"target": target, "batch": self.batch_size}).all()
+
+    def _write(self, database: Engine, target: str, rows: List[tuple], vectors: List[List[float]]) -> None:
+        with database.begin() as connection:
+            connection.execute(
+                _WRITE_SHADOW_SQL,
+                [{"id": row[0], "embedding": vector, "model": target} for row, vector in zip(rows, vectors)],
+            )
+
+    async def reembed(self, target: str) -> int:
+        """Эмбеддит моделью target все чанки, у которых еще нет ее вектора. Возвращает число чанков."""
+        processed = 0
+        for database in self.databases:
+            while True:
+                rows = await asyncio.to_thread(self._fetch, database, target)
+                if not rows:
+                    break
+                with scheduling(BACKGROUND):
+                    vectors = await self.embed([row[1] or "" for row in rows], target)
+                if vectors and len(vectors[0]) != EMBEDDING_DIMENSIONS:
+                    raise ValueError(
+                        f"{target} returns {len(vectors[0])}-dimensional vectors, "
+                        f"the embedding column holds {EMBEDDING_DIMENSIONS}"
+                    )
+                await asyncio.to_thread(self._write, database, target, rows, vectors)
+                processed += len(rows)
+                self.done += len(rows)
+                self._run_done += len(rows)
+                await asyncio.to_thread(self._update_state, done=self.done, total=max(self.total, self.done))
+                self._log_progress(target)
+                await self._throttle()
+        return processed
+
+    async def _throttle(self) -> None:
+        if self.rate <= 0 or self._run_started is None:
+            return
+        ahead = self._run_done / self.rate - (time.monotonic() - self._run_started)
+        if ahead > 0:
+            await asyncio.sleep(ahead)
+
+    def _log_progress(self, target: str) -> None:
+        now = time.monotonic()
+        if now - self._logged_at < EMBEDDING_MIGRATION_LOG_INTERVAL:
+            return
+        self._logged_at = now
+        progress = self.progress()
+        eta = progress["eta_s"]
+        logger.info(
+            "Re-embedding with {target}: {done}/{total} chunks, {rate} chunks/s, ETA {eta}",
+            target=target, done=self.done, total=self.total, rate=progress["chunks_per_s"],
+            eta=f"{eta:.0f}s" if eta is not None else "unknown",
+        )
+
+    def _promote(self, active: str) -> int:
+        return self._batched(_PROMOTE_SQL, {"active": active})
+
+    def _cleanup(self) -> int:
+        return self._batched(_CLEANUP_SQL, {})
+
+    def _batched(self, statement, params: dict) -> int:
+        total = 0
+        for database in self.databases:
+            while True:
+                with database.begin() as connection:
+                    changed = connection.execute(statement, {**params, "batch": self.batch_size}).rowcount
+                total += changed
+                if changed < self.batch_size:
+                    break
+        return total
+
+    async def run(self) -> None:
+        """Доводит начатую миграцию до конца; без миграции ничего не делает."""
+        state = await asyncio.to_thread(self._state)
+        if state is None or state.target_model is None:
+            return
+        lock = await asyncio.to_thread(self.engine.connect)
+        try:
+            acquired = await asyncio.to_thread(
+                lambda: lock.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": _LOCK_KEY}).scalar()
+            )
+            if not acquired:
+                logger.info("Embedding migration is running on another instance.")
+                return
+            self.running = True
+            try:
+                await self._migrate(state)
+            finally:
+                self.running = False
+                # Блокировка сеансовая: соединение вернется в пул, поэтому снимаем явно
+                await asyncio.to_thread(
+                    lambda: lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _LOCK_KEY})
+                )
+        finally:
+            await asyncio.to_thread(lock.close)
+
+    async def _migrate(self, state: EmbeddingState) -> None:
+        target = state.target_model
+        self.done = state.done
+        self.total = self.done + await asyncio.to_thread(self.count_pending, target)
+        self._run_started, self._run_done = time.monotonic(), 0
+        logger.info(f"Embedding migration {state.active_model} -> {target}: {self.total - self.done} chunks left.")
+
+        if state.active_model != target:
+            await self.reembed(target)
+            # Переключение — одна строка: все экземпляры API видят его при следующем опросе
+            await asyncio.to_thread(
+                self._update_state, active_model=target, phase="promoting", switched_at=datetime.utcnow()
+            )
+            embedding_models.active = target
+            logger.info(f"Switched search to {target}.")
+            # Пока кто-то ищет старой моделью без теневой колонки, колонки не меняем
+            await asyncio.sleep(self.grace)
+
+        # Чанки, записанные старой моделью до того, как экземпляры увидели переключение
+        await self.reembed(target)
+        promoted = await asyncio.to_thread(self._promote, target)
+        await asyncio.to_thread(self._update_state, target_model=None, phase="idle")
+        embedding_models.migrating = False
+        # Запросы, посчитанные старой моделью до переключения, еще могут читать теневую колонку
+        await asyncio.sleep(self.grace)
+        cleared = await asyncio.to_thread(self._cleanup)
+        for database in self.databases:
+            await asyncio.to_thread(maintain_index, database, cleared)
+        elapsed = time.monotonic() - self._run_started
+        logger.info(f"Embedding migration to {target} finished: {promoted} chunks promoted in {elapsed:.0f}s.")
+
+    def progress(self) -> dict:
+        """Ход текущего прогона: скорость в чанках в секунду и оценка оставшегося времени."""
+        elapsed = time.monotonic() - self._run_started if self._run_started is not None else 0.0
+        rate = self._run_done / elapsed if elapsed > 0 else 0.0
+        left = max(self.total - self.done, 0)
+        return {
+            "done": self.done,
+            "total": self.total,
+            "chunks_per_s": round(rate, 1),
+            "eta_s": round(left / rate, 1) if rate > 0 else None,
+        }
+
+
+async def run_embedding_migration(migration: EmbeddingMigration) -> None:
+    try:
+        await migration.run()
+    except Exception:
+        # Прогресс в строках: следующий запуск API продолжит с того же места
+        logger.exception("Embedding migration failed, search stays on the active model.")
+
+
+embedding_migration = EmbeddingMigration(engine, chunk_shards.engines())
@@ -0,0 +1,52 @@
+# api/history_cache.py
+import os
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, List, Optional, Tuple
+
+# Сколько диалогов держать в памяти; простаивающие дольше всех вытесняются первыми
+HISTORY_CACHE_CONVERSATIONS = int(os.getenv("HISTORY_CACHE_CONVERSATIONS", "10000"))
+
+
+class HistoryCache:
+    """
+    Окно последних turns сообщений каждого диалога (user_id, assistant).
+
+    Окно — кольцевой буфер: новое сообщение вытесняет самое старое, а сводка
+    диалога закреплена перед окном и не вытесняется. Диалоги хранятся в LRU,
+    так что память ограничена max_conversations окнами.
+    append() обновляет только уже загруженные окна: неполное окно хуже промаха.
+    """
+
+    def __init__(self, turns: int, max_conversations: int = HISTORY_CACHE_CONVERSATIONS):
+        self.turns = turns
+        self.max_conversations = max_conversations
+        self._windows: "OrderedDict[Hashable, Tuple[Optional[Dict[str, str]], Deque[Dict[str, str]]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[List[Dict[str, str]]]:
+        entry = self._windows.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._windows.move_to_end(key)
+        self.hits += 1
+        summary, window = entry
+        return ([summary] if summary else []) + list(window)
+
+    def put(self, key: Hashable, history: List[Dict[str, str]], summary: Optional[Dict[str, str]] = None) -> None:
+        self._windows[key] = (summary, deque(history, maxlen=self.turns))
+        self._windows.move_to_end(key)
+        while len(self._windows) > self.max_conversations:
+            self._windows.popitem(last=False)
+
+    def append(self, key: Hashable, role: str, content: str) -> None:
+        entry = self._windows.get(key)
+        if entry is not None:
+            entry[1].append({"role": role, "content": content})
+
+    def invalidate(self, key: Hashable) -> None:
+        self._windows.pop(key, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"conversations": len(self._windows), "hits": self.hits, "misses": self.misses}
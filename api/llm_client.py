@@ -1,20 +1,42 @@
 # api/llm_client.py
 import os
-from openai import AsyncOpenAI
 from loguru import logger
 from typing import Optional, Dict, Any, List
 
-# Инициализируем асинхронный клиент OpenAI
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+from .llm_gateway import AllProvidersFailed, LLMGateway
+from .logging_setup import redact_messages
+
+# Сколько символов найденного контекста показать, если LLM недоступна
+RETRIEVAL_ONLY_MAX_CHARS = int(os.getenv("RETRIEVAL_ONLY_MAX_CHARS", "1500"))
+
+
+def retrieval_only_answer(context: str) -> Dict[str, Any]:
+    """Ответ без генерации: отдаем найденные фрагменты базы знаний как есть."""
+    if not context:
+        return {
+            "response": "Произошла ошибка при обращении к AI-сервису. Пожалуйста, попробуйте позже.",
+            "sources": [],
+            "confidence": 0.0,
+        }
+    excerpt = context[:RETRIEVAL_ONLY_MAX_CHARS].rstrip()
+    if len(context) > RETRIEVAL_ONLY_MAX_CHARS:
+        excerpt += "…"
+    return {
+        "response": "AI-сервис сейчас недоступен, но вот что нашлось в базе знаний по вашему вопросу:\n\n" + excerpt,
+        "sources": [],
+        "confidence": 0.0,
+    }
 
 
 class LLMClient:
     """
-    Клиент для взаимодействия с OpenAI Chat Completion API.
+    Клиент для взаимодействия с OpenAI Chat Completion API через LLMGateway.
     Возвращает структурированный ответ: {'response': str, 'sources': [str], 'confidence': float}
     """
 
+    def __init__(self, gateway: Optional[LLMGateway] = None):
+        self.gateway = gateway or LLMGateway.from_env()
+
     async def get_summary(self, dialog_text: str) -> str:
         """
         Получает краткое изложение (summary) диалога.
@@ -30,13 +52,11 @@ class LLMClient:
         ]
 
         try:
-            response = await client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=messages,
+            summary = await self.gateway.complete(
+                messages,
                 temperature=0.2,  # Low temperature for factual summary
                 max_tokens=500,
             )
-            summary = response.choices[0].message.content.strip()
             logger.info("Successfully generated summary.")
             return summary
         except Exception as e:
@@ -101,19 +121,17 @@ class LLMClient:
 """
         messages.append({"role": "user", "content": user_prompt_with_context})
 
-        logger.info(f"Sending {len(messages)} messages to LLM.")
-        logger.debug(f"LLM messages: {messages}")
+        logger.info("Sending {count} messages to LLM.", count=len(messages))
+        # lazy: список сообщений собирается, только если DEBUG кому-то нужен
+        logger.opt(lazy=True).debug("LLM messages: {}", lambda: redact_messages(messages))
 
         try:
-            response = await client.chat.completions.create(
-                model=OPENAI_MODEL,
-                messages=messages,
+            answer_text = await self.gateway.complete(
+                messages,
                 temperature=temperature,
                 max_tokens=800,
             )
 
-            answer_text = response.choices[0].message.content.strip()
-
             # --- Парсинг результата ---
             sources = []
             confidence = None
@@ -142,6 +160,9 @@ class LLMClient:
             logger.info("Successfully received response from OpenAI.")
             return {"response": answer_text, "sources": sources, "confidence": confidence}
 
+        except AllProvidersFailed as e:
+            logger.error(f"All LLM providers failed, answering from retrieved context: {e}")
+            return retrieval_only_answer(context)
         except Exception as e:
             logger.exception(f"Error calling OpenAI API: {e}")
             return {
@@ -0,0 +1,251 @@
+# api/llm_gateway.py
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+from openai import AsyncOpenAI
+
+from .openai_scheduler import OpenAIScheduler, estimate_tokens, openai_scheduler
+
+# Общий бюджет времени на один ответ (все провайдеры и хеджи вместе)
+LLM_DEADLINE = float(os.getenv("LLM_DEADLINE", "20"))
+# Хедж: если ответа нет дольше p95 последних запросов, шлем дубликат
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", "0.95"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "1") == "1"
+# Circuit breaker: после N ошибок подряд провайдер пропускается на LLM_BREAKER_RESET секунд
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+# Цепочка провайдеров по порядку: от основного к более дешевому/быстрому
+LLM_PROVIDERS = os.getenv("LLM_PROVIDERS", "openai")
+
+
+class AllProvidersFailed(Exception):
+    """Ни один провайдер не ответил за отведенное время."""
+
+
+class LatencyTracker:
+    """Скользящее окно задержек успешных запросов."""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if len(self._samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class CircuitBreaker:
+    """
+    closed -> (failures подряд) -> open -> (reset_timeout) -> half_open.
+    В half_open пропускается один пробный запрос: успех закрывает цепь, ошибка снова открывает.
+    """
+
+    def __init__(self, failures: int = LLM_BREAKER_FAILURES, reset_timeout: float = LLM_BREAKER_RESET):
+        self.max_failures = failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or self.failures >= self.max_failures:
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def release(self) -> None:
+        """Вызов отменен (ушел клиент или последний ожидающий): не ошибка, следующий запрос снова проверит провайдера."""
+        self._probing = False
+
+
+class Provider:
+    """OpenAI-совместимый провайдер: свой base_url, ключ, модель и таймаут на запрос."""
+
+    def __init__(
+        self,
+        name: str,
+        model: str,
+        api_key: Optional[str] = None,
+        base_url: Optional[str] = None,
+        timeout: float = 15.0,
+        scheduler: Optional[OpenAIScheduler] = None,
+    ):
+        self.name = name
+        self.model = model
+        self.timeout = timeout
+        # Без планировщика — без лимитов RPM/TPM (например, локальная модель)
+        self.scheduler = scheduler or OpenAIScheduler(rpm=0, tpm=0)
+        # Повторы и таймауты делает шлюз, а не SDK
+        self.client = AsyncOpenAI(api_key=api_key or "none", base_url=base_url, max_retries=0)
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker()
+
+    @classmethod
+    def from_env(cls, name: str) -> "Provider":
+        """
+        Читает LLM_<NAME>_MODEL / _BASE_URL / _API_KEY / _TIMEOUT / _RPM / _TPM.
+        Для openai по умолчанию берутся OPENAI_* и общий планировщик аккаунта.
+        """
+        prefix = f"LLM_{name.upper()}_"
+        is_openai = name == "openai"
+        if os.getenv(prefix + "RPM") or os.getenv(prefix + "TPM"):
+            scheduler = OpenAIScheduler(rpm=int(os.getenv(prefix + "RPM", "0")), tpm=int(os.getenv(prefix + "TPM", "0")))
+        else:
+            scheduler = openai_scheduler if is_openai else None
+        return cls(
+            name=name,
+            model=os.getenv(prefix + "MODEL", os.getenv("OPENAI_MODEL", "gpt-4o-mini") if is_openai else "gpt-4o-mini"),
+            api_key=os.getenv(prefix + "API_KEY", os.getenv("OPENAI_API_KEY") if is_openai else None),
+            base_url=os.getenv(prefix + "BASE_URL", os.getenv("OPENAI_BASE_URL") if is_openai else None),
+            timeout=float(os.getenv(prefix + "TIMEOUT", "15")),
+            scheduler=scheduler,
+        )
+
+    async def complete(self, messages: List[Dict[str, str]], **params: Any) -> str:
+        estimated = estimate_tokens(*(m["content"] for m in messages)) + int(params.get("max_tokens") or 0)
+        async with self.scheduler.slot(estimated) as slot:
+            started = time.monotonic()
+            response = await self.client.chat.completions.create(model=self.model, messages=messages, **params)
+            self.latency.add(time.monotonic() - started)
+            if response.usage:
+                slot.used = response.usage.total_tokens
+        return response.choices[0].message.content.strip()
+
+
+class LLMGateway:
+    """
+    Единая точка вызова LLM для всех провайдеров.
+
+    Провайдеры пробуются по порядку в пределах общего дедлайна. Внутри провайдера
+    запрос хеджируется: если ответа нет дольше p95 недавних запросов, отправляется
+    дубликат и берется первый ответ. Провайдер с открытым circuit breaker
+    пропускается сразу. Если не ответил никто — AllProvidersFailed, и вызывающий
+    отдает ответ только по найденному контексту.
+    """
+
+    def __init__(
+        self,
+        providers: List[Provider],
+        deadline: float = LLM_DEADLINE,
+        hedge: bool = LLM_HEDGE_ENABLED,
+        hedge_percentile: float = LLM_HEDGE_PERCENTILE,
+    ):
+        if not providers:
+            raise ValueError("At least one LLM provider is required.")
+        self.providers = providers
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.fallbacks = 0
+
+    @classmethod
+    def from_env(cls) -> "LLMGateway":
+        names = [name.strip() for name in LLM_PROVIDERS.split(",") if name.strip()]
+        return cls([Provider.from_env(name) for name in names])
+
+    async def complete(
+        self,
+        messages: List[Dict[str, str]],
+        deadline: Optional[float] = None,
+        **params: Any,
+    ) -> str:
+        expires = time.monotonic() + (deadline or self.deadline)
+        errors = []
+        for index, provider in enumerate(self.providers):
+            remaining = expires - time.monotonic()
+            if remaining <= 0:
+                break
+            if not provider.breaker.allow():
+                errors.append(f"{provider.name}: circuit open")
+                continue
+            try:
+                answer = await asyncio.wait_for(
+                    self._hedged(provider, messages, params), timeout=min(provider.timeout, remaining)
+                )
+            except asyncio.CancelledError:
+                provider.breaker.release()
+                raise
+            except Exception as e:
+                provider.breaker.record_failure()
+                reason = "timeout" if isinstance(e, asyncio.TimeoutError) else repr(e)
+                errors.append(f"{provider.name}: {reason}")
+                logger.warning(f"LLM provider '{provider.name}' failed ({reason}), state {provider.breaker.state}.")
+                continue
+            provider.breaker.record_success()
+            if index > 0:
+                self.fallbacks += 1
+            return answer
+        raise AllProvidersFailed("; ".join(errors) or "deadline exceeded")
+
+    async def _hedged(self, provider: Provider, messages: List[Dict[str, str]], params: Dict[str, Any]) -> str:
+        primary = asyncio.create_task(provider.complete(messages, **params))
+        delay = provider.latency.percentile(self.hedge_percentile) if self.hedge else None
+        tasks = {primary}
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    self.hedged += 1
+                    tasks.add(asyncio.create_task(provider.complete(messages, **params)))
+
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                if not tasks:
+                    # Обе попытки упали — отдаем ошибку последней
+                    raise done.pop().exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "fallbacks": self.fallbacks,
+            "providers": {
+                p.name: {
+                    "model": p.model,
+                    "state": p.breaker.state,
+                    "p95_s": p.latency.percentile(0.95),
+                }
+                for p in self.providers
+            },
+        }
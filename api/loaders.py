@@ -0,0 +1,49 @@
+# api/loaders.py
+import os
+from pathlib import Path
+from typing import List, NamedTuple
+
+from loguru import logger
+
+
+class LoadedDocument(NamedTuple):
+    """Загруженный документ: путь к источнику и текст."""
+    source: str
+    content: str
+
+
+def _is_visible(path: Path) -> bool:
+    return not any(part.startswith(".") for part in path.parts)
+
+
+def load_documents(docs_path: str, glob: str = "**/*.txt") -> List[LoadedDocument]:
+    """
+    Читает документы из директории.
+    Текстовые файлы читаются напрямую; для остальных форматов лениво
+    подключается langchain_community (опциональная зависимость).
+    """
+    if not glob.endswith(".txt"):
+        return _load_with_langchain(docs_path, glob)
+
+    root = Path(docs_path)
+    documents = []
+    for path in sorted(root.glob(glob)):
+        if not path.is_file() or not _is_visible(path.relative_to(root)):
+            continue
+        with open(path, encoding="utf-8") as fh:
+            documents.append(LoadedDocument(source=str(path), content=fh.read()))
+    return documents
+
+
+def _load_with_langchain(docs_path: str, glob: str) -> List[LoadedDocument]:
+    try:
+        from langchain_community.document_loaders import DirectoryLoader
+    except ImportError:
+        logger.error(f"langchain_community is required to load '{glob}' files from '{docs_path}'.")
+        raise
+
+    loader = DirectoryLoader(docs_path, glob=glob)
+    return [
+        LoadedDocument(source=doc.metadata.get("source", os.path.join(docs_path, "unknown")), content=doc.page_content)
+        for doc in loader.load()
+    ]
@@ -1,21 +1,34 @@
 import os
-import sys
 import asyncio
-from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from sqlalchemy import text
 from sqlalchemy.orm import Session
 from loguru import logger
+import json
 import time
-from typing import Optional
+from typing import List, Optional
 
-from .db import Base, engine, get_db, User
-from .retriever import Retriever
+from .db import Base, engine, ensure_schema, get_db, get_or_create_telegram_user, User
+from .retriever import Retriever, embedding_models, get_openai_embeddings
+from .embedding_migration import embedding_migration, ensure_embedding_state, run_embedding_migration
+from .chunk_shards import chunk_shards
+from .db_routing import db_router
 from .llm_client import LLMClient
-from .rag_pipeline import process_query
+from .document_purge import run_purge
+from .logging_setup import LOG_ACCESS_SAMPLE_RATE, LOG_SLOW_REQUEST, configure_logging
+from .message_log import message_log
+from .profiling import ProfilingMiddleware
+from .partitions import ensure_partitions, migrate_to_partitioned, run_maintenance
+from .openai_scheduler import BACKGROUND, INTERACTIVE, openai_scheduler, scheduling
+from .rag_pipeline import drain_pending_writes, history_cache, process_query
 from .routes.documents import router as documents_router
+from .snapshot import import_snapshot, snapshot_path
+from .routes.embeddings import router as embeddings_router
+from .routes.profiles import router as profiles_router
 from . import auth, crud, schemas
 import yaml
 
@@ -30,10 +43,12 @@ if not api_key:
 
 CONFIGS_PATH = os.path.abspath("configs")
 DATA_PATH = os.path.abspath("data")
+# Пакетный /query/batch: максимум вопросов в запросе и одновременных генераций
+BATCH_QUERY_MAX = int(os.getenv("BATCH_QUERY_MAX", "1000"))
+BATCH_QUERY_CONCURRENCY = int(os.getenv("BATCH_QUERY_CONCURRENCY", "8"))
 
 # --- Логирование ---
-logger.remove()
-logger.add(sys.stderr, level="INFO")
+configure_logging()
 
 # --- Инициализация ---
 app = FastAPI(title="RAG API")
@@ -44,13 +59,24 @@ app.mount("/static", StaticFiles(directory=os.path.abspath("static")), name="sta
 
 app.include_router(documents_router, prefix="/api")
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
+app.include_router(profiles_router, prefix="/admin", tags=["admin"])
+app.include_router(embeddings_router, prefix="/admin", tags=["admin"])
+
+# Профиль запроса по заголовку X-Profile или с вероятностью PROFILE_SAMPLE_RATE.
+# Добавлен раньше log_requests, поэтому оказывается внутри него и видит сам обработчик.
+app.add_middleware(ProfilingMiddleware)
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     start_time = time.time()
     response = await call_next(request)
     duration = time.time() - start_time
-    logger.info(f"Handled request {request.method} {request.url.path} - {response.status_code} in {duration:.2f}s")
+    # Успешные быстрые запросы пишутся выборочно, ошибки и медленные — всегда
+    sample = None if response.status_code >= 400 or duration >= LOG_SLOW_REQUEST else LOG_ACCESS_SAMPLE_RATE
+    logger.info(
+        "Handled request {method} {path} - {status} in {duration:.2f}s",
+        method=request.method, path=request.url.path, status=response.status_code, duration=duration, sample=sample,
+    )
     return response
 
 # --- Модели Pydantic ---
@@ -62,6 +88,14 @@ class QueryRequest(BaseModel):
 class QueryResponse(BaseModel):
     response: str
 
+class BatchQueryRequest(BaseModel):
+    assistant: str
+    queries: List[str] = Field(..., min_length=1, max_length=BATCH_QUERY_MAX)
+    user_id: Optional[str] = None
+    # Для прогонов оценки история не нужна: вопросы независимы и не попадают в диалог
+    use_history: bool = False
+    concurrency: Optional[int] = None
+
 # --- События FastAPI ---
 @app.on_event("startup")
 async def on_startup():
@@ -72,6 +106,21 @@ async def on_startup():
         connection.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
         connection.commit()
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        ensure_schema(connection)
+        migrate_to_partitioned(connection)
+        ensure_partitions(connection)
+    chunk_shards.ensure_schema()
+    # Активная модель эмбеддингов; смена OPENAI_EMBEDDING_MODEL запускает миграцию в фоне
+    ensure_embedding_state(engine, chunk_shards.engines())
+    app.state.embedding_state = asyncio.create_task(embedding_models.watch())
+    app.state.embedding_migration = asyncio.create_task(run_embedding_migration(embedding_migration))
+    # Секции сообщений наперед и ретеншн старых — в фоне
+    app.state.partition_maintenance = asyncio.create_task(run_maintenance(engine))
+    # Чанки удаленных документов — фоновым set-based DELETE
+    app.state.document_purge = asyncio.create_task(run_purge(engine, shards=chunk_shards.engines()))
+    # Позиции WAL реплик для маршрутизации чтений
+    app.state.replica_monitor = asyncio.create_task(db_router.monitor()) if db_router.replicas else None
 
     # Создание сервисного аккаунта для бота, если он не существует
     db = next(get_db())
@@ -128,7 +177,7 @@ async def on_startup():
             retriever = Retriever(db, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
 
             docs_path = os.path.join(DATA_PATH, assistant_name)
-            task = retriever.load_and_embed_documents(assistant_name, docs_path)
+            task = _load_assistant_documents(retriever, docs_path, assistant_name)
             tasks.append(task)
 
         await asyncio.gather(*tasks)
@@ -136,46 +185,153 @@ async def on_startup():
         db.close()
     logger.info("Initial document processing complete.")
 
+async def _load_assistant_documents(retriever: Retriever, docs_path: str, assistant_name: str):
+    """Сначала снапшот ассистента, если он есть: загруженные из него документы data/ уже не эмбеддит."""
+    path = snapshot_path(assistant_name)
+    if path:
+        try:
+            await asyncio.to_thread(import_snapshot, path)
+        except Exception:
+            logger.exception(f"Failed to import snapshot {path}, embedding documents from {docs_path}.")
+    await retriever.load_and_embed_documents(docs_path, assistant=assistant_name)
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Дожидаемся фоновой записи диалогов перед остановкой."""
+    app.state.partition_maintenance.cancel()
+    app.state.document_purge.cancel()
+    if app.state.replica_monitor is not None:
+        app.state.replica_monitor.cancel()
+    app.state.embedding_state.cancel()
+    app.state.embedding_migration.cancel()
+    await drain_pending_writes()
+    await logger.complete()
+
 # --- Эндпоинты API ---
 @app.get("/")
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
-@app.post("/query", response_model=QueryResponse)
-async def handle_query(request: QueryRequest, db: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
-    """Основной эндпоинт для обработки запросов к RAG."""
-
+def _resolve_query_user(db: Session, current_user: User, assistant: str, telegram_id: Optional[str]) -> tuple[int, str]:
+    """Чей это запрос: для сервисного аккаунта бота — пользователь по telegram id. Возвращает (users.id, тариф)."""
     BOT_USER_EMAIL = os.getenv("BOT_USER_EMAIL")
-    user_id_for_query = None
 
     # Если запрос пришел от сервисного аккаунта бота
     if current_user.email == BOT_USER_EMAIL:
-        if not request.user_id:
+        if not telegram_id:
             raise HTTPException(status_code=400, detail="user_id is required for bot requests")
-        user_id_for_query = request.user_id
-        logger.info(f"Received query for assistant '{request.assistant}' from bot for user '{user_id_for_query}'")
+        # История хранится по users.id, бот присылает telegram id
+        telegram_user = get_or_create_telegram_user(db, telegram_id)
+        logger.info("Received query for assistant '{assistant}' from bot for user '{user_id}'",
+                    assistant=assistant, user_id=telegram_user.id)
+        return telegram_user.id, telegram_user.tariff
     # Если запрос от обычного пользователя
-    else:
-        user_id_for_query = str(current_user.id)
-        logger.info(f"Received query for assistant '{request.assistant}' from user '{user_id_for_query}'")
+    logger.info("Received query for assistant '{assistant}' from user '{user_id}'",
+                assistant=assistant, user_id=current_user.id)
+    return current_user.id, current_user.tariff
 
-    config_path = os.path.join(CONFIGS_PATH, f"{request.assistant}.yaml")
+def _check_assistant(assistant: str) -> None:
+    config_path = os.path.join(CONFIGS_PATH, f"{assistant}.yaml")
     if not os.path.exists(config_path):
-        raise HTTPException(status_code=404, detail=f"Assistant '{request.assistant}' not found.")
+        raise HTTPException(status_code=404, detail=f"Assistant '{assistant}' not found.")
+
+@app.post("/query", response_model=QueryResponse)
+async def handle_query(request: QueryRequest, response: Response, db: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
+    """Основной эндпоинт для обработки запросов к RAG."""
+
+    user_id_for_query, tariff = _resolve_query_user(db, current_user, request.assistant, request.user_id)
+    _check_assistant(request.assistant)
 
+    timings = {}
     try:
-        response_text = await process_query(
-            query=request.query,
-            assistant_name=request.assistant,
-            user_id=user_id_for_query,
-            db_session=db,
-            llm_client=llm_client
-        )
+        with scheduling(INTERACTIVE, request.assistant, tariff):
+            response_text = await process_query(
+                query=request.query,
+                assistant_name=request.assistant,
+                user_id=user_id_for_query,
+                db_session=db,
+                llm_client=llm_client,
+                timings=timings,
+            )
+        response.headers["Server-Timing"] = ", ".join(f"{name};dur={ms}" for name, ms in timings.items())
         return QueryResponse(response=response_text)
     except Exception as e:
         logger.error(f"Error processing query: {e}")
         raise HTTPException(status_code=500, detail="Internal server error while processing the query.")
 
+@app.post("/query/batch")
+async def handle_query_batch(request: BatchQueryRequest, db: Session = Depends(get_db), current_user: User = Depends(auth.get_current_user)):
+    """
+    Пакет вопросов одному ассистенту (QA-прогоны, ночные задачи). Все вопросы
+    эмбеддятся одним запросом к OpenAI, поиск и генерация идут параллельно, но не
+    больше BATCH_QUERY_CONCURRENCY одновременно. Ответы стримятся в NDJSON по мере
+    готовности: {"index", "query", "response", "timings"} или {"index", "query", "error"},
+    последняя строка — {"done": true, ...}. По умолчанию без истории диалога.
+    """
+    user_id_for_query, tariff = _resolve_query_user(db, current_user, request.assistant, request.user_id)
+    _check_assistant(request.assistant)
+    concurrency = max(1, min(request.concurrency or BATCH_QUERY_CONCURRENCY, BATCH_QUERY_CONCURRENCY))
+    started = time.perf_counter()
+
+    # Вопросы пакета и поиск по ним — одной моделью, даже если во время пакета она переключится
+    model = embedding_models.active
+    # Пакет — фоновая нагрузка: не вытесняет ответы в чате
+    with scheduling(BACKGROUND, request.assistant, tariff):
+        try:
+            embeddings = await get_openai_embeddings(request.queries, model)
+        except Exception as e:
+            logger.error(f"Error embedding query batch: {e}")
+            raise HTTPException(status_code=502, detail="Failed to embed the query batch.")
+    embed_ms = round((time.perf_counter() - started) * 1000, 1)
+    logger.info("Query batch of {count} for assistant '{assistant}' embedded in {embed_ms} ms",
+                count=len(request.queries), assistant=request.assistant, embed_ms=embed_ms)
+
+    async def _answer(index: int, query: str, embedding: list[float], limit: asyncio.Semaphore) -> dict:
+        async with limit:
+            timings = {}
+            try:
+                with scheduling(BACKGROUND, request.assistant, tariff):
+                    response_text = await process_query(
+                        query=query,
+                        assistant_name=request.assistant,
+                        user_id=user_id_for_query,
+                        db_session=db,
+                        llm_client=llm_client,
+                        timings=timings,
+                        query_embedding=embedding,
+                        embedding_model=model,
+                        use_history=request.use_history,
+                    )
+            except Exception as e:
+                logger.error(f"Error processing batch query {index}: {e}")
+                return {"index": index, "query": query, "error": "Internal server error while processing the query."}
+            return {"index": index, "query": query, "response": response_text, "timings": timings}
+
+    async def _stream():
+        limit = asyncio.Semaphore(concurrency)
+        tasks = [
+            asyncio.create_task(_answer(i, query, embedding, limit))
+            for i, (query, embedding) in enumerate(zip(request.queries, embeddings))
+        ]
+        errors = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                errors += "error" in result
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            # Клиент отключился — не тратим токены на оставшиеся вопросы
+            for task in tasks:
+                task.cancel()
+        yield json.dumps({
+            "done": True, "count": len(tasks), "errors": errors, "embed_ms": embed_ms,
+            "total_ms": round((time.perf_counter() - started) * 1000, 1),
+        }) + "\n"
+
+    return StreamingResponse(_stream(), media_type="application/x-ndjson")
+
 @app.get("/health")
 def health_check():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok", "llm": llm_client.gateway.stats(), "openai": openai_scheduler.stats(),
+            "messages": message_log.stats(), "history": history_cache.stats(),
+            "replicas": db_router.stats(), "chunk_shards": chunk_shards.stats()}
\ No newline at end of file
@@ -0,0 +1,136 @@
+# api/message_log.py
+import asyncio
+import os
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from loguru import logger
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from .db import Message, SessionLocal
+from .db_routing import db_router, history_key
+
+# Пачка пишется, когда набралось MESSAGE_LOG_BATCH сообщений или прошло MESSAGE_LOG_FLUSH_INTERVAL секунд
+MESSAGE_LOG_BATCH = int(os.getenv("MESSAGE_LOG_BATCH", "200"))
+MESSAGE_LOG_FLUSH_INTERVAL = float(os.getenv("MESSAGE_LOG_FLUSH_INTERVAL", "0.5"))
+
+T = TypeVar("T")
+
+
+class MessageLog:
+    """
+    Write-behind журнал сообщений чата.
+
+    append() кладет сообщение в память и сразу возвращается; фоновая задача пишет
+    накопленное одним INSERT и одним COMMIT. Пока сообщение не записано, оно
+    доступно через pending(), так что история видит собственные записи.
+    Если запись не удалась, пачка возвращается в буфер и пишется повторно.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        batch_size: int = MESSAGE_LOG_BATCH,
+        flush_interval: float = MESSAGE_LOG_FLUSH_INTERVAL,
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: List[dict] = []
+        self._inflight: List[dict] = []
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+
+    def append(self, user_id, assistant: str, role: str, content: str) -> None:
+        self._buffer.append({
+            "user_id": user_id,
+            "assistant": assistant,
+            "role": role,
+            "content": content,
+            # Время ставим сами: у всей пачки иначе был бы один now()
+            "created_at": datetime.utcnow(),
+        })
+        if len(self._buffer) >= self.batch_size:
+            self._full.set()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    def pending(self, user_id, assistant: str) -> List[dict]:
+        """Еще не записанные сообщения диалога, в порядке добавления."""
+        return [
+            row for row in self._inflight + self._buffer
+            if row["user_id"] == user_id and row["assistant"] == assistant
+        ]
+
+    async def read_with_pending(self, user_id, assistant: str, load: Callable[[], T]) -> Tuple[T, List[dict]]:
+        """
+        load() в отдельном потоке и незаписанные сообщения диалога, согласованно: под замком
+        записи пачка не может закоммититься между чтением базы и pending(), поэтому
+        каждое сообщение попадает ровно в один из двух источников.
+        """
+        async with self._lock:
+            loaded = await asyncio.to_thread(load)
+            return loaded, self.pending(user_id, assistant)
+
+    async def _flush_loop(self) -> None:
+        while self._buffer:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            if not await self.flush():
+                # Запись упала — не долбим базу в цикле
+                await asyncio.sleep(self.flush_interval)
+
+    async def flush(self) -> bool:
+        """Пишет все накопленное. Вызывается фоновой задачей, перед суммаризацией и при остановке."""
+        async with self._lock:
+            if not self._buffer:
+                return True
+            self._inflight, self._buffer = self._buffer, []
+            self._full.clear()
+            rows = self._inflight
+            try:
+                await asyncio.to_thread(self._write, rows)
+            except Exception:
+                self.failures += 1
+                logger.exception(f"Failed to write {len(rows)} messages, will retry.")
+                self._buffer = rows + self._buffer
+                return False
+            finally:
+                self._inflight = []
+            self.flushed += len(rows)
+            self.batches += 1
+            logger.debug(f"Wrote {len(rows)} messages in one batch.")
+            return True
+
+    def _write(self, rows: List[dict]) -> None:
+        with self.session_factory() as session:
+            session.execute(insert(Message), rows)
+            session.commit()
+            db_router.note_write(session, *{history_key(row["user_id"], row["assistant"]) for row in rows})
+
+    async def close(self) -> None:
+        """Останавливает фоновую запись и дописывает остаток."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush()
+        if self._buffer:
+            logger.error(f"{len(self._buffer)} messages were not written on shutdown.")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "buffered": len(self._buffer) + len(self._inflight),
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "failures": self.failures,
+        }
+
+
+message_log = MessageLog()
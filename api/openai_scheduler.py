@@ -0,0 +1,205 @@
+# api/openai_scheduler.py
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+# Лимиты аккаунта OpenAI (0 — без ограничения)
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "200000"))
+# Доля бюджета, которую фоновые вызовы не могут занять: она всегда остается для /query
+OPENAI_INTERACTIVE_RESERVE = float(os.getenv("OPENAI_INTERACTIVE_RESERVE", "0.2"))
+# Веса тарифов для справедливого разделения, например "default:1,premium:3"
+OPENAI_TARIFF_WEIGHTS = os.getenv("OPENAI_TARIFF_WEIGHTS", "default:1")
+
+INTERACTIVE = 0  # ответы на /query
+BACKGROUND = 1   # загрузка документов, суммаризация
+
+# (приоритет, ассистент, тариф) текущего запроса; задается через scheduling()
+_flow: ContextVar[Tuple[int, str, str]] = ContextVar("openai_flow", default=(BACKGROUND, "general", "default"))
+
+
+@contextmanager
+def scheduling(priority: int, assistant: Optional[str] = None, tariff: Optional[str] = None):
+    """Помечает все вызовы OpenAI внутри блока приоритетом и потоком (ассистент, тариф)."""
+    _, current_assistant, current_tariff = _flow.get()
+    token = _flow.set((priority, assistant or current_assistant, tariff or current_tariff))
+    try:
+        yield
+    finally:
+        _flow.reset(token)
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Грубая оценка до вызова: для кириллицы ~3 символа на токен."""
+    return max(1, sum(len(text) for text in texts) // 3)
+
+
+def _parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition(":")
+        if name.strip():
+            weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+class _Budget:
+    """Поминутный лимит как ведро токенов: пополняется на limit/60 в секунду, вмещает limit."""
+
+    def __init__(self, limit_per_minute: int):
+        self.limit = limit_per_minute
+        self.available = float(limit_per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.available = min(self.limit, self.available + (now - self.updated) * self.limit / 60)
+        self.updated = now
+
+    def delay(self, amount: float, reserve: float = 0.0) -> float:
+        """
+        Сколько ждать, пока после списания amount останется не меньше reserve доли лимита.
+        Вызов дороже доступной без резерва доли ждет полного ведра без резерва: иначе
+        он никогда бы не прошел и навсегда застрял бы во главе очереди.
+        """
+        if not self.limit:
+            return 0.0
+        self._refill()
+        need = min(amount, (1 - reserve) * self.limit) + reserve * self.limit - self.available
+        return 0.0 if need <= 0 else need * 60 / self.limit
+
+    def take(self, amount: float) -> None:
+        if self.limit:
+            self.available -= min(amount, self.limit)
+
+    def refund(self, amount: float) -> None:
+        """Поправка после ответа: amount > 0 — потратили меньше оценки, < 0 — больше."""
+        if self.limit:
+            self.available = min(self.limit, self.available + amount)
+
+
+class _Slot:
+    __slots__ = ("estimated", "used")
+
+    def __init__(self, estimated: int):
+        self.estimated = estimated
+        self.used: Optional[int] = None
+
+
+class OpenAIScheduler:
+    """
+    Единая очередь исходящих вызовов к OpenAI с бюджетами RPM/TPM.
+
+    Интерактивные вызовы всегда идут раньше фоновых, а фоновым недоступна
+    резервная доля бюджета. Внутри приоритета очередь справедливая (WFQ):
+    каждый поток (ассистент, тариф) получает долю пропорционально весу тарифа,
+    поэтому большая загрузка документов одного ассистента не занимает весь лимит.
+    """
+
+    def __init__(
+        self,
+        rpm: int = OPENAI_RPM,
+        tpm: int = OPENAI_TPM,
+        weights: Optional[Dict[str, float]] = None,
+        reserve: float = OPENAI_INTERACTIVE_RESERVE,
+    ):
+        self.requests = _Budget(rpm)
+        self.tokens = _Budget(tpm)
+        self.weights = weights if weights is not None else _parse_weights(OPENAI_TARIFF_WEIGHTS)
+        self.reserve = reserve
+        self._heap: List[tuple] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[Tuple[int, str, str], float] = {}
+        self._wakeup = asyncio.Event()
+        self._pump_task: Optional[asyncio.Task] = None
+        self.dispatched = {INTERACTIVE: 0, BACKGROUND: 0}
+        self.wait_seconds = {INTERACTIVE: 0.0, BACKGROUND: 0.0}
+
+    def _delay(self, priority: int, cost: int) -> float:
+        reserve = self.reserve if priority == BACKGROUND else 0.0
+        return max(self.requests.delay(1, reserve), self.tokens.delay(cost, reserve))
+
+    def _dispatch(self, priority: int, cost: int, queued_at: float) -> None:
+        self.requests.take(1)
+        self.tokens.take(cost)
+        self.dispatched[priority] += 1
+        self.wait_seconds[priority] += time.monotonic() - queued_at
+
+    async def _acquire(self, cost: int) -> None:
+        flow = _flow.get()
+        priority = flow[0]
+        queued_at = time.monotonic()
+        if not self._heap and self._delay(priority, cost) == 0:
+            self._dispatch(priority, cost, queued_at)
+            return
+
+        # Виртуальное время окончания: поток с большим весом продвигается медленнее
+        weight = self.weights.get(flow[2], 1.0)
+        start = max(self._virtual_time, self._last_finish.get(flow, 0.0))
+        finish = start + cost / weight
+        self._last_finish[flow] = finish
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, finish, next(self._seq), future, cost, queued_at))
+        self._wakeup.set()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self) -> None:
+        while self._heap:
+            priority, finish, _, future, cost, queued_at = self._heap[0]
+            if future.done():
+                heapq.heappop(self._heap)
+                continue
+            wait = self._delay(priority, cost)
+            if wait > 0:
+                # Новый интерактивный вызов может обогнать ждущий фоновый — просыпаемся на push
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self._heap)
+            self._virtual_time = max(self._virtual_time, finish)
+            self._dispatch(priority, cost, queued_at)
+            future.set_result(None)
+        if not self._heap:
+            self._last_finish.clear()
+            self._virtual_time = 0.0
+
+    @asynccontextmanager
+    async def slot(self, estimated_tokens: int):
+        """
+        Ждет очереди и бюджета, затем пропускает вызов. Если внутри блока
+        записать в slot.used фактический расход токенов, бюджет будет поправлен.
+        """
+        await self._acquire(estimated_tokens)
+        slot = _Slot(estimated_tokens)
+        try:
+            yield slot
+        finally:
+            if slot.used is not None:
+                self.tokens.refund(slot.estimated - slot.used)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "queued": len(self._heap),
+            "rpm_available": round(self.requests.available),
+            "tpm_available": round(self.tokens.available),
+            "dispatched_interactive": self.dispatched[INTERACTIVE],
+            "dispatched_background": self.dispatched[BACKGROUND],
+            "wait_s_interactive": round(self.wait_seconds[INTERACTIVE], 3),
+            "wait_s_background": round(self.wait_seconds[BACKGROUND], 3),
+        }
+
+
+# Общий планировщик для аккаунта OPENAI_API_KEY: чат, суммаризация и эмбеддинги
+openai_scheduler = OpenAIScheduler()
@@ -0,0 +1,185 @@
+# api/partitions.py
+import asyncio
+import gzip
+import os
+import re
+from datetime import date, datetime
+from typing import List, Optional
+
+from loguru import logger
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from .db import Message
+
+# Сколько месяцев сообщений хранить в базе; более старые секции выгружаются в архив и удаляются
+MESSAGES_RETENTION_MONTHS = int(os.getenv("MESSAGES_RETENTION_MONTHS", "12"))
+# На сколько месяцев вперед заранее создавать секции
+MESSAGES_PARTITIONS_AHEAD = int(os.getenv("MESSAGES_PARTITIONS_AHEAD", "2"))
+MESSAGES_ARCHIVE_DIR = os.getenv("MESSAGES_ARCHIVE_DIR", "archive/messages")
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+_PARTITION = re.compile(r"^messages_(\d{4})_(\d{2})$")
+_LEGACY = "messages_unpartitioned"
+_DEFAULT = "messages_default"
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"messages_{month:%Y_%m}"
+
+
+def is_partitioned(connection: Connection) -> bool:
+    return connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('messages'))"
+    )).scalar()
+
+
+def migrate_to_partitioned(connection: Connection) -> None:
+    """
+    Переносит старую несекционированную messages в секционированную.
+    Идемпотентно: если таблица уже секционирована, ничего не делает.
+    """
+    exists = connection.execute(text("SELECT to_regclass('messages') IS NOT NULL")).scalar()
+    if not exists or is_partitioned(connection):
+        return
+
+    logger.info("Converting messages to a partitioned table...")
+    # Имена индексов, ключа и последовательности освобождаем для новой таблицы
+    connection.execute(text(f"ALTER TABLE messages RENAME TO {_LEGACY}"))
+    for name in ("messages_pkey", "ix_messages_user_id", "ix_messages_conversation"):
+        connection.execute(text(f"ALTER INDEX IF EXISTS {name} RENAME TO {name}_unpartitioned"))
+    connection.execute(text(f"ALTER SEQUENCE IF EXISTS messages_id_seq RENAME TO {_LEGACY}_id_seq"))
+    Message.__table__.create(connection)
+
+    first = connection.execute(text(f"SELECT min(created_at) FROM {_LEGACY}")).scalar()
+    ensure_partitions(connection, since=first.date() if first else None)
+    connection.execute(text(
+        f"INSERT INTO messages (id, user_id, assistant, role, content, created_at) "
+        f"SELECT id, user_id, assistant, role, content, COALESCE(created_at, now()) FROM {_LEGACY}"
+    ))
+    connection.execute(text(
+        "SELECT setval(pg_get_serial_sequence('messages', 'id'), COALESCE((SELECT max(id) FROM messages), 0) + 1, false)"
+    ))
+    connection.execute(text(f"DROP TABLE {_LEGACY}"))
+    logger.info("messages is now partitioned by month.")
+
+
+def _create_partition(connection: Connection, name: str, start: date, end: date) -> None:
+    """
+    Создает секцию месяца. Если за этот месяц уже есть строки в секции по умолчанию,
+    CREATE ... PARTITION OF упал бы на ее ограничении: секция по умолчанию отсоединяется,
+    строки месяца переносятся в новую секцию, и она присоединяется обратно — в той же транзакции.
+    """
+    bounds = {"start": start, "end": end}
+    stranded = False
+    if connection.execute(text(f"SELECT to_regclass('{_DEFAULT}') IS NOT NULL")).scalar():
+        stranded = connection.execute(text(
+            f"SELECT EXISTS (SELECT 1 FROM {_DEFAULT} WHERE created_at >= :start AND created_at < :end)"
+        ), bounds).scalar()
+    if stranded:
+        connection.execute(text(f"ALTER TABLE messages DETACH PARTITION {_DEFAULT}"))
+    connection.execute(text(
+        f"CREATE TABLE {name} PARTITION OF messages "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    if stranded:
+        moved = connection.execute(text(
+            f"WITH moved AS (DELETE FROM {_DEFAULT} WHERE created_at >= :start AND created_at < :end RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ), bounds).rowcount
+        connection.execute(text(f"ALTER TABLE messages ATTACH PARTITION {_DEFAULT} DEFAULT"))
+        logger.info(f"Moved {moved} messages from {_DEFAULT} to {name}")
+
+
+def ensure_partitions(
+    connection: Connection,
+    since: Optional[date] = None,
+    ahead: int = MESSAGES_PARTITIONS_AHEAD,
+    today: Optional[date] = None,
+) -> List[str]:
+    """Создает месячные секции от since (по умолчанию — текущий месяц) до ahead месяцев вперед и секцию по умолчанию."""
+    current = (today or datetime.utcnow().date()).replace(day=1)
+    month = (since or current).replace(day=1)
+    created = []
+    while month <= _add_months(current, ahead):
+        name = partition_name(month)
+        exists = connection.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar()
+        if not exists:
+            _create_partition(connection, name, month, _add_months(month, 1))
+            created.append(name)
+        month = _add_months(month, 1)
+    # Страховка от вставок вне созданных секций (например, если обслуживание не запускалось)
+    connection.execute(text(f"CREATE TABLE IF NOT EXISTS {_DEFAULT} PARTITION OF messages DEFAULT"))
+    if created:
+        logger.info(f"Created message partitions: {', '.join(created)}")
+    return created
+
+
+def _export_partition(connection: Connection, name: str, archive_dir: str) -> str:
+    """Выгружает секцию в gzip CSV через COPY. Файл появляется атомарно (через .tmp)."""
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    tmp_path = path + ".tmp"
+    cursor = connection.connection.cursor()
+    try:
+        with gzip.open(tmp_path, "wb") as fh:
+            cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)", fh)
+    finally:
+        cursor.close()
+    os.replace(tmp_path, path)
+    return path
+
+
+def apply_retention(
+    connection: Connection,
+    retention_months: int = MESSAGES_RETENTION_MONTHS,
+    archive_dir: str = MESSAGES_ARCHIVE_DIR,
+    today: Optional[date] = None,
+) -> List[str]:
+    """
+    Секции целиком старше retention_months месяцев выгружаются в архив,
+    отсоединяются и удаляются. DROP секции вместо DELETE строк не оставляет раздувания.
+    """
+    cutoff = _add_months((today or datetime.utcnow().date()).replace(day=1), -retention_months)
+    partitions = connection.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass('messages') ORDER BY c.relname"
+    )).scalars().all()
+
+    archived = []
+    for name in partitions:
+        match = _PARTITION.match(name)
+        if not match:
+            continue
+        month = date(int(match.group(1)), int(match.group(2)), 1)
+        if _add_months(month, 1) > cutoff:
+            continue
+        path = _export_partition(connection, name, archive_dir)
+        connection.execute(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+        connection.execute(text(f"DROP TABLE {name}"))
+        archived.append(path)
+        logger.info(f"Archived message partition {name} to {path}")
+    return archived
+
+
+def maintain(engine: Engine) -> None:
+    """Один проход обслуживания: секции наперед и ретеншн. Каждый шаг — своя транзакция."""
+    with engine.begin() as connection:
+        ensure_partitions(connection)
+    with engine.begin() as connection:
+        apply_retention(connection)
+
+
+async def run_maintenance(engine: Engine, interval: float = PARTITION_MAINTENANCE_INTERVAL) -> None:
+    """Фоновое обслуживание секций, пока работает API."""
+    while True:
+        try:
+            await asyncio.to_thread(maintain, engine)
+        except Exception:
+            logger.exception("Message partition maintenance failed.")
+        await asyncio.sleep(interval)
@@ -0,0 +1,159 @@
+# api/profiling.py
+import asyncio
+import hmac
+import os
+import random
+import re
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+# Профиль снимается, если в заголовке X-Profile передан этот токен...
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+# ...или случайно с этой вероятностью (0 — только по заголовку)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Интервал сэмплирования pyinstrument, сек
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Сколько последних профилей хранить на диске
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+_SUFFIX = ".speedscope.json"
+_UNSAFE = re.compile(r"[^A-Za-z0-9_-]+")
+
+
+class RequestProfiler:
+    """
+    Профилирование отдельных запросов сэмплирующим профайлером pyinstrument
+    (опциональная зависимость). Режим async_mode="enabled": время ожидания
+    await (OpenAI, поток БД) видно в профиле отдельным кадром, а не теряется.
+    Профили пишутся в формате speedscope и открываются на https://www.speedscope.app.
+    """
+
+    def __init__(
+        self,
+        directory: str = PROFILE_DIR,
+        token: str = PROFILE_TOKEN,
+        sample_rate: float = PROFILE_SAMPLE_RATE,
+        interval: float = PROFILE_INTERVAL,
+        keep: int = PROFILE_KEEP,
+    ):
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.keep = keep
+        self.random = random.Random()
+        self.taken = 0
+        self._profiler_cls = None
+        self._unavailable = False
+
+    def should_profile(self, header: Optional[str]) -> bool:
+        if header and self.token and hmac.compare_digest(header, self.token):
+            return True
+        return self.sample_rate > 0 and self.random.random() < self.sample_rate
+
+    def start(self) -> Optional[Any]:
+        """Запускает профайлер в текущей задаче; None, если pyinstrument не установлен."""
+        if self._profiler_cls is None:
+            if self._unavailable:
+                return None
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                self._unavailable = True
+                logger.warning("Profiling requested but pyinstrument is not installed: pip install pyinstrument")
+                return None
+            self._profiler_cls = Profiler
+        profiler = self._profiler_cls(interval=self.interval, async_mode="enabled")
+        profiler.start()
+        return profiler
+
+    def new_name(self, label: str) -> str:
+        slug = _UNSAFE.sub("_", label).strip("_")[:60]
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{uuid.uuid4().hex[:8]}"
+
+    async def finish(self, profiler: Any, name: str) -> None:
+        # Останавливать нужно в той же задаче, где запускали; рендер и запись — в потоке
+        profiler.stop()
+        try:
+            await asyncio.to_thread(self._write, profiler, name)
+        except Exception:
+            logger.exception(f"Failed to save profile {name}.")
+            return
+        self.taken += 1
+        logger.info(f"Saved profile {name} ({profiler.last_session.duration:.3f}s).")
+
+    def _write(self, profiler: Any, name: str) -> None:
+        from pyinstrument.renderers import SpeedscopeRenderer
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name + _SUFFIX)
+        with open(path + ".tmp", "w", encoding="utf-8") as fh:
+            fh.write(profiler.output(renderer=SpeedscopeRenderer()))
+        os.replace(path + ".tmp", path)
+        for old in self.list()[self.keep:]:
+            os.remove(os.path.join(self.directory, old["name"] + _SUFFIX))
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Сохраненные профили, новые первыми."""
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(_SUFFIX):
+                stat = entry.stat()
+                profiles.append({
+                    "name": entry.name[:-len(_SUFFIX)],
+                    "size": stat.st_size,
+                    "created_at": stat.st_mtime,
+                })
+        return sorted(profiles, key=lambda p: p["created_at"], reverse=True)
+
+    def path(self, name: str) -> Optional[str]:
+        """Путь к профилю по имени; имена вне каталога (../) не принимаются."""
+        if _UNSAFE.search(name):
+            return None
+        path = os.path.join(self.directory, name + _SUFFIX)
+        return path if os.path.isfile(path) else None
+
+
+class ProfilingMiddleware:
+    """
+    ASGI-middleware: профилирует запрос, если should_profile() разрешает.
+    Чистый ASGI, а не @app.middleware: приложение выполняется в той же задаче,
+    и профайлер видит весь запрос. Имя профиля возвращается в заголовке X-Profile-Id.
+    """
+
+    def __init__(self, app, profiler: Optional[RequestProfiler] = None):
+        self.app = app
+        self.profiler = profiler or request_profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        header = dict(scope["headers"]).get(PROFILE_HEADER)
+        if not self.profiler.should_profile(header.decode("latin-1") if header else None):
+            return await self.app(scope, receive, send)
+        profiler = self.profiler.start()
+        if profiler is None:
+            return await self.app(scope, receive, send)
+
+        name = self.profiler.new_name(f"{scope['method']} {scope['path']}")
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (PROFILE_ID_HEADER, name.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            await self.profiler.finish(profiler, name)
+
+
+request_profiler = RequestProfiler()
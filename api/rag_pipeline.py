@@ -1,141 +1,331 @@
 # api/rag_pipeline.py
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
-from .retriever import Retriever
-from .db import Message
+from .retriever import (
+    RETRIEVER_ADAPTIVE_MARGIN,
+    RETRIEVER_MAX_DISTANCE,
+    Retriever,
+    corpus_version,
+    embedding_models,
+    get_openai_embedding,
+    select_chunks,
+)
+from .db import ConversationSummary, Message, SessionLocal
+from .db_routing import db_router, history_key
+from .history_cache import HistoryCache
 from .llm_client import LLMClient
+from .logging_setup import redact
+from .message_log import message_log
+from .openai_scheduler import BACKGROUND, scheduling
+from .singleflight import SingleFlight
 from loguru import logger
-import os, yaml
+from typing import Optional
+from datetime import datetime, timedelta
+import asyncio, hashlib, json, os, time, yaml
 
 CONFIGS_PATH = os.getenv("CONFIGS_PATH", "configs")
 MAX_HISTORY_LENGTH = 10
 SUMMARIZATION_THRESHOLD = 20
+# Ответ, когда в базе знаний нет ничего достаточно близкого к вопросу (LLM не вызывается)
+NO_CONTEXT_ANSWER = "К сожалению, я не нашел информации по вашему вопросу."
+# История не смотрит дальше этого окна: запрос затрагивает только свежие секции messages
+HISTORY_LOOKBACK_DAYS = int(os.getenv("HISTORY_LOOKBACK_DAYS", "30"))
+
+# Одинаковые одновременные вопросы (рассылка -> десятки одинаковых вопросов) делят одну генерацию
+generation_flight = SingleFlight()
+# Последние MAX_HISTORY_LENGTH сообщений активных диалогов
+history_cache = HistoryCache(MAX_HISTORY_LENGTH)
+# Кэш конфигов ассистентов: путь -> (mtime, config)
+_config_cache: dict[str, tuple[float, dict]] = {}
+# Незавершенная фоновая суммаризация по (user_id, assistant)
+_pending_writes: dict[tuple[str, str], asyncio.Task] = {}
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split()).rstrip("?!. ")
+
+
+def generation_key(assistant_name: str, query: str, history: list[dict]) -> tuple:
+    """Ключ генерации: ассистент, нормализованный вопрос, версия корпуса и история диалога."""
+    history_digest = hashlib.sha1(
+        json.dumps(history, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return assistant_name, normalize_query(query), corpus_version(), history_digest
+
+
+def _summary_message(summary: Optional[ConversationSummary]) -> Optional[dict]:
+    if summary is None:
+        return None
+    return {"role": "system", "content": f"[Краткая сводка беседы]\n{summary.content}"}
 
-async def save_message(db_session: Session, user_id: str, assistant: str, role: str, content: str):
-    """Сохраняет сообщение в базу данных."""
-    logger.info(f"Saving message for user {user_id}, role {role}")
-    message = Message(
-        user_id=user_id,
-        assistant=assistant,
-        role=role,
-        content=content
-    )
-    db_session.add(message)
-    db_session.commit()
 
-async def get_history(db_session: Session, user_id: str, assistant: str) -> list[dict]:
-    """История диалога: только допустимые роли для Chat API."""
-    logger.info(f"Fetching history for user {user_id}, assistant {assistant}")
+def _unsummarized_since(summary: Optional[ConversationSummary]) -> datetime:
+    """Нижняя граница created_at для сообщений диалога, еще не вошедших в сводку."""
+    since = datetime.utcnow() - timedelta(days=HISTORY_LOOKBACK_DAYS)
+    if summary is not None and summary.summarized_until > since:
+        since = summary.summarized_until
+    return since
+
+
+def _load_history(db_session: Session, user_id: int, assistant: str) -> tuple[Optional[dict], list[dict]]:
+    """Сводка диалога и последние сообщения после нее."""
+    summary = db_session.get(ConversationSummary, (user_id, assistant))
     messages = (
         db_session.query(Message)
         .filter(
             Message.user_id == user_id,
             Message.assistant == assistant,
-            Message.role.in_(("user", "assistant", "system"))  # ВАЖНО: нет 'summary'
+            Message.created_at > _unsummarized_since(summary),
+            Message.role.in_(("user", "assistant"))
         )
         .order_by(desc(Message.created_at))
         .limit(MAX_HISTORY_LENGTH)
         .all()
     )
-    history = [{"role": msg.role, "content": msg.content} for msg in reversed(messages)]
-    logger.info(f"Fetched {len(history)} messages from history.")
+    return _summary_message(summary), [{"role": msg.role, "content": msg.content} for msg in reversed(messages)]
+
+
+async def fetch_history(user_id: int, assistant: str) -> list[dict]:
+    """
+    История диалога: обычно из кэша окон, при промахе — из базы в отдельном потоке
+    и своей сессии, чтобы идти параллельно с эмбеддингом. Промах дожидается
+    суммаризации после предыдущего ответа и добавляет еще не записанные сообщения журнала.
+    """
+    key = (user_id, assistant)
+    cached = history_cache.get(key)
+    if cached is not None:
+        return cached
+
+    pending = _pending_writes.get(key)
+    if pending is not None:
+        await asyncio.shield(pending)
+
+    def _run():
+        # Реплика подходит, только если уже проиграла последнюю запись этого диалога
+        with db_router.read_session(history_key(user_id, assistant)) as session:
+            return _load_history(session, user_id, assistant)
+
+    (summary, turns), pending_rows = await message_log.read_with_pending(user_id, assistant, _run)
+    # Еще не записанные в базу сообщения журнала — самые свежие
+    turns += [{"role": row["role"], "content": row["content"]} for row in pending_rows]
+    turns = turns[-MAX_HISTORY_LENGTH:]
+    history_cache.put(key, turns, summary)
+    history = ([summary] if summary else []) + turns
+    logger.debug("Fetched {count} messages from history.", count=len(history))
     return history
 
 
-async def summarize_dialog(db_session: Session, user_id: str, assistant: str, llm_client: LLMClient):
-    """Суммаризация диалога: храним как system-сообщение."""
+def load_assistant_config(assistant_name: str) -> dict:
+    """YAML ассистента с кэшем по mtime: файл перечитывается только после изменения."""
+    config_path = os.path.join(CONFIGS_PATH, f"{assistant_name}.yaml")
+    try:
+        mtime = os.path.getmtime(config_path)
+    except OSError:
+        return {}
+    cached = _config_cache.get(config_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(config_path, "r", encoding="utf-8") as fh:
+            assistant_config = yaml.safe_load(fh) or {}
+    except Exception as e:
+        logger.warning(f"Failed to load assistant config {config_path}: {e}")
+        return {}
+    _config_cache[config_path] = (mtime, assistant_config)
+    return assistant_config
+
+
+class StageTimer:
+    """Время этапов pipeline в миллисекундах (для логов и заголовка Server-Timing)."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: dict[str, float] = {}
+
+    async def run(self, name: str, awaitable):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.stages[name] = (time.perf_counter() - start) * 1000
+
+    def finish(self) -> dict[str, float]:
+        self.stages["total"] = (time.perf_counter() - self.started) * 1000
+        return {name: round(ms, 1) for name, ms in self.stages.items()}
+
+
+async def summarize_dialog(db_session: Session, user_id: int, assistant: str, llm_client: LLMClient):
+    """
+    Суммаризация диалога: сводка хранится в conversation_summaries, сообщения не удаляются
+    (старые уходят вместе с секциями по ретеншну). История дальше читает только сообщения новее сводки.
+    """
     logger.info(f"Summarizing dialog for user {user_id}, assistant {assistant}")
-    messages = (
-        db_session.query(Message)
-        .filter(
-            Message.user_id == user_id,
-            Message.assistant == assistant,
-            Message.role != 'system'  # игнорим предыдущую summary, если была
-        )
-        .order_by(Message.created_at)
-        .all()
+    summary = db_session.get(ConversationSummary, (user_id, assistant))
+    conversation = (
+        Message.user_id == user_id,
+        Message.assistant == assistant,
+        Message.created_at > _unsummarized_since(summary),
+        Message.role.in_(("user", "assistant")),
     )
+    count = db_session.query(Message).filter(*conversation).count()
+    if count + len(message_log.pending(user_id, assistant)) < SUMMARIZATION_THRESHOLD:
+        return
+
+    # Сводка покрывает сообщения до summarized_until — сначала дописываем журнал
+    await message_log.flush()
+    messages = db_session.query(Message).filter(*conversation).order_by(Message.created_at).all()
 
     if len(messages) < SUMMARIZATION_THRESHOLD:
         return
 
     full_dialog = "\n".join([f"{m.role}: {m.content}" for m in messages])
+    if summary is not None:
+        full_dialog = f"[Предыдущая сводка]\n{summary.content}\n\n{full_dialog}"
     summary_text = await llm_client.get_summary(full_dialog)
 
     if summary_text:
-        # Удаляем старые сообщения и оставляем только system-summary
-        db_session.query(Message).filter(
-            Message.user_id == user_id,
-            Message.assistant == assistant
-        ).delete()
-
-        summary_message = Message(
-            user_id=user_id,
-            assistant=assistant,
-            role='system',  # ВАЖНО: вместо 'summary'
-            content=f"[Краткая сводка беседы]\n{summary_text}"
-        )
-        db_session.add(summary_message)
+        if summary is None:
+            summary = ConversationSummary(user_id=user_id, assistant=assistant)
+            db_session.add(summary)
+        summary.content = summary_text
+        # Сообщения, пришедшие во время генерации сводки, останутся в истории
+        summary.summarized_until = messages[-1].created_at
         db_session.commit()
-        logger.info("Dialog summarized and old messages replaced.")
+        db_router.note_write(db_session, history_key(user_id, assistant))
+        history_cache.invalidate((user_id, assistant))
+        logger.info("Dialog summarized.")
+
+
+def persist_exchange(user_id: str, assistant_name: str, query: str, response_text: str, llm_client: LLMClient):
+    """
+    Кладет вопрос и ответ в журнал сообщений (в базу они уйдут пачкой)
+    и в фоне проверяет необходимость суммаризации.
+    """
+    key = (user_id, assistant_name)
+    message_log.append(user_id, assistant_name, "user", query)
+    history_cache.append(key, "user", query)
+    if response_text:
+        message_log.append(user_id, assistant_name, "assistant", response_text)
+        history_cache.append(key, "assistant", response_text)
+
+    previous = _pending_writes.get(key)
+
+    async def _summarize():
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            with scheduling(BACKGROUND), SessionLocal() as session:
+                await summarize_dialog(session, user_id, assistant_name, llm_client)
+        except Exception:
+            logger.exception(f"Failed to summarize dialog for user {user_id}, assistant {assistant_name}")
+
+    def _forget(task: asyncio.Task):
+        if _pending_writes.get(key) is task:
+            del _pending_writes[key]
+
+    task = asyncio.create_task(_summarize())
+    _pending_writes[key] = task
+    task.add_done_callback(_forget)
+
+
+async def drain_pending_writes() -> None:
+    """Дожидается фоновой суммаризации и дописывает журнал сообщений (при остановке API)."""
+    if _pending_writes:
+        await asyncio.gather(*list(_pending_writes.values()), return_exceptions=True)
+    await message_log.close()
+
+
+async def _value(value):
+    return value
 
 
 async def process_query(
     query: str,
     assistant_name: str,
-    user_id: str, # Добавили user_id
+    user_id: int,  # users.id (для бота — найден по telegram id)
     db_session: Session,
-    llm_client: LLMClient
+    llm_client: LLMClient,
+    timings: Optional[dict] = None,
+    query_embedding: Optional[list[float]] = None,
+    use_history: bool = True,
+    embedding_model: Optional[str] = None,
 ) -> str:
     """
     Основной pipeline: поиск по базе + генерация ответа с учетом истории.
+
+    Эмбеддинг вопроса и загрузка истории идут параллельно, конфиг берется из кэша,
+    так что ответ ждет только критический путь эмбеддинг -> поиск -> LLM.
+    Запись сообщений и суммаризация выполняются в фоне после ответа.
+    Пакетный режим передает готовый эмбеддинг (и модель, которой он посчитан); с use_history=False
+    история не читается и не пишется — каждый вопрос отвечается независимо.
     """
-    logger.info(f"Processing query for assistant '{assistant_name}': '{query}'")
+    logger.info("Processing query for assistant '{assistant}': {query}", assistant=assistant_name, query=redact(query))
+    timer = StageTimer()
+    # Во время миграции модели эмбеддингов вопрос и поиск должны использовать одну модель
+    model = embedding_model or embedding_models.active
+
+    # 1. Независимые этапы: эмбеддинг вопроса и история — параллельно
+    embedding_task = asyncio.create_task(
+        timer.run("embed", get_openai_embedding(query, model)) if query_embedding is None else _value(query_embedding)
+    )
+    history_task = asyncio.create_task(
+        timer.run("history", fetch_history(user_id, assistant_name)) if use_history else _value([])
+    )
+    try:
+        assistant_config = load_assistant_config(assistant_name)
 
-    # 1. Сохраняем сообщение пользователя
-    await save_message(db_session, user_id, assistant_name, 'user', query)
+        # параметры ретривера из конфига
+        retr_conf = (assistant_config or {}).get("retriever", {}) or {}
+        top_k = int(retr_conf.get("top_k", 3))
+        chunk_size = int(retr_conf.get("chunk_size", 1000))
+        chunk_overlap = int(retr_conf.get("chunk_overlap", 200))
+        max_distance = float(retr_conf.get("max_distance", RETRIEVER_MAX_DISTANCE))
+        adaptive_margin = retr_conf.get("adaptive_margin", RETRIEVER_ADAPTIVE_MARGIN)
 
-    # 2. Извлекаем историю
-    history = await get_history(db_session, user_id, assistant_name)
+        # 2. Поиск релевантных чанков по готовому эмбеддингу
+        query_embedding = await embedding_task
+        retriever = Retriever(db_session, chunk_size=chunk_size, chunk_overlap=chunk_overlap, embedding_model=model)
+        found = await timer.run(
+            "search",
+            retriever.search(query, top_k=top_k, query_embedding=query_embedding, assistant=assistant_name),
+        )
+        context_chunks = select_chunks(
+            found, max_distance, float(adaptive_margin) if adaptive_margin is not None else None
+        )
+        context = "\n---\n".join(chunk.content for chunk in context_chunks)
 
-    config_path = os.path.join(CONFIGS_PATH, f"{assistant_name}.yaml")
-    assistant_config = {}
-    if os.path.exists(config_path):
-        try:
-            with open(config_path, "r", encoding="utf-8") as fh:
-                assistant_config = yaml.safe_load(fh) or {}
-        except Exception as e:
-            logger.warning(f"Failed to load assistant config {config_path}: {e}")
-
-    # параметры ретривера из конфига
-    retr_conf = (assistant_config or {}).get("retriever", {}) or {}
-    top_k = int(retr_conf.get("top_k", 3))
-    chunk_size = int(retr_conf.get("chunk_size", 1000))
-    chunk_overlap = int(retr_conf.get("chunk_overlap", 200))
-
-    # 3. Поиск релевантных чанков (с учетом параметров)
-    retriever = Retriever(db_session, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    context_chunks = await retriever.search(query, assistant_name, top_k=top_k)
-    context = "\n---\n".join(context_chunks) if context_chunks else ""
-
-    # 5. Генерация через LLM
-    llm_result = await llm_client.get_response(
-        query=query,
-        context=context,
-        assistant_config=assistant_config,
-        history=history
-    )
-    
-    response_text = llm_result.get("response") if isinstance(llm_result, dict) else str(llm_result)
+        history = await history_task
+    finally:
+        for task in (embedding_task, history_task):
+            task.cancel()
 
-    # 6. Сохраняем ответ ассистента
-    if response_text:
-        await save_message(db_session, user_id, assistant_name, 'assistant', response_text)
+    if not context_chunks:
+        # 3a. Ничего релевантного: отвечаем заготовкой без вызова LLM
+        logger.info("No chunks within distance {max_distance} for assistant '{assistant}', skipping LLM.",
+                    max_distance=max_distance, assistant=assistant_name)
+        response_text = assistant_config.get("fallback_answer") or NO_CONTEXT_ANSWER
+    else:
+        # 3. Генерация через LLM (одинаковые одновременные вопросы делят один вызов)
+        llm_result = await timer.run("llm", generation_flight.do(
+            generation_key(assistant_name, query, history),
+            lambda: llm_client.get_response(
+                query=query,
+                context=context,
+                assistant_config=assistant_config,
+                history=history
+            ),
+        ))
+
+        response_text = llm_result.get("response") if isinstance(llm_result, dict) else str(llm_result)
 
-    # 7. Проверяем необходимость суммаризации (в фоне)
-    # В реальном приложении это лучше делать в фоновом воркере
-    await summarize_dialog(db_session, user_id, assistant_name, llm_client)
+    # 4. Сохранение диалога и суммаризация — в фоне, ответ их не ждет
+    if use_history:
+        persist_exchange(user_id, assistant_name, query, response_text, llm_client)
 
-    logger.debug(f"LLM response: {response_text[:200]}...")
+    stages = timer.finish()
+    if timings is not None:
+        timings.update(stages)
+    logger.info("Query stages (ms): {stages}", stages=stages, assistant=assistant_name)
+    logger.opt(lazy=True).debug("LLM response: {}", lambda: redact(response_text))
 
-    return response_text
\ No newline at end of file
+    return response_text
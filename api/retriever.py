@@ -1,28 +1,136 @@
 # api/retriever.py
+import asyncio
 import os
-from typing import List
+from typing import List, Optional
 from sqlalchemy.orm import Session
-from pgvector.sqlalchemy import Vector
-from langchain_community.document_loaders import DirectoryLoader, TextLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from loguru import logger
 from openai import AsyncOpenAI
 
-from .db import Document, DocumentChunk
+from .chunk_shards import RetrievedChunk, chunk_shards
+from .db import DOCUMENT_DELETED, Document, EmbeddingState, SessionLocal
+from .db_routing import CORPUS, db_router
+from .loaders import load_documents
+from .logging_setup import redact
+from .openai_scheduler import estimate_tokens, openai_scheduler
+from .singleflight import SingleFlight
+from .text_splitter import RecursiveCharacterTextSplitter
 
 # --- Инициализация ---
 client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 EMBEDDING_MODEL = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
+# Значения по умолчанию для порога релевантности; переопределяются в configs/<assistant>.yaml
+RETRIEVER_MAX_DISTANCE = float(os.getenv("RETRIEVER_MAX_DISTANCE", "0.65"))
+RETRIEVER_ADAPTIVE_MARGIN = float(os.getenv("RETRIEVER_ADAPTIVE_MARGIN", "0.15"))
+# Сколько текстов уходит в один запрос эмбеддингов (лимит OpenAI — 2048)
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "256"))
+# Размерность колонки embedding; модели text-embedding-3 укорачиваются до нее параметром dimensions
+EMBEDDING_DIMENSIONS = 1536
+# Как часто перечитывать активную модель из embedding_state, сек
+EMBEDDING_STATE_POLL = float(os.getenv("EMBEDDING_STATE_POLL", "5"))
+
+def select_chunks(
+    chunks: List[RetrievedChunk],
+    max_distance: float = RETRIEVER_MAX_DISTANCE,
+    adaptive_margin: Optional[float] = RETRIEVER_ADAPTIVE_MARGIN,
+) -> List[RetrievedChunk]:
+    """
+    Отбрасывает чанки дальше max_distance. Адаптивный k: если лучший чанк близок,
+    оставляем только те, что не дальше него на adaptive_margin, — слабые хвосты не идут в контекст.
+    """
+    selected = [chunk for chunk in chunks if chunk.distance <= max_distance]
+    if selected and adaptive_margin is not None:
+        best = min(chunk.distance for chunk in selected)
+        selected = [chunk for chunk in selected if chunk.distance <= best + adaptive_margin]
+    return selected
+
+
+class EmbeddingModels:
+    """
+    Модель для эмбеддингов вопросов и новых чанков. Активная модель хранится в
+    embedding_state и меняется, только когда весь корпус пересчитан новой моделью;
+    OPENAI_EMBEDDING_MODEL — лишь модель по умолчанию для новой базы.
+    migrating: идет миграция, и часть нужных векторов лежит в теневой колонке.
+    """
+
+    def __init__(self, default: str = EMBEDDING_MODEL):
+        self.active = default
+        self.migrating = False
+
+    def refresh(self, session: Session) -> None:
+        state = session.get(EmbeddingState, 1)
+        if state is not None:
+            self.active = state.active_model
+            self.migrating = state.target_model is not None
+
+    async def watch(self, interval: float = EMBEDDING_STATE_POLL) -> None:
+        """Фоновое чтение embedding_state: переключение модели на другом экземпляре API видно здесь."""
+        def _refresh():
+            with SessionLocal() as session:
+                self.refresh(session)
+
+        while True:
+            try:
+                await asyncio.to_thread(_refresh)
+            except Exception:
+                logger.exception("Failed to read embedding state.")
+            await asyncio.sleep(interval)
+
+
+embedding_models = EmbeddingModels()
+# Одинаковые одновременные запросы эмбеддингов делят один вызов OpenAI
+embedding_flight = SingleFlight()
+# Версия корпуса: меняется при любом изменении документов, входит в ключи кэшей ответов
+_corpus_version = 0
+
+
+def corpus_version() -> int:
+    return _corpus_version
+
+
+def bump_corpus_version() -> None:
+    global _corpus_version
+    _corpus_version += 1
 
 
-async def get_openai_embedding(text_to_embed: str) -> List[float]:
-    """Получает эмбеддинг для текста с помощью OpenAI API."""
+async def get_openai_embedding(text_to_embed: str, model: Optional[str] = None) -> List[float]:
+    """Получает эмбеддинг для текста с помощью OpenAI API (по умолчанию — активной моделью)."""
+    model = model or embedding_models.active
+    return await embedding_flight.do(
+        (model, text_to_embed),
+        lambda: _create_embedding(text_to_embed, model),
+    )
+
+
+async def get_openai_embeddings(texts: List[str], model: Optional[str] = None) -> List[List[float]]:
+    """
+    Эмбеддинги списка текстов: один запрос к OpenAI на EMBEDDING_BATCH_SIZE текстов
+    вместо запроса на каждый. Повторяющиеся тексты эмбеддятся один раз.
+    """
+    model = model or embedding_models.active
+    unique = list(dict.fromkeys(texts))
+    batches = [unique[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(unique), EMBEDDING_BATCH_SIZE)]
+    results = await asyncio.gather(*(_create_embeddings(batch, model) for batch in batches))
+    vectors = {text_: vector for batch, embeddings in zip(batches, results) for text_, vector in zip(batch, embeddings)}
+    return [vectors[text_] for text_ in texts]
+
+
+async def _create_embedding(text_to_embed: str, model: str) -> List[float]:
+    return (await _create_embeddings([text_to_embed], model))[0]
+
+
+async def _create_embeddings(texts: List[str], model: str) -> List[List[float]]:
+    # ada-002 не принимает dimensions, у text-embedding-3-large своя размерность больше колонки
+    options = {"dimensions": EMBEDDING_DIMENSIONS} if model.startswith("text-embedding-3") else {}
     try:
-        response = await client.embeddings.create(
-            model=EMBEDDING_MODEL,
-            input=[text_to_embed]
-        )
-        return response.data[0].embedding
+        async with openai_scheduler.slot(estimate_tokens(*texts)) as slot:
+            response = await client.embeddings.create(
+                model=model,
+                input=texts,
+                **options
+            )
+            if response.usage:
+                slot.used = response.usage.total_tokens
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
     except Exception as e:
         logger.error(f"Error getting embedding from OpenAI: {e}")
         raise
@@ -33,30 +141,41 @@ class Retriever:
     Отвечает за загрузку, эмбеддинг и поиск документов.
     """
 
-    def __init__(self, db_session: Session, chunk_size: int = 1000, chunk_overlap: int = 200):
+    def __init__(
+        self, db_session: Session, chunk_size: int = 1000, chunk_overlap: int = 200, embedding_model: Optional[str] = None
+    ):
         self.db = db_session
+        # Модель фиксируется на время жизни ретривера: вопрос и чанки одного документа — одной моделью
+        self.embedding_model = embedding_model or embedding_models.active
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
             length_function=len
         )
 
-    async def add_document(self, file_name: str, content: str, user_id: int = None):
+    async def add_document(self, file_name: str, content: str, user_id: int = None, assistant: str = "general"):
         """Разбивает на чанки и сохраняет один документ в БД. Обеспечивает идемпотентность."""
         logger.info(f"Processing document '{file_name}'.")
 
         # Ищем существующий документ или создаем новый
-        document = self.db.query(Document).filter_by(filename=file_name, user_id=user_id).first()
+        live = self.db.query(Document).filter(
+            Document.filename == file_name, Document.user_id == user_id, Document.status != DOCUMENT_DELETED
+        )
+        document = live.filter(Document.assistant == assistant).first()
+        if not document and user_id is None:
+            # Документы из data/, загруженные до появления колонки assistant, числятся за general
+            document = live.filter(Document.assistant == "general").first()
+            if document:
+                document.assistant = assistant
+                self.db.commit()
         if not document:
-            document = Document(filename=file_name, user_id=user_id)
+            document = Document(filename=file_name, user_id=user_id, assistant=assistant)
             self.db.add(document)
             self.db.commit()
             self.db.refresh(document)
 
-        # Проверяем, есть ли уже чанки для этого документа
-        existing_chunks_count = self.db.query(DocumentChunk).filter_by(
-            document_id=document.id
-        ).count()
+        # Проверяем, есть ли уже чанки для этого документа (они могут лежать в шарде ассистента)
+        existing_chunks_count = chunk_shards.count_chunks(self.db, document.assistant, document.id)
 
         if existing_chunks_count > 0:
             logger.info(f"Chunks for document '{file_name}' already exist. Skipping.")
@@ -71,21 +190,27 @@ class Retriever:
         chunks = self.text_splitter.split_text(content)
         logger.info(f"Split document '{file_name}' into {len(chunks)} chunks.")
 
-        for chunk_content in chunks:
-            chunk_with_source = f"{chunk_content}\n\nSource: {file_name}"
-            embedding = await get_openai_embedding(chunk_with_source)
-            db_chunk = DocumentChunk(
-                document_id=document.id,
-                content=chunk_with_source,
-                embedding=embedding
-            )
-            self.db.add(db_chunk)
+        contents = [f"{chunk_content}\n\nSource: {file_name}" for chunk_content in chunks]
+        embeddings = await get_openai_embeddings(contents, self.embedding_model)
+        rows = [
+            {"document_id": document.id, "content": chunk, "embedding": embedding, "embedding_model": self.embedding_model}
+            for chunk, embedding in zip(contents, embeddings)
+        ]
+        chunk_shards.write_chunks(self.db, document.assistant, rows)
 
-        document.status = "ready"
+        # Документ могли удалить во время загрузки — не возвращаем его из tombstone
+        updated = self.db.query(Document).filter(Document.id == document.id, Document.status != DOCUMENT_DELETED).update(
+            {"status": "ready", "chunk_count": len(chunks), "byte_size": len(content.encode("utf-8"))},
+            synchronize_session=False,
+        )
         self.db.commit()
+        if not updated:
+            chunk_shards.delete_chunks(document.assistant, document.id)
+        db_router.note_write(self.db, CORPUS)
+        bump_corpus_version()
         logger.info(f"Successfully added and embedded document '{file_name}'.")
 
-    async def load_and_embed_documents(self, docs_path: str):
+    async def load_and_embed_documents(self, docs_path: str, assistant: str = "general"):
         """Загружает, разбивает на чанки и сохраняет документы в БД, используя OpenAI для эмбеддингов."""
         logger.info(f"Processing documents from '{docs_path}'...")
 
@@ -93,8 +218,7 @@ class Retriever:
             logger.warning(f"Directory '{docs_path}' is empty or does not exist.")
             return
 
-        loader = DirectoryLoader(docs_path, glob="**/*.txt", loader_cls=TextLoader)
-        documents = loader.load()
+        documents = load_documents(docs_path, glob="**/*.txt")
         if not documents:
             logger.warning(f"No documents found in '{docs_path}'.")
             return
@@ -102,25 +226,34 @@ class Retriever:
         logger.info(f"Found {len(documents)} documents to process.")
 
         for doc in documents:
-            file_name = os.path.basename(doc.metadata.get("source", "unknown.txt"))
-            content = doc.page_content
-            await self.add_document(file_name, content)
+            file_name = os.path.basename(doc.source)
+            await self.add_document(file_name, doc.content, assistant=assistant)
 
         logger.info(f"Finished processing documents from '{docs_path}'.")
 
-    async def search(self, query: str, top_k: int = 3) -> List[str]:
-        """Ищет релевантные чанки в БД."""
-        logger.info(f"Searching for relevant documents for query: '{query}'")
+    async def search(
+        self,
+        query: str,
+        top_k: int = 3,
+        query_embedding: Optional[List[float]] = None,
+        assistant: str = "general",
+    ) -> List[RetrievedChunk]:
+        """Ищет релевантные чанки в документах ассистента. Готовый эмбеддинг вопроса можно передать заранее."""
+        logger.debug("Searching for relevant documents for query {query}", query=redact(query))
 
-        query_embedding = await get_openai_embedding(query)
+        if query_embedding is None:
+            query_embedding = await get_openai_embedding(query, self.embedding_model)
 
-        results = self.db.query(DocumentChunk).order_by(
-            DocumentChunk.embedding.cosine_distance(query_embedding)
-        ).limit(top_k).all()
+        # Чтение идет на свежую реплику или в шард ассистента, не через сессию запроса
+        results = await chunk_shards.search(
+            assistant, query_embedding, top_k, self.embedding_model, shadow=embedding_models.migrating
+        )
 
         if not results:
             logger.warning("No relevant documents found.")
             return []
 
-        logger.info(f"Found {len(results)} relevant chunks.")
-        return [result.content for result in results]
+        logger.opt(lazy=True).info(
+            "Found {} relevant chunks, distances: {}", lambda: len(results), lambda: [round(r.distance, 3) for r in results]
+        )
+        return results
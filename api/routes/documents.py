@@ -1,13 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 import os
 from pydantic import BaseModel
 from datetime import datetime
 
-from ..retriever import Retriever
-from ..db import get_db, User, Document
+from ..retriever import Retriever, bump_corpus_version
+from ..chunk_shards import chunk_shards
+from ..db import DOCUMENT_DELETED, get_db, User, Document
+from ..db_routing import CORPUS, db_router
+from ..document_purge import request_purge
 from ..auth import get_current_user
+from .. import crud
+from ..openai_scheduler import BACKGROUND, scheduling
 
 router = APIRouter()
 
@@ -16,22 +21,56 @@ class DocumentResponse(BaseModel):
     filename: str
     upload_date: datetime
     status: str
+    assistant: str
+    chunk_count: int
+    byte_size: int
 
     class Config:
         orm_mode = True
 
-@router.get("/documents", response_model=List[DocumentResponse])
-async def get_documents_list(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+class DocumentPage(BaseModel):
+    items: List[DocumentResponse]
+    next_cursor: Optional[str] = None
+
+@router.get("/documents", response_model=DocumentPage)
+def get_documents_list(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    assistant: Optional[str] = None,
+    status: Optional[str] = None,
+    prefix: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Страница документов текущего пользователя, новые первыми.
+    Следующая страница запрашивается с cursor=next_cursor; next_cursor = null — страниц больше нет.
     """
-    Получает список документов, загруженных текущим пользователем.
+    try:
+        items, next_cursor = crud.list_documents(
+            db, current_user.id, limit=limit, cursor=cursor, assistant=assistant, status=status, prefix=prefix
+        )
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return DocumentPage(items=items, next_cursor=next_cursor)
+
+@router.get("/documents/{doc_id}", response_model=DocumentResponse)
+def get_document(doc_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    Возвращает метаданные документа текущего пользователя.
     """
-    documents = db.query(Document).filter(Document.user_id == current_user.id).all()
-    return documents
+    document = db.query(Document).filter(
+        Document.id == doc_id, Document.user_id == current_user.id, Document.status != DOCUMENT_DELETED
+    ).first()
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    return document
 
 @router.post("/documents")
 async def upload_document(
     db: Session = Depends(get_db),
     file: UploadFile = File(...),
+    assistant: str = Form("general"),
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -39,21 +78,31 @@ async def upload_document(
     """
     retriever = Retriever(db)
     content = await file.read()
-    await retriever.add_document(
-        file_name=file.filename, 
-        content=content.decode("utf-8"), 
-        user_id=current_user.id
-    )
+    # Эмбеддинги загрузки — фоновая нагрузка, не должна вытеснять ответы в чате
+    with scheduling(BACKGROUND, tariff=current_user.tariff):
+        await retriever.add_document(
+            file_name=file.filename,
+            content=content.decode("utf-8"),
+            user_id=current_user.id,
+            assistant=assistant or "general",
+        )
     return {"filename": file.filename, "owner_id": current_user.id}
 
 @router.delete("/documents/{doc_id}")
 async def delete_document(doc_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     """
     Удаляет документ, если он принадлежит текущему пользователю.
+    Документ только помечается удаленным и сразу пропадает из поиска;
+    чанки удаляются фоновой задачей одним set-based DELETE.
     """
-    document = db.query(Document).filter(Document.id == doc_id, Document.user_id == current_user.id).first()
-    if not document:
+    updated = db.query(Document).filter(
+        Document.id == doc_id, Document.user_id == current_user.id, Document.status != DOCUMENT_DELETED
+    ).update({"status": DOCUMENT_DELETED}, synchronize_session=False)
+    if not updated:
         raise HTTPException(status_code=404, detail="Document not found or you don't have permission to delete it")
-    db.delete(document)
     db.commit()
+    db_router.note_write(db, CORPUS)
+    chunk_shards.forget_documents()
+    bump_corpus_version()
+    request_purge()
     return {"message": "Document deleted"}
\ No newline at end of file
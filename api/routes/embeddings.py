@@ -0,0 +1,32 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from ..auth import get_admin_user
+from ..db import EmbeddingState, User, get_db
+from ..embedding_migration import embedding_migration
+
+router = APIRouter()
+
+@router.get("/embeddings")
+def embedding_status(db: Session = Depends(get_db), current_user: User = Depends(get_admin_user)):
+    """
+    Активная модель эмбеддингов и ход миграции на новую: чанков готово из total,
+    скорость в чанках в секунду и оценка оставшегося времени (если миграция идет на этом экземпляре).
+    """
+    state = db.get(EmbeddingState, 1)
+    if state is None:
+        return {"active_model": None, "target_model": None, "phase": "idle"}
+    status = {
+        "active_model": state.active_model,
+        "target_model": state.target_model,
+        "phase": state.phase,
+        "done": state.done,
+        "total": state.total,
+        "started_at": state.started_at,
+        "switched_at": state.switched_at,
+        "chunks_per_s": None,
+        "eta_s": None,
+    }
+    if embedding_migration.running:
+        status.update(embedding_migration.progress())
+    return status
@@ -0,0 +1,25 @@
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+
+from ..auth import get_admin_user
+from ..db import User
+from ..profiling import request_profiler
+
+router = APIRouter()
+
+@router.get("/profiles")
+def list_profiles(current_user: User = Depends(get_admin_user)):
+    """
+    Список сохраненных профилей запросов, новые первыми.
+    """
+    return request_profiler.list()
+
+@router.get("/profiles/{name}")
+def get_profile(name: str, current_user: User = Depends(get_admin_user)):
+    """
+    Профиль в формате speedscope (открывается на https://www.speedscope.app).
+    """
+    path = request_profiler.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=f"{name}.speedscope.json")
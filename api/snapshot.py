@@ -0,0 +1,381 @@
+# api/snapshot.py
+"""
+Снапшот корпуса ассистента: документы, чанки и векторы в одном бинарном файле.
+Новая реплика API или dev-окружение загружает его за секунды, без эмбеддинга data/.
+
+    python -m api.snapshot export dental snapshots/dental.snap
+    python -m api.snapshot import snapshots/dental.snap
+    python -m api.snapshot verify snapshots/dental.snap
+
+Формат (все числа little-endian, секции выровнены по 64 байта):
+
+    RAGSNAP1                      магия
+    vectors         float32[n, d] векторы чанков, читаются через np.memmap без копирования
+    document_index  int32[n]      номер документа чанка в списке documents заголовка
+    text_offsets    uint64[n + 1] границы текста чанка в секции text
+    text            bytes         тексты чанков в UTF-8 подряд
+    заголовок       JSON          модель, размерность, документы, смещения и sha256 секций
+    uint64 + RAGSNAP1             длина заголовка и магия в конце файла
+
+Заголовок пишется в конце, как футер у Parquet: файл пишется одним проходом по чанкам.
+"""
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import struct
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import BinaryIO, Callable, Dict, List, NamedTuple, Optional
+
+import numpy as np
+from loguru import logger
+from sqlalchemy import insert, select
+from sqlalchemy.orm import Session
+
+from .chunk_shards import ChunkShards, chunk_shards, shard_chunks
+from .db import DOCUMENT_DELETED, Document, DocumentChunk, SessionLocal
+from .db_routing import CORPUS, db_router
+from .retriever import EMBEDDING_DIMENSIONS, bump_corpus_version, embedding_models
+
+# Снапшоты, которые API загружает при старте: <SNAPSHOT_DIR>/<assistant>.snap
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_SUFFIX = ".snap"
+
+MAGIC = b"RAGSNAP1"
+FORMAT_VERSION = 1
+_ALIGN = 64
+_TRAILER = struct.Struct("<Q8s")
+# Строк в одном COPY / INSERT при загрузке
+_LOAD_BATCH = 1000
+_HASH_BLOCK = 16 << 20
+
+
+class ImportResult(NamedTuple):
+    documents: int
+    chunks: int
+    skipped: int
+
+
+class _Writer:
+    """Пишет секции подряд, выравнивает их и считает sha256 каждой."""
+
+    def __init__(self, fh: BinaryIO):
+        self.fh = fh
+        self.sections: Dict[str, dict] = {}
+        self._current: Optional[str] = None
+        self._hash = hashlib.sha256()
+        fh.write(MAGIC)
+
+    def _align(self) -> None:
+        padding = -self.fh.tell() % _ALIGN
+        if padding:
+            self.fh.write(b"\0" * padding)
+
+    def begin(self, name: str, dtype: str, shape: List[int]) -> None:
+        self._align()
+        self.sections[name] = {"offset": self.fh.tell(), "length": 0, "dtype": dtype, "shape": shape}
+        self._hash = hashlib.sha256()
+        self._current = name
+
+    def write(self, data: bytes) -> None:
+        self.fh.write(data)
+        self._hash.update(data)
+        self.sections[self._current]["length"] += len(data)
+
+    def end(self) -> None:
+        self.sections[self._current]["sha256"] = self._hash.hexdigest()
+
+
+def export_snapshot(
+    path: str,
+    assistant: str,
+    session_factory: Callable[[], Session] = SessionLocal,
+    shards: ChunkShards = chunk_shards,
+) -> dict:
+    """
+    Выгружает документы ассистента из data/ (без владельца) со всеми чанками и векторами
+    активной модели. Файл пишется во временный и переименовывается, так что читатели
+    никогда не видят недописанный снапшот. Возвращает заголовок.
+    """
+    started = time.perf_counter()
+    with session_factory() as session:
+        embedding_models.refresh(session)
+        if embedding_models.migrating:
+            raise ValueError("embedding model migration is in progress, export after it finishes")
+        model = embedding_models.active
+        documents = session.query(Document).filter(
+            Document.assistant == assistant, Document.user_id.is_(None), Document.status == "ready"
+        ).order_by(Document.id).all()
+        index_of = {document.id: i for i, document in enumerate(documents)}
+
+        shard = shards.engine_for(assistant)
+        table = DocumentChunk.__table__ if shard is None else shard_chunks
+        query = (
+            select(table.c.document_id, table.c.content, table.c.embedding)
+            .where(table.c.document_id.in_(list(index_of)), table.c.embedding_model == model)
+            .order_by(table.c.document_id, table.c.id)
+        )
+        connection = session.connection() if shard is None else shard.connect()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + ".tmp", "wb") as fh, tempfile.TemporaryFile() as text:
+            writer = _Writer(fh)
+            document_index, offsets, chunk_counts = [], [0], [0] * len(documents)
+            writer.begin("vectors", "<f4", [0, EMBEDDING_DIMENSIONS])
+            # Серверный курсор: в памяти только текущая пачка строк
+            result = connection.execution_options(stream_results=True, yield_per=_LOAD_BATCH).execute(query)
+            for rows in result.partitions():
+                vectors = np.asarray([row.embedding for row in rows], dtype="<f4")
+                writer.write(vectors.tobytes())
+                for row in rows:
+                    encoded = (row.content or "").encode("utf-8")
+                    text.write(encoded)
+                    offsets.append(offsets[-1] + len(encoded))
+                    document_index.append(index_of[row.document_id])
+                    chunk_counts[index_of[row.document_id]] += 1
+            writer.end()
+            count = len(document_index)
+            writer.sections["vectors"]["shape"][0] = count
+            if shard is not None:
+                connection.close()
+
+            writer.begin("document_index", "<i4", [count])
+            writer.write(np.asarray(document_index, dtype="<i4").tobytes())
+            writer.end()
+            writer.begin("text_offsets", "<u8", [count + 1])
+            writer.write(np.asarray(offsets, dtype="<u8").tobytes())
+            writer.end()
+            writer.begin("text", "u1", [offsets[-1]])
+            text.seek(0)
+            while block := text.read(_HASH_BLOCK):
+                writer.write(block)
+            writer.end()
+
+            header = {
+                "format": FORMAT_VERSION,
+                "assistant": assistant,
+                "embedding_model": model,
+                "dimensions": EMBEDDING_DIMENSIONS,
+                "created_at": datetime.utcnow().isoformat(),
+                "chunks": count,
+                "documents": [
+                    {
+                        "filename": document.filename,
+                        "upload_date": document.upload_date.isoformat() if document.upload_date else None,
+                        "byte_size": document.byte_size,
+                        "chunk_count": chunk_counts[i],
+                    }
+                    for i, document in enumerate(documents)
+                ],
+                "sections": writer.sections,
+            }
+            encoded_header = json.dumps(header, ensure_ascii=False).encode("utf-8")
+            fh.write(encoded_header)
+            fh.write(_TRAILER.pack(len(encoded_header), MAGIC))
+        os.replace(path + ".tmp", path)
+
+    logger.info(
+        f"Exported snapshot of '{assistant}' to {path}: {len(documents)} documents, {count} chunks "
+        f"in {time.perf_counter() - started:.1f}s."
+    )
+    return header
+
+
+class Snapshot:
+    """
+    Открытый снапшот. Секции отображаются в память (np.memmap): векторы можно
+    сразу искать в процессе, не читая файл целиком, а загрузка в pgvector
+    идет пачками прямо из отображения.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        size = os.path.getsize(path)
+        with open(path, "rb") as fh:
+            if fh.read(len(MAGIC)) != MAGIC or size < len(MAGIC) + _TRAILER.size:
+                raise ValueError(f"{path} is not a corpus snapshot")
+            fh.seek(size - _TRAILER.size)
+            length, magic = _TRAILER.unpack(fh.read(_TRAILER.size))
+            if magic != MAGIC or length > size - len(MAGIC) - _TRAILER.size:
+                raise ValueError(f"{path} is truncated")
+            fh.seek(size - _TRAILER.size - length)
+            self.header = json.loads(fh.read(length))
+        if self.header.get("format") != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported snapshot format {self.header.get('format')}")
+        self.vectors = self._section("vectors")
+        self.document_index = self._section("document_index")
+        self.text_offsets = self._section("text_offsets")
+        self.text = self._section("text")
+
+    def _section(self, name: str) -> np.ndarray:
+        section = self.header["sections"][name]
+        if not section["length"]:
+            return np.zeros(section["shape"], dtype=section["dtype"])
+        return np.memmap(self.path, dtype=section["dtype"], mode="r", offset=section["offset"], shape=tuple(section["shape"]))
+
+    def __len__(self) -> int:
+        return self.header["chunks"]
+
+    def content(self, i: int) -> str:
+        return bytes(self.text[self.text_offsets[i]:self.text_offsets[i + 1]]).decode("utf-8")
+
+    def verify(self) -> None:
+        """Сверяет sha256 всех секций с заголовком; при расхождении — ValueError."""
+        with open(self.path, "rb") as fh:
+            for name, section in self.header["sections"].items():
+                digest = hashlib.sha256()
+                fh.seek(section["offset"])
+                left = section["length"]
+                while left:
+                    block = fh.read(min(left, _HASH_BLOCK))
+                    if not block:
+                        break
+                    digest.update(block)
+                    left -= len(block)
+                if left or digest.hexdigest() != section["sha256"]:
+                    raise ValueError(f"{self.path}: checksum mismatch in section '{name}'")
+
+
+def _vector_literal(vector: np.ndarray) -> str:
+    return "[" + ",".join(vector.astype(str)) + "]"
+
+
+def _load_chunks(connection, snapshot: Snapshot, document_ids: Dict[int, int], model: str, table) -> int:
+    """
+    Пишет чанки новых документов. В Postgres — COPY пачками прямо из отображения
+    файла, иначе — INSERT пачками. document_ids: номер документа в снапшоте -> documents.id.
+    """
+    selected = [i for i in range(len(snapshot)) if int(snapshot.document_index[i]) in document_ids]
+    postgres = connection.dialect.name == "postgresql"
+    for start in range(0, len(selected), _LOAD_BATCH):
+        batch = selected[start:start + _LOAD_BATCH]
+        if postgres:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for i in batch:
+                writer.writerow((
+                    document_ids[int(snapshot.document_index[i])], snapshot.content(i),
+                    _vector_literal(snapshot.vectors[i]), model,
+                ))
+            buffer.seek(0)
+            cursor = connection.connection.cursor()
+            cursor.copy_expert(
+                "COPY document_chunks (document_id, content, embedding, embedding_model) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        else:
+            connection.execute(insert(table), [
+                {
+                    "document_id": document_ids[int(snapshot.document_index[i])],
+                    "content": snapshot.content(i),
+                    "embedding": np.asarray(snapshot.vectors[i]),
+                    "embedding_model": model,
+                }
+                for i in batch
+            ])
+    return len(selected)
+
+
+def import_snapshot(
+    path: str,
+    session_factory: Callable[[], Session] = SessionLocal,
+    shards: ChunkShards = chunk_shards,
+    verify: bool = True,
+) -> ImportResult:
+    """
+    Загружает снапшот в базу. Документы, которые уже есть у ассистента, пропускаются,
+    поэтому повторный импорт и последующая загрузка data/ ничего не дублируют.
+    Снапшот другой модели эмбеддингов не загружается: его векторы несовместимы с поиском.
+    """
+    started = time.perf_counter()
+    snapshot = Snapshot(path)
+    header = snapshot.header
+    if verify:
+        snapshot.verify()
+    if header["dimensions"] != EMBEDDING_DIMENSIONS:
+        raise ValueError(f"{path}: {header['dimensions']}-dimensional vectors, expected {EMBEDDING_DIMENSIONS}")
+    assistant, model = header["assistant"], header["embedding_model"]
+
+    with session_factory() as session:
+        embedding_models.refresh(session)
+        if model != embedding_models.active:
+            raise ValueError(f"{path}: vectors of {model}, active model is {embedding_models.active}")
+        existing = {
+            filename for (filename,) in session.query(Document.filename).filter(
+                Document.assistant == assistant, Document.user_id.is_(None), Document.status != DOCUMENT_DELETED
+            )
+        }
+        new_documents = {}
+        for i, item in enumerate(header["documents"]):
+            if item["filename"] in existing:
+                continue
+            document = Document(
+                filename=item["filename"], user_id=None, assistant=assistant, status="ready",
+                chunk_count=item["chunk_count"], byte_size=item["byte_size"],
+            )
+            if item.get("upload_date"):
+                document.upload_date = datetime.fromisoformat(item["upload_date"])
+            session.add(document)
+            new_documents[i] = document
+        session.flush()
+        document_ids = {i: document.id for i, document in new_documents.items()}
+
+        shard = shards.engine_for(assistant)
+        if shard is None:
+            # Документы и чанки в одной транзакции: поиск видит документ сразу целиком
+            chunks = _load_chunks(session.connection(), snapshot, document_ids, model, DocumentChunk.__table__)
+        else:
+            with shard.begin() as connection:
+                chunks = _load_chunks(connection, snapshot, document_ids, model, shard_chunks)
+        session.commit()
+        if document_ids:
+            db_router.note_write(session, CORPUS)
+            bump_corpus_version()
+
+    result = ImportResult(len(document_ids), chunks, len(header["documents"]) - len(document_ids))
+    logger.info(
+        f"Imported snapshot {path} for '{assistant}': {result.documents} documents, {result.chunks} chunks, "
+        f"{result.skipped} already present, in {time.perf_counter() - started:.1f}s."
+    )
+    return result
+
+
+def snapshot_path(assistant: str, directory: str = SNAPSHOT_DIR) -> Optional[str]:
+    """Снапшот ассистента для загрузки при старте, если он есть."""
+    path = os.path.join(directory, assistant + SNAPSHOT_SUFFIX)
+    return path if os.path.isfile(path) else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export, import or verify corpus snapshots")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="выгрузить документы ассистента в файл")
+    export.add_argument("assistant")
+    export.add_argument("path", nargs="?")
+    load = commands.add_parser("import", help="загрузить снапшот в базу")
+    load.add_argument("path")
+    load.add_argument("--no-verify", action="store_true", help="не сверять контрольные суммы")
+    check = commands.add_parser("verify", help="проверить контрольные суммы и показать заголовок")
+    check.add_argument("path")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        export_snapshot(args.path or os.path.join(SNAPSHOT_DIR, args.assistant + SNAPSHOT_SUFFIX), args.assistant)
+    elif args.command == "import":
+        import_snapshot(args.path, verify=not args.no_verify)
+    else:
+        snapshot = Snapshot(args.path)
+        snapshot.verify()
+        header = {key: value for key, value in snapshot.header.items() if key != "documents"}
+        header["documents"] = len(snapshot.header["documents"])
+        json.dump(header, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# api/text_splitter.py
+import re
+from typing import Callable, List, Optional
+
+from loguru import logger
+
+DEFAULT_SEPARATORS = ["\n\n", "\n", " ", ""]
+
+
+def _split_keep_separator(text: str, separator: str) -> List[str]:
+    """Режет текст по разделителю, оставляя разделитель в начале следующего куска."""
+    if not separator:
+        return [ch for ch in text]
+    parts = re.split(f"({re.escape(separator)})", text)
+    splits = [parts[i] + parts[i + 1] for i in range(1, len(parts), 2)]
+    if len(parts) % 2 == 0:
+        splits += parts[-1:]
+    splits = [parts[0], *splits]
+    return [s for s in splits if s]
+
+
+class RecursiveCharacterTextSplitter:
+    """
+    Рекурсивный сплиттер по символам без зависимости от langchain.
+    Повторяет семантику langchain RecursiveCharacterTextSplitter с настройками
+    по умолчанию (keep_separator=True, strip_whitespace=True, литеральные разделители),
+    поэтому чанки совпадают байт в байт с тем, что уже лежит в БД.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        length_function: Callable[[str], int] = len,
+        separators: Optional[List[str]] = None,
+    ):
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be > 0, got {chunk_size}")
+        if chunk_overlap < 0:
+            raise ValueError(f"chunk_overlap must be >= 0, got {chunk_overlap}")
+        if chunk_overlap > chunk_size:
+            raise ValueError(
+                f"Got a larger chunk overlap ({chunk_overlap}) than chunk size ({chunk_size}), should be smaller."
+            )
+        self._chunk_size = chunk_size
+        self._chunk_overlap = chunk_overlap
+        self._length_function = length_function
+        self._separators = separators or DEFAULT_SEPARATORS
+
+    def split_text(self, text: str) -> List[str]:
+        return self._split_text(text, self._separators)
+
+    def _split_text(self, text: str, separators: List[str]) -> List[str]:
+        final_chunks = []
+        # Выбираем первый разделитель, который встречается в тексте
+        separator = separators[-1]
+        new_separators = []
+        for i, sep in enumerate(separators):
+            if not sep:
+                separator = sep
+                break
+            if sep in text:
+                separator = sep
+                new_separators = separators[i + 1:]
+                break
+
+        splits = _split_keep_separator(text, separator)
+
+        # Склеиваем мелкие куски, слишком длинные режем следующим разделителем
+        good_splits = []
+        for s in splits:
+            if self._length_function(s) < self._chunk_size:
+                good_splits.append(s)
+                continue
+            if good_splits:
+                final_chunks.extend(self._merge_splits(good_splits))
+                good_splits = []
+            if not new_separators:
+                final_chunks.append(s)
+            else:
+                final_chunks.extend(self._split_text(s, new_separators))
+        if good_splits:
+            final_chunks.extend(self._merge_splits(good_splits))
+        return final_chunks
+
+    def _merge_splits(self, splits: List[str]) -> List[str]:
+        # Разделитель уже сохранен внутри кусков, поэтому склеиваем без него
+        docs = []
+        current_doc: List[str] = []
+        total = 0
+        for d in splits:
+            len_ = self._length_function(d)
+            if total + len_ > self._chunk_size:
+                if total > self._chunk_size:
+                    logger.warning(
+                        f"Created a chunk of size {total}, which is longer than the specified {self._chunk_size}"
+                    )
+                if current_doc:
+                    doc = "".join(current_doc).strip()
+                    if doc:
+                        docs.append(doc)
+                    # Оставляем хвост не длиннее chunk_overlap для перекрытия
+                    while total > self._chunk_overlap or (total + len_ > self._chunk_size and total > 0):
+                        total -= self._length_function(current_doc[0])
+                        current_doc = current_doc[1:]
+            current_doc.append(d)
+            total += len_
+        doc = "".join(current_doc).strip()
+        if doc:
+            docs.append(doc)
+        return docs
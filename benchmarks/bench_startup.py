@@ -0,0 +1,109 @@
+# benchmarks/bench_startup.py
+"""
+Замер холодного старта воркера API: время импорта модуля и пиковый RSS.
+
+    python benchmarks/bench_startup.py --runs 5 --module api.main
+
+Каждый прогон — отдельный интерпретатор, поэтому кэши импорта не мешают.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Минимальное окружение, чтобы api.main импортировался без .env
+BENCH_ENV = {
+    "OPENAI_API_KEY": "sk-bench",
+    "POSTGRES_USER": "bench",
+    "POSTGRES_PASSWORD": "bench",
+    "DB_HOST": "localhost",
+    "DB_PORT": "5432",
+    "POSTGRES_DB": "bench",
+}
+
+
+def _run_once(module: str) -> dict:
+    env = {**os.environ, **BENCH_ENV}
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    _, stderr = proc.communicate()
+    wall = time.perf_counter() - start
+    if proc.returncode:
+        raise RuntimeError(f"import {module} failed:\n{stderr[-2000:]}")
+
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [p.strip() for p in line[len("import time:"):].split("|")]
+        if parts[0].isdigit():
+            imports.append((int(parts[1]), parts[2]))
+    return {"wall_s": wall, "imports": imports}
+
+
+def _max_rss_mb(module: str) -> float:
+    """Пиковый RSS отдельного процесса, который только импортирует модуль."""
+    code = (
+        f"import resource, {module}; "
+        "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+    )
+    out = subprocess.check_output(
+        [sys.executable, "-c", code], cwd=ROOT, env={**os.environ, **BENCH_ENV}, text=True
+    )
+    return int(out.strip().splitlines()[-1]) / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for API workers")
+    parser.add_argument("--module", default="api.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="сколько самых тяжелых импортов показать")
+    parser.add_argument("--json", dest="json_path", help="сохранить результат в JSON")
+    args = parser.parse_args()
+
+    runs = [_run_once(args.module) for _ in range(args.runs)]
+    walls = [r["wall_s"] for r in runs]
+    rss_mb = _max_rss_mb(args.module)
+
+    cumulative = {}
+    for r in runs:
+        for us, name in r["imports"]:
+            cumulative.setdefault(name, []).append(us)
+    heaviest = sorted(
+        ((statistics.median(v) / 1000, name) for name, v in cumulative.items() if "." not in name.strip()),
+        reverse=True,
+    )[: args.top]
+
+    result = {
+        "module": args.module,
+        "runs": args.runs,
+        "wall_median_s": statistics.median(walls),
+        "wall_min_s": min(walls),
+        "max_rss_mb": rss_mb,
+        "heaviest_top_level_imports_ms": {name.strip(): round(ms, 1) for ms, name in heaviest},
+    }
+
+    print(f"{args.module}: median {result['wall_median_s']:.3f}s, min {result['wall_min_s']:.3f}s, "
+          f"max RSS {rss_mb:.1f} MB over {args.runs} runs")
+    for ms, name in heaviest:
+        print(f"  {ms:8.1f} ms  {name.strip()}")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as fh:
+            json.dump(result, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
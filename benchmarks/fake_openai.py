@@ -0,0 +1,173 @@
+# benchmarks/fake_openai.py
+"""
+Локальный OpenAI-совместимый сервер для тестов и нагрузочных прогонов API.
+
+    python benchmarks/fake_openai.py --port 8090 --latency 0.3 --slow-rate 0.05 --slow-latency 5
+    # в окружении API: OPENAI_BASE_URL=http://localhost:8090/v1 OPENAI_API_KEY=fake
+
+Поддерживает /v1/chat/completions и /v1/embeddings. Эмбеддинги детерминированные:
+хеши слов раскладываются по координатам, так что тексты с общими словами близки.
+Ответ чата длиной --completion-tokens «генерируется» со скоростью --tokens-per-second.
+Поведение меняется на лету через POST /control (latency, slow_rate, slow_latency, error_rate,
+completion_tokens, tokens_per_second), счетчики вызовов — GET /stats.
+"""
+import argparse
+import asyncio
+import hashlib
+import math
+import random
+import re
+import time
+from collections import Counter
+from typing import List
+
+from aiohttp import web
+
+DEFAULT_DIMENSIONS = 1536
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def hashed_embedding(text: str, dimensions: int = DEFAULT_DIMENSIONS) -> List[float]:
+    """Детерминированный «мешок слов»: каждое слово добавляет ±1 в координату по своему хешу."""
+    vector = [0.0] * dimensions
+    for word in _WORD.findall(text.casefold()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        index = int.from_bytes(digest[:4], "little") % dimensions
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+async def _behave(app: web.Application, kind: str) -> None:
+    app["calls"][kind] += 1
+    latency = app["latency"]
+    if app["slow_rate"] and app["random"].random() < app["slow_rate"]:
+        latency = app["slow_latency"]
+    await asyncio.sleep(latency)
+    if app["error_rate"] and app["random"].random() < app["error_rate"]:
+        app["calls"][f"{kind}_errors"] += 1
+        raise web.HTTPInternalServerError(
+            text='{"error": {"message": "fake failure", "type": "server_error"}}',
+            content_type="application/json",
+        )
+
+
+async def _chat_completions(request: web.Request) -> web.Response:
+    payload = await request.json()
+    app = request.app
+    await _behave(app, "chat")
+    completion_tokens = min(int(app["completion_tokens"]), int(payload.get("max_tokens") or 10**6))
+    if app["tokens_per_second"]:
+        await asyncio.sleep(completion_tokens / app["tokens_per_second"])
+    question = payload["messages"][-1]["content"].strip().splitlines()[-1]
+    content = f"Ответ {app['name']} ({payload.get('model')}): {question[:200]}"
+    if completion_tokens > 0:
+        content += " " + " ".join(["слово"] * completion_tokens)
+    prompt_tokens = sum(len(m.get("content") or "") for m in payload["messages"]) // 3
+    return web.json_response({
+        "id": f"chatcmpl-{request.app['calls']['chat']}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    })
+
+
+async def _embeddings(request: web.Request) -> web.Response:
+    payload = await request.json()
+    await _behave(request.app, "embeddings")
+    inputs = payload["input"] if isinstance(payload["input"], list) else [payload["input"]]
+    dimensions = int(payload.get("dimensions") or request.app["dimensions"])
+    tokens = sum(len(text) for text in inputs) // 3
+    return web.json_response({
+        "object": "list",
+        "model": payload.get("model"),
+        "data": [
+            {"object": "embedding", "index": i, "embedding": hashed_embedding(text, dimensions)}
+            for i, text in enumerate(inputs)
+        ],
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+    })
+
+
+async def _control(request: web.Request) -> web.Response:
+    for key, value in (await request.json()).items():
+        if key in ("latency", "slow_rate", "slow_latency", "error_rate", "completion_tokens", "tokens_per_second"):
+            request.app[key] = float(value)
+    return await _stats(request)
+
+
+async def _stats(request: web.Request) -> web.Response:
+    app = request.app
+    return web.json_response({
+        "calls": dict(app["calls"]),
+        "latency": app["latency"],
+        "slow_rate": app["slow_rate"],
+        "slow_latency": app["slow_latency"],
+        "error_rate": app["error_rate"],
+        "completion_tokens": app["completion_tokens"],
+        "tokens_per_second": app["tokens_per_second"],
+    })
+
+
+def create_app(
+    latency: float = 0.0,
+    slow_rate: float = 0.0,
+    slow_latency: float = 5.0,
+    error_rate: float = 0.0,
+    dimensions: int = DEFAULT_DIMENSIONS,
+    name: str = "fake",
+    seed: int = 0,
+    completion_tokens: int = 0,
+    tokens_per_second: float = 0.0,
+) -> web.Application:
+    app = web.Application()
+    app["calls"] = Counter()
+    app["latency"] = latency
+    app["slow_rate"] = slow_rate
+    app["slow_latency"] = slow_latency
+    app["error_rate"] = error_rate
+    app["dimensions"] = dimensions
+    app["name"] = name
+    app["random"] = random.Random(seed)
+    app["completion_tokens"] = completion_tokens
+    app["tokens_per_second"] = tokens_per_second
+    app.router.add_post("/v1/chat/completions", _chat_completions)
+    app.router.add_post("/v1/embeddings", _embeddings)
+    app.router.add_post("/control", _control)
+    app.router.add_get("/stats", _stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.0, help="обычная задержка ответа, сек")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="доля медленных ответов (хвост задержек)")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="задержка медленного ответа, сек")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument("--dimensions", type=int, default=DEFAULT_DIMENSIONS)
+    parser.add_argument("--name", default="fake")
+    parser.add_argument("--completion-tokens", type=int, default=0, help="длина ответа чата в токенах")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="скорость генерации (0 — мгновенно)")
+    args = parser.parse_args()
+
+    app = create_app(
+        args.latency, args.slow_rate, args.slow_latency, args.error_rate, args.dimensions, args.name,
+        completion_tokens=args.completion_tokens, tokens_per_second=args.tokens_per_second,
+    )
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
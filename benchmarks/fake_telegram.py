@@ -0,0 +1,200 @@
+# benchmarks/fake_telegram.py
+"""
+Локальная замена Telegram для нагрузочных тестов бота.
+
+Фейковый Bot API (бот отправляет сюда sendMessage/sendChatAction/getFile):
+
+    python benchmarks/fake_telegram.py serve --port 8081
+    # в окружении бота: TELEGRAM_API_URL=http://localhost:8081
+
+Генератор апдейтов, который шлет сообщения в вебхук бота:
+
+    python benchmarks/fake_telegram.py send --url http://localhost:8080/telegram/webhook \\
+        --secret $WEBHOOK_SECRET --chats 200 --messages 5 --concurrency 100
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import statistics
+import time
+from collections import Counter
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+_message_ids = itertools.count(1)
+_update_ids = itertools.count(1)
+
+
+# --- Фейковый Bot API ---
+def _chat(chat_id) -> dict:
+    return {"id": int(chat_id), "type": "private", "first_name": "Load"}
+
+
+def _message(chat_id, text=None) -> dict:
+    message = {"message_id": next(_message_ids), "date": int(time.time()), "chat": _chat(chat_id)}
+    if text is not None:
+        message["text"] = text
+    return message
+
+
+async def _bot_method(request: web.Request) -> web.Response:
+    method = request.match_info["method"]
+    if request.content_type == "application/json":
+        params = await request.json()
+    else:
+        params = dict(await request.post())
+    app = request.app
+    app["calls"][method] += 1
+    await asyncio.sleep(app["latency"])
+
+    chat_id = params.get("chat_id", 1)
+    if method in ("sendMessage", "editMessageText"):
+        result = _message(chat_id, params.get("text", ""))
+    elif method == "getMe":
+        result = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+    elif method == "getFile":
+        file_id = params.get("file_id", "file")
+        result = {"file_id": file_id, "file_unique_id": file_id, "file_size": app["file_size"],
+                  "file_path": f"documents/{file_id}.txt"}
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+
+async def _file_download(request: web.Request) -> web.StreamResponse:
+    size = request.app["file_size"]
+    response = web.StreamResponse(headers={"Content-Type": "text/plain", "Content-Length": str(size)})
+    await response.prepare(request)
+    line = ("Тестовый документ для нагрузочного прогона.\n" * 64).encode("utf-8")
+    sent = 0
+    while sent < size:
+        part = line[: size - sent]
+        await response.write(part)
+        sent += len(part)
+    await response.write_eof()
+    return response
+
+
+async def _stats(request: web.Request) -> web.Response:
+    return web.json_response(dict(request.app["calls"]))
+
+
+def create_bot_api_app(latency: float = 0.0, file_size: int = 64 * 1024) -> web.Application:
+    app = web.Application()
+    app["calls"] = Counter()
+    app["latency"] = latency
+    app["file_size"] = file_size
+    app.router.add_post("/bot{token}/{method}", _bot_method)
+    app.router.add_get("/file/bot{token}/{path:.*}", _file_download)
+    app.router.add_get("/stats", _stats)
+    return app
+
+
+# --- Генератор апдейтов ---
+def make_text_update(chat_id: int, text: str) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": _chat(chat_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "text": text,
+        },
+    }
+
+
+def make_document_update(chat_id: int, file_name: str = "load.txt") -> dict:
+    file_id = f"doc{next(_message_ids)}"
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": _chat(chat_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Load"},
+            "document": {"file_id": file_id, "file_unique_id": file_id, "file_name": file_name},
+        },
+    }
+
+
+async def send_updates(url: str, secret: str, updates, concurrency: int) -> dict:
+    """
+    Отправляет апдейты в вебхук и возвращает сводку по задержкам и статусам.
+    Апдейты одного чата уходят последовательно (как у Telegram), разные чаты — параллельно.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, statuses = [], Counter()
+    by_chat = {}
+    for update in updates:
+        by_chat.setdefault(update["message"]["chat"]["id"], []).append(update)
+
+    async with ClientSession(timeout=ClientTimeout(total=30)) as session:
+        async def _send_chat(chat_updates):
+            for update in chat_updates:
+                async with semaphore:
+                    start = time.perf_counter()
+                    try:
+                        async with session.post(url, json=update,
+                                                headers={"X-Telegram-Bot-Api-Secret-Token": secret}) as resp:
+                            statuses[resp.status] += 1
+                    except Exception as e:
+                        statuses[type(e).__name__] += 1
+                    latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(_send_chat(chat_updates) for chat_updates in by_chat.values()))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+
+    def _pct(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+
+    return {
+        "updates": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(_pct(0.50), 2),
+        "p95_ms": round(_pct(0.95), 2),
+        "p99_ms": round(_pct(0.99), 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+        "statuses": {str(k): v for k, v in statuses.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram for bot load testing")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    serve = sub.add_parser("serve", help="фейковый Bot API")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8081)
+    serve.add_argument("--latency", type=float, default=0.0, help="задержка ответа Bot API, сек")
+    serve.add_argument("--file-size", type=int, default=64 * 1024)
+
+    send = sub.add_parser("send", help="отправка апдейтов в вебхук")
+    send.add_argument("--url", required=True)
+    send.add_argument("--secret", required=True)
+    send.add_argument("--chats", type=int, default=100)
+    send.add_argument("--messages", type=int, default=5, help="сообщений на чат")
+    send.add_argument("--concurrency", type=int, default=50)
+    send.add_argument("--first-chat-id", type=int, default=10_000)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        web.run_app(create_bot_api_app(args.latency, args.file_size), host=args.host, port=args.port)
+        return
+
+    updates = [
+        make_text_update(args.first_chat_id + chat, f"Вопрос {n} из чата {chat}")
+        for n in range(args.messages)
+        for chat in range(args.chats)
+    ]
+    summary = asyncio.run(send_updates(args.url, args.secret, updates, args.concurrency))
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+# benchmarks/loadtest.py
+"""
+Нагрузочный прогон API (и, по желанию, бота) смешанной нагрузкой.
+
+Стенд без внешних сервисов:
+
+    python benchmarks/fake_openai.py --port 8090 --latency 0.2 --completion-tokens 200 --tokens-per-second 400
+    OPENAI_BASE_URL=http://localhost:8090/v1 OPENAI_API_KEY=fake uvicorn api.main:app --port 8000
+    python benchmarks/loadtest.py --api http://localhost:8000 --duration 60 --concurrency 50 \\
+        --mix query=0.85,upload=0.1,delete=0.05 --api-pid $(pgrep -f "uvicorn api.main") \\
+        --save-baseline benchmarks/baselines/local.json
+
+Отчет: RPS, p50/p95/p99 по операциям и по этапам /query (из заголовка Server-Timing),
+CPU и RSS процесса API. С --compare сравнивает с сохраненным baseline и завершается
+с кодом 1, если p95 или RPS ухудшились больше чем на --max-regression.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from aiohttp import ClientSession, ClientTimeout, FormData
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+QUESTIONS = {
+    "dental": [
+        "Сколько стоит профессиональная чистка зубов?",
+        "Больно ли ставить имплант?",
+        "Как записаться на прием к стоматологу?",
+        "Что делать, если болит зуб ночью?",
+    ],
+    "shop": [
+        "Какие есть способы доставки?",
+        "Можно ли вернуть товар без чека?",
+        "Есть ли скидки для постоянных клиентов?",
+    ],
+    "legal": [
+        "Как составить договор аренды квартиры?",
+        "Какой срок исковой давности по долгам?",
+        "Нужен ли нотариус для договора дарения?",
+    ],
+}
+# Вопросы вне базы знаний — проверяют короткий путь без LLM
+OFF_TOPIC = ["Какая погода на Марсе?", "Кто выиграл чемпионат мира по шахматам в 1972 году?"]
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "mean_ms": 0.0}
+    ordered = sorted(values)
+
+    def _pct(p):
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+    return {
+        "count": len(ordered),
+        "p50_ms": round(_pct(0.50), 2),
+        "p95_ms": round(_pct(0.95), 2),
+        "p99_ms": round(_pct(0.99), 2),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+    }
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """'embed;dur=201.3, llm;dur=300.8' -> {'embed': 0.2013, 'llm': 0.3008} (секунды)."""
+    stages = {}
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                try:
+                    stages[name] = float(value) / 1000
+                except ValueError:
+                    pass
+    return stages
+
+
+class ResourceSampler:
+    """Раз в interval секунд читает CPU и RSS процесса из /proc (Linux)."""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.rss_mb: List[float] = []
+        self._cpu_start: Optional[float] = None
+        self._cpu_end: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as fh:
+            fields = fh.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    def _rss(self) -> float:
+        with open(f"/proc/{self.pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+    async def _loop(self):
+        while True:
+            self.rss_mb.append(self._rss())
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._cpu_start = self._cpu_seconds()
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        self._cpu_end = self._cpu_seconds()
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    def summary(self, elapsed: float) -> dict:
+        return {
+            "cpu_percent": round((self._cpu_end - self._cpu_start) / elapsed * 100, 1) if elapsed else 0.0,
+            "rss_mb_max": round(max(self.rss_mb), 1) if self.rss_mb else 0.0,
+            "rss_mb_mean": round(sum(self.rss_mb) / len(self.rss_mb), 1) if self.rss_mb else 0.0,
+        }
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.stages: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.uploaded: List[str] = []
+        self.headers: Dict[str, str] = {}
+        self.mix = self._parse_mix(args.mix)
+        self.random = random.Random(args.seed)
+
+    @staticmethod
+    def _parse_mix(spec: str) -> Dict[str, float]:
+        mix = {}
+        for item in spec.split(","):
+            name, _, weight = item.partition("=")
+            mix[name.strip()] = float(weight or 1)
+        unknown = set(mix) - {"query", "upload", "delete"}
+        if unknown:
+            raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+        return mix
+
+    async def login(self, session: ClientSession) -> None:
+        data = {"username": self.args.email, "password": self.args.password}
+        async with session.post(f"{self.args.api}/auth/login", data=data) as resp:
+            resp.raise_for_status()
+            token = (await resp.json())["access_token"]
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    async def _timed(self, op: str, request) -> Optional[dict]:
+        start = time.perf_counter()
+        try:
+            async with request as resp:
+                body = await resp.read()
+                self.statuses[op][resp.status] += 1
+                if resp.status >= 400:
+                    return None
+                if op == "query":
+                    for stage, seconds in parse_server_timing(resp.headers.get("Server-Timing")).items():
+                        self.stages[stage].append(seconds)
+                return json.loads(body) if body else {}
+        except Exception as e:
+            self.statuses[op][type(e).__name__] += 1
+            return None
+        finally:
+            self.latencies[op].append(time.perf_counter() - start)
+
+    async def do_query(self, session: ClientSession, worker: int) -> None:
+        assistant = self.random.choice(self.args.assistants)
+        pool = QUESTIONS.get(assistant, OFF_TOPIC)
+        question = self.random.choice(OFF_TOPIC if self.random.random() < self.args.off_topic else pool)
+        payload = {"assistant": assistant, "query": question, "user_id": f"load-{worker}"}
+        await self._timed("query", session.post(f"{self.args.api}/query", json=payload, headers=self.headers))
+
+    async def do_upload(self, session: ClientSession, worker: int) -> None:
+        name = f"load_{worker}_{int(time.time() * 1000)}_{self.random.randrange(10**6)}.txt"
+        text = "\n\n".join(self.random.choice(QUESTIONS["dental"]) * 20 for _ in range(self.args.upload_paragraphs))
+        form = FormData()
+        form.add_field("assistant", self.random.choice(self.args.assistants))
+        form.add_field("file", text.encode("utf-8"), filename=name, content_type="text/plain")
+        result = await self._timed("upload", session.post(f"{self.args.api}/api/documents", data=form, headers=self.headers))
+        if result is not None:
+            self.uploaded.append(name)
+
+    async def do_delete(self, session: ClientSession, worker: int) -> None:
+        if not self.uploaded:
+            return await self.do_query(session, worker)
+        name = self.uploaded.pop(self.random.randrange(len(self.uploaded)))
+        documents = await self._timed("list", session.get(f"{self.args.api}/api/documents", headers=self.headers))
+        items = documents.get("items", documents) if isinstance(documents, dict) else documents or []
+        doc_id = next((d["id"] for d in items if d.get("filename") == name), None)
+        if doc_id is None:
+            return
+        await self._timed("delete", session.delete(f"{self.args.api}/api/documents/{doc_id}", headers=self.headers))
+
+    async def worker(self, session: ClientSession, worker: int, deadline: float) -> None:
+        operations = list(self.mix)
+        weights = [self.mix[op] for op in operations]
+        handlers = {"query": self.do_query, "upload": self.do_upload, "delete": self.do_delete}
+        while time.monotonic() < deadline:
+            op = self.random.choices(operations, weights)[0]
+            await handlers[op](session, worker)
+            if self.args.think_time:
+                await asyncio.sleep(self.random.expovariate(1 / self.args.think_time))
+
+    async def run_bot(self) -> Optional[dict]:
+        if not self.args.bot_webhook:
+            return None
+        sys.path.insert(0, os.path.dirname(__file__))
+        from fake_telegram import make_text_update, send_updates
+
+        updates = [
+            make_text_update(10_000 + chat, self.random.choice(QUESTIONS["dental"]))
+            for _ in range(self.args.bot_messages)
+            for chat in range(self.args.bot_chats)
+        ]
+        return await send_updates(self.args.bot_webhook, self.args.bot_secret, updates, self.args.concurrency)
+
+    async def run(self) -> dict:
+        timeout = ClientTimeout(total=self.args.timeout)
+        async with ClientSession(timeout=timeout) as session:
+            await self.login(session)
+            sampler = ResourceSampler(self.args.api_pid) if self.args.api_pid else None
+            if sampler:
+                sampler.start()
+
+            started = time.perf_counter()
+            deadline = time.monotonic() + self.args.duration
+            api_load = asyncio.gather(*(self.worker(session, n, deadline) for n in range(self.args.concurrency)))
+            bot_summary, _ = await asyncio.gather(self.run_bot(), api_load)
+            elapsed = time.perf_counter() - started
+
+            if sampler:
+                await sampler.stop()
+
+        total = sum(len(v) for v in self.latencies.values())
+        return {
+            "commit": _git_commit(),
+            "duration_s": round(elapsed, 2),
+            "concurrency": self.args.concurrency,
+            "mix": self.mix,
+            "requests": total,
+            "rps": round(total / elapsed, 1) if elapsed else 0.0,
+            "operations": {
+                op: {**percentiles(values), "statuses": {str(k): v for k, v in self.statuses[op].items()}}
+                for op, values in sorted(self.latencies.items())
+            },
+            "stages": {stage: percentiles(values) for stage, values in sorted(self.stages.items())},
+            "resources": sampler.summary(elapsed) if sampler else None,
+            "bot": bot_summary,
+        }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(current: dict, baseline: dict, max_regression: float) -> List[str]:
+    """Сравнение с baseline: список регрессий (пустой — все в порядке)."""
+    regressions = []
+    lines = [f"{'metric':<28}{'baseline':>12}{'current':>12}{'delta':>10}"]
+
+    def _row(name, old, new, higher_is_better=False):
+        if not old:
+            return
+        delta = (new - old) / old
+        lines.append(f"{name:<28}{old:>12.1f}{new:>12.1f}{delta:>+10.1%}")
+        worse = -delta if higher_is_better else delta
+        if worse > max_regression:
+            regressions.append(f"{name}: {old:.1f} -> {new:.1f} ({delta:+.1%})")
+
+    _row("rps", baseline.get("rps", 0), current["rps"], higher_is_better=True)
+    for group in ("operations", "stages"):
+        for name, stats in current[group].items():
+            old = baseline.get(group, {}).get(name)
+            if old:
+                _row(f"{name} p95_ms", old["p95_ms"], stats["p95_ms"])
+    print("\n".join(lines))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mixed-workload load test for the RAG API and bot")
+    parser.add_argument("--api", default="http://localhost:8000")
+    parser.add_argument("--email", default=os.getenv("BOT_USER_EMAIL"), help="сервисный аккаунт бота")
+    parser.add_argument("--password", default=os.getenv("BOT_USER_PASSWORD"))
+    parser.add_argument("--duration", type=float, default=30, help="длительность прогона, сек")
+    parser.add_argument("--concurrency", type=int, default=20, help="одновременных виртуальных клиентов")
+    parser.add_argument("--mix", default="query=0.9,upload=0.07,delete=0.03")
+    parser.add_argument("--assistants", type=lambda s: s.split(","), default=["dental", "shop", "legal"])
+    parser.add_argument("--off-topic", type=float, default=0.1, help="доля вопросов вне базы знаний")
+    parser.add_argument("--upload-paragraphs", type=int, default=20)
+    parser.add_argument("--think-time", type=float, default=0.0, help="средняя пауза клиента между запросами, сек")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--api-pid", type=int, help="PID процесса API для замера CPU/RSS")
+    parser.add_argument("--bot-webhook", help="URL вебхука бота: параллельно шлет апдейты от фейкового Telegram")
+    parser.add_argument("--bot-secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    parser.add_argument("--bot-chats", type=int, default=50)
+    parser.add_argument("--bot-messages", type=int, default=5)
+    parser.add_argument("--json", help="сохранить отчет в файл")
+    parser.add_argument("--save-baseline", help="сохранить отчет как baseline")
+    parser.add_argument("--compare", help="baseline для сравнения")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="допустимое ухудшение (0.2 = 20%%)")
+    args = parser.parse_args()
+    if not args.email or not args.password:
+        parser.error("--email/--password (или BOT_USER_EMAIL/BOT_USER_PASSWORD) обязательны")
+
+    summary = asyncio.run(LoadTest(args).run())
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+    for path in (args.json, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, "w", encoding="utf-8") as fh:
+                json.dump(summary, fh, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as fh:
+            baseline = json.load(fh)
+        regressions = compare(summary, baseline, args.max_regression)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+# benchmarks/retrieval_eval.py
+"""
+Оценка качества и скорости поиска по golden-наборам ассистентов, без сети и без БД.
+
+    python benchmarks/retrieval_eval.py --assistants dental,legal,shop \\
+        --chunk-sizes 400,800,1200 --overlaps 0,100,200 --top-k 1,3,5 --recall-target 0.9
+
+Golden-набор (benchmarks/golden/<assistant>.json) — вопросы с ожидаемым источником:
+файлом в docs и фрагментом текста, который должен быть в найденном чанке.
+Документы режутся тем же RecursiveCharacterTextSplitter, что и при загрузке, а вместо
+OpenAI используются детерминированные эмбеддинги из fake_openai, поэтому цифры
+воспроизводимы. Поиск — точный косинусный скан, как у pgvector без ANN-индекса.
+
+Для каждой конфигурации (chunk_size, chunk_overlap, top_k): recall@k, MRR, задержка
+поиска p50/p95, размер индекса (векторы float32 + текст) и объем контекста для LLM.
+Рекомендуется самая быстрая конфигурация с recall не ниже --recall-target; текущая
+из configs/<assistant>.yaml отмечена в отчете. Если ни одна не дотягивает, код выхода 1.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+import yaml
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+from api.loaders import load_documents  # noqa: E402
+from api.text_splitter import RecursiveCharacterTextSplitter  # noqa: E402
+from benchmarks.fake_openai import DEFAULT_DIMENSIONS, hashed_embedding  # noqa: E402
+
+GOLDEN_DIR = os.path.join(ROOT, "benchmarks", "golden")
+
+
+class Index(NamedTuple):
+    """Чанки с источниками и нормированная матрица их эмбеддингов."""
+    sources: List[str]
+    chunks: List[str]
+    vectors: np.ndarray
+    build_s: float
+
+    @property
+    def size_bytes(self) -> int:
+        return self.vectors.shape[0] * self.vectors.shape[1] * 4 + sum(len(c.encode("utf-8")) for c in self.chunks)
+
+
+def load_golden(assistant: str, golden_dir: str = GOLDEN_DIR) -> dict:
+    """Читает golden-набор и проверяет, что ожидаемые фрагменты действительно есть в источниках."""
+    with open(os.path.join(golden_dir, f"{assistant}.json"), encoding="utf-8") as fh:
+        golden = json.load(fh)
+    docs = os.path.join(ROOT, golden["docs"])
+    texts = {os.path.relpath(doc.source, docs): doc.content.casefold() for doc in load_documents(docs)}
+    for item in golden["questions"]:
+        if item["expected"].casefold() not in texts.get(item["source"], ""):
+            raise ValueError(f"{assistant}: '{item['expected']}' not found in {item['source']}")
+    golden["documents"] = docs
+    return golden
+
+
+def build_index(docs_path: str, chunk_size: int, chunk_overlap: int, dimensions: int = DEFAULT_DIMENSIONS) -> Index:
+    started = time.perf_counter()
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    sources, chunks = [], []
+    for doc in load_documents(docs_path):
+        for chunk in splitter.split_text(doc.content):
+            sources.append(os.path.relpath(doc.source, docs_path))
+            chunks.append(chunk)
+    vectors = np.array([hashed_embedding(c, dimensions) for c in chunks], dtype=np.float32)
+    return Index(sources, chunks, vectors, time.perf_counter() - started)
+
+
+def search(index: Index, query_vector: np.ndarray, top_k: int) -> List[int]:
+    """Точный поиск по косинусу (векторы уже нормированы), ближайшие первыми."""
+    scores = index.vectors @ query_vector
+    k = min(top_k, len(scores))
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best])].tolist()
+
+
+def _first_hit(index: Index, ids: List[int], item: dict) -> Optional[int]:
+    expected = item["expected"].casefold()
+    for rank, i in enumerate(ids, start=1):
+        if index.sources[i] == item["source"] and expected in index.chunks[i].casefold():
+            return rank
+    return None
+
+
+def _pct(ordered: List[float], p: float) -> float:
+    return ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000
+
+
+def evaluate(index: Index, questions: List[dict], top_k: int, dimensions: int = DEFAULT_DIMENSIONS, repeat: int = 5) -> dict:
+    hits, reciprocal, timings, context = 0, 0.0, [], 0
+    for item in questions:
+        query = np.array(hashed_embedding(item["question"], dimensions), dtype=np.float32)
+        for _ in range(repeat):
+            started = time.perf_counter()
+            ids = search(index, query, top_k)
+            timings.append(time.perf_counter() - started)
+        rank = _first_hit(index, ids, item)
+        if rank is not None:
+            hits += 1
+            reciprocal += 1 / rank
+        context += sum(len(index.chunks[i]) for i in ids)
+    timings.sort()
+    total = len(questions)
+    return {
+        "recall": round(hits / total, 4),
+        "mrr": round(reciprocal / total, 4),
+        "search_p50_ms": round(_pct(timings, 0.50), 4),
+        "search_p95_ms": round(_pct(timings, 0.95), 4),
+        "chunks": len(index.chunks),
+        "index_bytes": index.size_bytes,
+        "build_s": round(index.build_s, 3),
+        "context_chars": round(context / total),
+    }
+
+
+def current_config(assistant: str) -> Tuple[int, int, int]:
+    with open(os.path.join(ROOT, "configs", f"{assistant}.yaml"), encoding="utf-8") as fh:
+        retriever = (yaml.safe_load(fh) or {}).get("retriever", {})
+    return retriever.get("chunk_size", 1000), retriever.get("chunk_overlap", 200), retriever.get("top_k", 3)
+
+
+def sweep(
+    golden: dict,
+    chunk_sizes: List[int],
+    overlaps: List[int],
+    top_ks: List[int],
+    dimensions: int = DEFAULT_DIMENSIONS,
+    repeat: int = 5,
+    extra: Optional[Tuple[int, int, int]] = None,
+) -> List[dict]:
+    """Перебирает сетку конфигураций; индекс строится один раз на пару (chunk_size, chunk_overlap)."""
+    configs = {(size, overlap, k) for size in chunk_sizes for overlap in overlaps for k in top_ks if overlap < size}
+    if extra:
+        configs.add(extra)
+    indexes: Dict[Tuple[int, int], Index] = {}
+    results = []
+    for size, overlap, k in sorted(configs):
+        if (size, overlap) not in indexes:
+            indexes[(size, overlap)] = build_index(golden["documents"], size, overlap, dimensions)
+        metrics = evaluate(indexes[(size, overlap)], golden["questions"], k, dimensions, repeat)
+        results.append({"chunk_size": size, "chunk_overlap": overlap, "top_k": k, **metrics})
+    return results
+
+
+def recommend(results: List[dict], recall_target: float) -> Optional[dict]:
+    """Самая быстрая конфигурация с recall >= цели; при равной скорости — с меньшим контекстом и индексом."""
+    passing = [r for r in results if r["recall"] >= recall_target]
+    if not passing:
+        return None
+    return min(passing, key=lambda r: (r["search_p95_ms"], r["context_chars"], r["index_bytes"]))
+
+
+def _print_report(assistant: str, results: List[dict], current: Tuple[int, int, int], best: Optional[dict], target: float):
+    print(f"\n== {assistant} ==")
+    print(f"{'size':>6} {'ovl':>5} {'k':>3} {'recall':>7} {'mrr':>6} {'p50_ms':>8} {'p95_ms':>8} "
+          f"{'chunks':>7} {'index_kb':>9} {'ctx_chars':>9}")
+    for r in results:
+        key = (r["chunk_size"], r["chunk_overlap"], r["top_k"])
+        mark = " <- current" if key == current else ""
+        if best is r:
+            mark += " <- recommended"
+        print(f"{r['chunk_size']:>6} {r['chunk_overlap']:>5} {r['top_k']:>3} {r['recall']:>7.2f} {r['mrr']:>6.2f} "
+              f"{r['search_p50_ms']:>8.3f} {r['search_p95_ms']:>8.3f} {r['chunks']:>7} "
+              f"{r['index_bytes'] / 1024:>9.1f} {r['context_chars']:>9}{mark}")
+    if best is None:
+        print(f"No configuration reaches recall {target:.2f}.")
+
+
+def _ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval quality/latency sweep over golden sets")
+    parser.add_argument("--assistants", type=lambda s: s.split(","), default=["dental", "legal", "shop"])
+    parser.add_argument("--golden-dir", default=GOLDEN_DIR)
+    parser.add_argument("--chunk-sizes", type=_ints, default=[400, 800, 1200])
+    parser.add_argument("--overlaps", type=_ints, default=[0, 100, 200])
+    parser.add_argument("--top-k", type=_ints, default=[1, 3, 5])
+    parser.add_argument("--dimensions", type=int, default=DEFAULT_DIMENSIONS)
+    parser.add_argument("--repeat", type=int, default=20, help="повторов поиска на вопрос для замера задержки")
+    parser.add_argument("--recall-target", type=float, default=0.9)
+    parser.add_argument("--json", help="сохранить отчет в файл")
+    args = parser.parse_args()
+
+    report, missing = {}, []
+    for assistant in args.assistants:
+        golden = load_golden(assistant, args.golden_dir)
+        current = current_config(assistant)
+        results = sweep(golden, args.chunk_sizes, args.overlaps, args.top_k, args.dimensions, args.repeat, extra=current)
+        best = recommend(results, args.recall_target)
+        _print_report(assistant, results, current, best, args.recall_target)
+        if best is None:
+            missing.append(assistant)
+        report[assistant] = {
+            "current": dict(zip(("chunk_size", "chunk_overlap", "top_k"), current)),
+            "recommended": best,
+            "results": results,
+        }
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as fh:
+            json.dump({"recall_target": args.recall_target, "assistants": report}, fh, ensure_ascii=False, indent=2)
+    sys.exit(1 if missing else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,91 @@
 # bot/handlers_docs.py
 import asyncio
-import tempfile
-import os
 import logging
 from aiogram import Router, F
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, Message
 from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
 from aiogram import Bot
 
 import services
+from keyboards import get_docs_page_keyboard
+from relay import progress_reporter, relay_document
 
 router = Router(name="docs")
 logger = logging.getLogger(__name__)
 
+# Сколько последних фильтров /docs помнить в данных FSM для кнопки "Далее"
+DOCS_FILTERS_KEPT = 20
+
+
+def _format_docs_page(docs) -> str:
+    lines = []
+    for d in docs:
+        size_kb = (d.get("byte_size") or 0) / 1024
+        lines.append(f"📄 {d.get('id')}: {d.get('filename', 'unknown')} — {d.get('chunk_count', 0)} чанков, {size_kb:.1f} КБ")
+    return "\n".join(lines)
+
+
+async def _remember_filter(state: FSMContext, filter_id: str, prefix: str) -> None:
+    """Префикс в callback_data не помещается (64 байта), храним его в данных FSM."""
+    data = await state.get_data()
+    filters = dict(data.get("docs_filters") or {})
+    filters[filter_id] = prefix
+    await state.update_data(docs_filters=dict(list(filters.items())[-DOCS_FILTERS_KEPT:]))
+
 
 @router.message(Command("docs"))
-async def cmd_list_docs(message: Message):
-    docs = await asyncio.to_thread(services.get_documents)
-    if not docs:
+async def cmd_list_docs(message: Message, state: FSMContext):
+    """/docs [префикс имени] — первая страница документов, дальше — кнопкой."""
+    args = message.text.split(maxsplit=1)
+    prefix = args[1].strip() if len(args) > 1 else None
+    page = await asyncio.to_thread(services.get_documents, prefix=prefix)
+    if not page or not page.get("items"):
         await message.answer("📂 Документы не найдены.")
         return
+    filter_id = ""
+    if prefix and page.get("next_cursor"):
+        filter_id = str(message.message_id)
+        await _remember_filter(state, filter_id, prefix)
+    await message.answer(
+        _format_docs_page(page["items"]),
+        reply_markup=get_docs_page_keyboard(page.get("next_cursor"), filter_id),
+    )
 
-    lines = []
-    for d in docs:
-        doc_id = d.get("id") or d.get("doc_id") or d.get("_id") or str(d.get("id", "unknown"))
-        filename = d.get("filename") or d.get("name") or d.get("title") or "unknown"
-        lines.append(f"📄 {doc_id}: {filename}")
-    text = "\n".join(lines)
-    # Telegram ограничение на длину сообщения — при длинном списке можно отправлять частями
-    await message.answer(text[:3900])
+
+@router.callback_query(F.data.startswith("docs_page:"))
+async def cq_docs_page(callback: CallbackQuery, state: FSMContext):
+    _, cursor, filter_id = (callback.data.split(":", 2) + [""])[:3]
+    prefix = None
+    if filter_id:
+        prefix = ((await state.get_data()).get("docs_filters") or {}).get(filter_id)
+        if prefix is None:
+            # Без фильтра следующие страницы были бы шире первой
+            await callback.answer("Список устарел, повторите /docs.", show_alert=True)
+            return
+    page = await asyncio.to_thread(services.get_documents, cursor=cursor, prefix=prefix)
+    await callback.answer()
+    # Прошлую кнопку убираем, новая страница приходит отдельным сообщением
+    await callback.message.edit_reply_markup(reply_markup=None)
+    if not page or not page.get("items"):
+        return
+    await callback.message.answer(
+        _format_docs_page(page["items"]),
+        reply_markup=get_docs_page_keyboard(page.get("next_cursor"), filter_id),
+    )
 
 
 @router.message(F.document)
 async def handle_file(message: Message, bot: Bot):
     """
-    Пользователь присылает файл — сохраняем временно, отправляем в API в фоне.
+    Пользователь присылает файл — пересылаем его в API потоком, без временных файлов.
     """
     doc = message.document
-    # безопасный временный файл
-    suffix = os.path.splitext(doc.file_name or "")[1] or ""
-    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tf:
-        tmp_path = tf.name
-
-    # скачать файл
-    file_obj = await bot.get_file(doc.file_id)
-    await bot.download_file(file_obj.file_path, tmp_path)
-
-    # загружаем в background thread (embedding может занимать время)
-    await message.answer("⏳ Загружаю документ и создаю эмбеддинги... Это может занять время.")
-    res = await asyncio.to_thread(services.upload_document, tmp_path, doc.file_name)
-
-    # удаляем временный файл
-    try:
-        os.remove(tmp_path)
-    except Exception:
-        logger.exception("Не удалось удалить временный файл %s", tmp_path)
-
-    if res:
+    # embedding может занимать время — показываем прогресс загрузки
+    status = await message.answer("⏳ Загружаю документ и создаю эмбеддинги... Это может занять время.")
+    ok, _ = await relay_document(bot, doc, on_progress=progress_reporter(status))
+
+    if ok:
         await message.answer(f"✅ Документ {doc.file_name} загружен.")
     else:
         await message.answer("❌ Ошибка при загрузке документа. Посмотри логи сервера.")
@@ -90,6 +119,8 @@ async def cmd_get_doc(message: Message):
     await message.answer(
         f"📄 {doc.get('filename','unknown')}\n"
         f"ID: {doc.get('id')}\n"
-        f"Размер: {doc.get('size','?')} байт\n"
-        f"Дополнительно: {doc.get('meta', '')}"
+        f"Ассистент: {doc.get('assistant', '?')}\n"
+        f"Статус: {doc.get('status', '?')}\n"
+        f"Чанков: {doc.get('chunk_count', '?')}\n"
+        f"Размер: {doc.get('byte_size', '?')} байт"
     )
@@ -4,8 +4,10 @@ from aiogram.filters import CommandStart, Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from loguru import logger
+from logging_setup import redact
 from keyboards import get_assistants_keyboard, get_cancel_keyboard, get_main_menu
-from services import get_rag_response, upload_document_to_api
+from relay import progress_reporter, relay_document
+from services import get_rag_response
 
 # --- Инициализация ---
 router = Router()
@@ -53,19 +55,15 @@ async def handle_document(message: types.Message, state: FSMContext):
     user_data = await state.get_data()
     user_id = str(message.from_user.id)
 
-    await message.bot.send_chat_action(chat_id=message.chat.id, action='typing')
+    status = await message.answer("⏳ Загружаю документ...")
 
     try:
-        file = await message.bot.get_file(message.document.file_id)
-        file_content_bytes = await message.bot.download_file(file.file_path)
-        file_content = file_content_bytes.read().decode('utf-8')
-
-        # Вызов нового сервиса
-        success, api_message = await upload_document_to_api(
+        # Файл идет из Telegram в API потоком, не собираясь в памяти бота
+        success, api_message = await relay_document(
+            message.bot,
+            message.document,
             assistant="general",
-            file_name=message.document.file_name,
-            content=file_content,
-            user_id=user_id
+            on_progress=progress_reporter(status),
         )
 
         if success:
@@ -129,7 +127,7 @@ async def handle_user_query(message: types.Message, state: FSMContext):
     except Exception as e:
         logger.warning(f"Failed to send chat action: {e}")
 
-    logger.info(f"User {user_id} sent query: '{query}'")
+    logger.info("User {user_id} sent query: {query}", user_id=user_id, query=redact(query))
 
     # Получаем ответ от API
     api_response = await get_rag_response(
@@ -152,7 +150,7 @@ async def handle_user_query(message: types.Message, state: FSMContext):
     else:
         response_text = str(api_response)
 
-    logger.debug(f"Response for user {user_id}: {response_text}")
+    logger.opt(lazy=True).debug("Response for user {}: {}", lambda: user_id, lambda: redact(response_text))
     await message.answer(response_text + sources_text)
 
 
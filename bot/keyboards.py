@@ -1,5 +1,7 @@
 # bot/keyboards.py
 import os
+from typing import Optional
+
 import yaml
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton,\
     ReplyKeyboardMarkup, KeyboardButton
@@ -30,6 +32,19 @@ def get_cancel_keyboard() -> InlineKeyboardMarkup:
 
 
 
+def get_docs_page_keyboard(next_cursor: Optional[str], filter_id: str = "") -> Optional[InlineKeyboardMarkup]:
+    """
+    Кнопка следующей страницы списка документов; None, если страниц больше нет.
+    Telegram ограничивает callback_data 64 байтами, поэтому сам фильтр лежит в данных
+    FSM, а в кнопке — только курсор и номер фильтра.
+    """
+    if not next_cursor:
+        return None
+    callback_data = f"docs_page:{next_cursor}:{filter_id}"
+    buttons = [[InlineKeyboardButton(text="Далее ▶️", callback_data=callback_data)]]
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
 def get_main_menu():
     return ReplyKeyboardMarkup(
         keyboard=[
@@ -0,0 +1,91 @@
+# bot/logging_setup.py
+import hashlib
+import os
+import random
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# text | json (одна JSON-строка на запись, поля из extra — отдельными ключами)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Не больше стольких записей в секунду с одной строки кода; WARNING и выше не ограничиваются. 0 — без лимита
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", "20"))
+# 1 — писать вопросы и ответы пользователей как есть (только для отладки)
+LOG_USER_CONTENT = os.getenv("LOG_USER_CONTENT", "0") == "1"
+BOT_LOG_FILE = os.getenv("BOT_LOG_FILE", "logs/bot.log")
+BOT_LOG_FILE_LEVEL = os.getenv("BOT_LOG_FILE_LEVEL", "DEBUG")
+
+_WARNING = 30
+# Формат loguru по умолчанию; пометка о подавленных записях добавляется после сообщения
+_TEXT_FORMAT = (
+    "<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level: <8}</level> | "
+    "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+)
+
+
+def redact(text: Optional[str]) -> str:
+    """Текст пользователя для лога: длина и короткий хеш вместо содержимого."""
+    if text is None:
+        return "None"
+    if LOG_USER_CONTENT:
+        return text
+    digest = hashlib.blake2b(text.encode("utf-8"), digest_size=4).hexdigest()
+    return f"<{len(text)} chars #{digest}>"
+
+
+class LogFilter:
+    """Выборка по extra["sample"] и лимит записей в секунду на строку кода (как в API)."""
+
+    def __init__(self, rate_limit: float = LOG_RATE_LIMIT, seed: Optional[int] = None):
+        self.rate_limit = rate_limit
+        self.random = random.Random(seed)
+        self._windows: Dict[Tuple[str, int], list] = {}
+        # Запись общая для всех sink'ов, поэтому число подавленных передается в format() не через нее
+        self._local = threading.local()
+
+    def __call__(self, record: dict) -> bool:
+        self._local.suppressed = 0
+        if record["level"].no >= _WARNING:
+            return True
+        sample = record["extra"].get("sample")
+        if sample is not None and self.random.random() >= sample:
+            return False
+        if not self.rate_limit:
+            return True
+
+        key = (record["name"], record["line"])
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= 1.0:
+            suppressed = window[2] if window else 0
+            window = self._windows[key] = [now, 0, 0]
+            self._local.suppressed = suppressed
+        if window[1] >= self.rate_limit:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
+
+    def format(self, record: dict) -> str:
+        """Формат sink'а: loguru вызывает его в том же потоке сразу после фильтра."""
+        suppressed = getattr(self._local, "suppressed", 0)
+        note = f" [+{suppressed} suppressed]" if suppressed else ""
+        return _TEXT_FORMAT + note + "\n{exception}"
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT, file_path: Optional[str] = BOT_LOG_FILE) -> None:
+    """stderr и файл пишутся из фонового потока (enqueue=True), цикл событий не блокируется."""
+    logger.remove()
+    options = dict(enqueue=True, serialize=fmt == "json", backtrace=False, diagnose=False)
+    stderr_filter = LogFilter()
+    logger.add(sys.stderr, level=level, filter=stderr_filter, format=stderr_filter.format, **options)
+    if file_path:
+        file_filter = LogFilter()
+        logger.add(
+            file_path, level=BOT_LOG_FILE_LEVEL, rotation="10 MB", compression="zip",
+            filter=file_filter, format=file_filter.format, **options,
+        )
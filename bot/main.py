@@ -3,42 +3,94 @@ import asyncio
 import os
 import sys
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from dotenv import load_dotenv
+# Загрузка переменных окружения (до импорта модулей, читающих их при импорте)
+load_dotenv()
+
 from loguru import logger
 from handlers_order import router as order_router
 from handler_docs import router as docs_router
-# Загрузка переменных окружения
-load_dotenv()
+from logging_setup import configure_logging
+from middlewares import ChatOrderingIsolation, ChatOrderingMiddleware, HandlerProfilingMiddleware
+from scheduler import ChatScheduler
+from sender import OutboundLimiter
+from storage import create_storage
 
 # --- Конфигурация --- 
 TOKEN = os.getenv("TELEGRAM_TOKEN")
 API_URL = os.getenv("API_URL")
+# polling — одна реплика; webhook — несколько реплик за балансировщиком
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Альтернативный Bot API сервер (например, benchmarks/fake_telegram.py для нагрузочных тестов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 
 # --- Логирование ---
-logger.remove()
-logger.add(sys.stderr, level="INFO")
-logger.add("logs/bot.log", level="DEBUG", rotation="10 MB", compression="zip")
+configure_logging()
 
 
-async def main():
-    """Основная функция запуска бота."""
-    if not TOKEN or not API_URL:
-        logger.error("TELEGRAM_TOKEN или API_URL не установлены в .env файле.")
-        return
+def create_bot() -> Bot:
+    session = None
+    if TELEGRAM_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    bot = Bot(token=TOKEN, parse_mode="HTML", session=session)
+    # Все исходящие вызовы Bot API идут через лимиты Telegram
+    bot.session.middleware(OutboundLimiter())
+    return bot
+
+
+def create_dispatcher() -> Dispatcher:
+    scheduler = ChatScheduler()
+    # Порядок внутри чата и общий лимит параллельности для всех роутеров: очередь чата
+    # держится как изоляция событий FSM, и состояние читается, когда очередь подошла
+    dp = Dispatcher(
+        storage=create_storage(),
+        events_isolation=ChatOrderingIsolation(scheduler),
+        disable_fsm=True,
+        scheduler=scheduler,
+    )
+    # FSM подключаем сами, после ChatOrderingMiddleware: отброшенный очередью апдейт
+    # доходит до него исключением из lock() изоляции
+    dp.update.outer_middleware(ChatOrderingMiddleware())
+    dp.update.outer_middleware(dp.fsm)
+    # Профиль хендлера снимается внутри задачи чата, поэтому в нем только сама обработка
+    profiling = HandlerProfilingMiddleware()
+    dp.message.middleware(profiling)
+    dp.callback_query.middleware(profiling)
 
-    bot = Bot(token=TOKEN, parse_mode="HTML")
-    dp = Dispatcher(storage=MemoryStorage())
-    
     # Подключаем роутер с хендлерами
     dp.include_router(order_router)
     dp.include_router(docs_router)
+
+    async def on_startup():
+        dp["scheduler_report"] = asyncio.create_task(scheduler.report())
+
+    async def on_shutdown():
+        dp["scheduler_report"].cancel()
+
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+    return dp
+
+
+async def main():
+    """Основная функция запуска бота (long polling)."""
+    bot = create_bot()
+    dp = create_dispatcher()
     logger.info("Starting Telegram bot...")
     await bot.delete_webhook(drop_pending_updates=True)
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
+    if not TOKEN or not API_URL:
+        logger.error("TELEGRAM_TOKEN или API_URL не установлены в .env файле.")
+        sys.exit(1)
     try:
-        asyncio.run(main())
+        if BOT_MODE == "webhook":
+            from webhook import run_webhook
+            run_webhook(create_bot(), create_dispatcher())
+        else:
+            asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         logger.info("Bot stopped.")
\ No newline at end of file
@@ -0,0 +1,148 @@
+# bot/middlewares.py
+import asyncio
+import os
+import random
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+from aiogram.types import TelegramObject, Update
+from loguru import logger
+
+from scheduler import ChatScheduler, Dropped, Superseded
+
+# Профилирование хендлеров: доля апдейтов и telegram id, чьи апдейты профилируются всегда
+BOT_PROFILE_SAMPLE_RATE = float(os.getenv("BOT_PROFILE_SAMPLE_RATE", "0"))
+BOT_PROFILE_USERS = {uid.strip() for uid in os.getenv("BOT_PROFILE_USERS", "").split(",") if uid.strip()}
+BOT_PROFILE_DIR = os.getenv("BOT_PROFILE_DIR", "profiles/bot")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.001"))
+
+BUSY_TEXT = "⏳ Я еще отвечаю на ваши предыдущие сообщения. Подождите немного и повторите вопрос."
+
+# Можно ли схлопнуть текущий апдейт: выставляет ChatOrderingMiddleware, читает ChatOrderingIsolation
+_coalescible: ContextVar[bool] = ContextVar("coalescible", default=False)
+
+
+class ChatOrderingIsolation(BaseEventIsolation):
+    """
+    Изоляция событий FSM через ChatScheduler. FSMContextMiddleware читает состояние
+    уже внутри lock(), поэтому апдейт, дождавшийся очереди чата, видит состояние,
+    выставленное предыдущим хендлером (например, файл сразу после /upload).
+    """
+
+    def __init__(self, scheduler: ChatScheduler):
+        self.scheduler = scheduler
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        async with self.scheduler.turn(key.chat_id, coalescible=_coalescible.get()):
+            yield
+
+    async def close(self) -> None:
+        pass
+
+
+class ChatOrderingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware апдейтов, стоит перед FSMContextMiddleware: помечает текстовые
+    вопросы (не команды) как схлопываемые и отвечает пользователю, если апдейт
+    отброшен очередью чата. Саму очередь держит ChatOrderingIsolation.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        context = data.get("event_context")
+        chat_id = (context.chat_id or context.user_id) if context else None
+        if chat_id is None:
+            return await handler(event, data)
+
+        message = event.message if isinstance(event, Update) else None
+        token = _coalescible.set(bool(message and message.text and not message.text.startswith("/")))
+        try:
+            return await handler(event, data)
+        except Superseded:
+            logger.info(f"Query in chat {chat_id} superseded by a newer one.")
+            return UNHANDLED
+        except Dropped as e:
+            logger.info(f"Update {getattr(event, 'update_id', '?')} for chat {chat_id} dropped: {e}")
+            if message:
+                try:
+                    await message.answer(BUSY_TEXT)
+                except Exception as send_error:
+                    logger.warning(f"Failed to notify chat {chat_id} about dropped update: {send_error}")
+            return UNHANDLED
+        finally:
+            _coalescible.reset(token)
+
+
+class HandlerProfilingMiddleware(BaseMiddleware):
+    """
+    Внутренний middleware: снимает профиль хендлера pyinstrument'ом (опциональная
+    зависимость) для апдейтов из BOT_PROFILE_USERS или с вероятностью BOT_PROFILE_SAMPLE_RATE.
+    Профили в формате speedscope пишутся в BOT_PROFILE_DIR.
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = BOT_PROFILE_SAMPLE_RATE,
+        users: set = BOT_PROFILE_USERS,
+        directory: str = BOT_PROFILE_DIR,
+    ):
+        self.sample_rate = sample_rate
+        self.users = users
+        self.directory = directory
+        self.random = random.Random()
+        self._profiler_cls = None
+        if sample_rate or users:
+            try:
+                from pyinstrument import Profiler
+                self._profiler_cls = Profiler
+            except ImportError:
+                logger.warning("Bot profiling is configured but pyinstrument is not installed: pip install pyinstrument")
+
+    def _should_profile(self, data: Dict[str, Any]) -> bool:
+        if self._profiler_cls is None:
+            return False
+        user = data.get("event_from_user")
+        if user is not None and str(user.id) in self.users:
+            return True
+        return self.sample_rate > 0 and self.random.random() < self.sample_rate
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if not self._should_profile(data):
+            return await handler(event, data)
+
+        profiler = self._profiler_cls(interval=PROFILE_INTERVAL, async_mode="enabled")
+        profiler.start()
+        try:
+            return await handler(event, data)
+        finally:
+            profiler.stop()
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{type(event).__name__}-{self.random.getrandbits(32):08x}"
+            try:
+                path = await asyncio.to_thread(self._write, profiler, name)
+                logger.info(f"Saved handler profile {path} ({profiler.last_session.duration:.3f}s).")
+            except Exception as e:
+                logger.warning(f"Failed to save handler profile {name}: {e}")
+
+    def _write(self, profiler, name: str) -> str:
+        from pyinstrument.renderers import SpeedscopeRenderer
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{name}.speedscope.json")
+        with open(path, "w", encoding="utf-8") as fh:
+            fh.write(profiler.output(renderer=SpeedscopeRenderer()))
+        return path
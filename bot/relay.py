@@ -0,0 +1,145 @@
+# bot/relay.py
+import asyncio
+import os
+import secrets
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional, Tuple
+
+import httpx
+from aiogram import Bot
+from aiogram.types import Document
+from loguru import logger
+
+from services import API_URL, auth_manager
+
+RELAY_CHUNK_SIZE = int(os.getenv("RELAY_CHUNK_SIZE", str(64 * 1024)))
+# Сколько чанков может лежать между скачиванием и отправкой (память на одну загрузку)
+RELAY_BUFFER_CHUNKS = int(os.getenv("RELAY_BUFFER_CHUNKS", "4"))
+RELAY_MAX_CONCURRENT = int(os.getenv("RELAY_MAX_CONCURRENT", "16"))
+RELAY_TIMEOUT = float(os.getenv("RELAY_TIMEOUT", "300"))
+
+ProgressCallback = Callable[[int, Optional[int]], Awaitable[None]]
+
+_relay_slots = asyncio.Semaphore(RELAY_MAX_CONCURRENT)
+_EOF = object()
+
+
+def _quote(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', "%22").replace("\r", "%0D").replace("\n", "%0A")
+
+
+async def _download(bot: Bot, file_path: str, queue: asyncio.Queue) -> None:
+    """Качает файл из Telegram чанками в ограниченную очередь."""
+    try:
+        url = bot.session.api.file_url(bot.token, file_path)
+        async for chunk in bot.session.stream_content(
+            url=url, timeout=int(RELAY_TIMEOUT), chunk_size=RELAY_CHUNK_SIZE, raise_for_status=True
+        ):
+            await queue.put(chunk)
+        await queue.put(_EOF)
+    except Exception as e:
+        await queue.put(e)
+
+
+async def _multipart_body(
+    queue: asyncio.Queue,
+    boundary: str,
+    file_name: str,
+    assistant: str,
+    total: Optional[int],
+    on_progress: Optional[ProgressCallback],
+) -> AsyncIterator[bytes]:
+    yield (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="assistant"\r\n\r\n{assistant}\r\n'
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{_quote(file_name)}"\r\n'
+        f"Content-Type: text/plain\r\n\r\n"
+    ).encode("utf-8")
+
+    sent, last_report = 0, 0.0
+    while True:
+        item = await queue.get()
+        if item is _EOF:
+            break
+        if isinstance(item, Exception):
+            raise item
+        yield item
+        sent += len(item)
+        now = time.monotonic()
+        if on_progress and now - last_report >= 1.0:
+            last_report = now
+            await on_progress(sent, total)
+
+    yield f"\r\n--{boundary}--\r\n".encode("utf-8")
+    if on_progress:
+        await on_progress(sent, total)
+
+
+async def relay_document(
+    bot: Bot,
+    document: Document,
+    assistant: str = "general",
+    on_progress: Optional[ProgressCallback] = None,
+) -> Tuple[bool, str]:
+    """
+    Потоково пересылает документ из Telegram в POST /api/documents.
+    Файл не собирается в памяти целиком: скачивание и multipart-загрузка
+    связаны очередью из RELAY_BUFFER_CHUNKS чанков.
+    """
+    auth_header = await auth_manager.get_auth_header()
+    if not auth_header:
+        return False, "Ошибка аутентификации бота."
+
+    file_name = document.file_name or f"{document.file_unique_id}.txt"
+    async with _relay_slots:
+        file = await bot.get_file(document.file_id)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=RELAY_BUFFER_CHUNKS)
+        downloader = asyncio.create_task(_download(bot, file.file_path, queue))
+        boundary = f"relay{secrets.token_hex(16)}"
+        body = _multipart_body(queue, boundary, file_name, assistant, document.file_size, on_progress)
+
+        logger.info(f"Relaying document '{file_name}' ({document.file_size} bytes) to API for assistant '{assistant}'.")
+        try:
+            async with httpx.AsyncClient(timeout=RELAY_TIMEOUT) as client:
+                response = await client.post(
+                    f"{API_URL}/api/documents",
+                    content=body,
+                    headers={**auth_header, "Content-Type": f"multipart/form-data; boundary={boundary}"},
+                )
+            response.raise_for_status()
+            return True, response.json().get("filename", file_name)
+        except httpx.HTTPStatusError as e:
+            try:
+                error_message = e.response.json().get("detail", e.response.text)
+            except ValueError:
+                error_message = e.response.text
+            logger.error(f"API error while relaying document: {error_message}")
+            return False, error_message
+        except Exception:
+            logger.exception(f"Failed to relay document '{file_name}'.")
+            return False, "Внутренняя ошибка сервера."
+        finally:
+            downloader.cancel()
+            await asyncio.gather(downloader, return_exceptions=True)
+
+
+def progress_reporter(status_message) -> ProgressCallback:
+    """Колбэк прогресса, который редактирует сервисное сообщение в чате."""
+    last_text = None
+
+    async def _report(sent: int, total: Optional[int]) -> None:
+        nonlocal last_text
+        if total:
+            text = f"⏳ Загружено {min(100, sent * 100 // total)}% ({sent / 1_048_576:.1f} из {total / 1_048_576:.1f} МБ)"
+        else:
+            text = f"⏳ Загружено {sent / 1_048_576:.1f} МБ"
+        if text == last_text:
+            return
+        last_text = text
+        try:
+            await status_message.edit_text(text)
+        except Exception as e:
+            logger.debug(f"Failed to update upload progress: {e}")
+
+    return _report
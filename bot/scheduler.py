@@ -0,0 +1,160 @@
+# bot/scheduler.py
+import asyncio
+import os
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Hashable
+
+from loguru import logger
+
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", "64"))
+CHAT_MAX_PENDING = int(os.getenv("CHAT_MAX_PENDING", "2000"))
+CHAT_QUEUE_LIMIT = int(os.getenv("CHAT_QUEUE_LIMIT", "3"))
+# coalesce — новый вопрос вытесняет самый старый ожидающий; drop — новый вопрос отклоняется
+CHAT_OVERFLOW_POLICY = os.getenv("CHAT_OVERFLOW_POLICY", "coalesce")
+
+
+class Dropped(Exception):
+    """Задача не будет выполнена: очередь переполнена."""
+
+
+class Superseded(Dropped):
+    """Ожидающий вопрос вытеснен более новым вопросом из того же чата."""
+
+
+class _Ticket:
+    __slots__ = ("future", "coalescible")
+
+    def __init__(self, future: asyncio.Future, coalescible: bool):
+        self.future = future
+        self.coalescible = coalescible
+
+
+class _Lane:
+    __slots__ = ("busy", "waiting")
+
+    def __init__(self):
+        self.busy = False
+        self.waiting: Deque[_Ticket] = deque()
+
+
+class ChatScheduler:
+    """
+    Модель конкуренции для апдейтов бота.
+
+    Задачи одного чата выполняются строго по очереди, разные чаты — параллельно,
+    но не более `max_concurrency` одновременно. Очередь каждого чата ограничена
+    `queue_limit` ожидающими задачами, общая — `max_pending`. При переполнении
+    очереди чата новый вопрос либо вытесняет самый старый ожидающий вопрос
+    (coalesce), либо отклоняется (drop).
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = CHAT_MAX_CONCURRENCY,
+        max_pending: int = CHAT_MAX_PENDING,
+        queue_limit: int = CHAT_QUEUE_LIMIT,
+        overflow_policy: str = CHAT_OVERFLOW_POLICY,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.queue_limit = queue_limit
+        self.overflow_policy = overflow_policy
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._lanes: Dict[Hashable, _Lane] = {}
+        self._pending = 0
+        self._running = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.completed = 0
+
+    async def run(self, chat_id: Hashable, call: Callable[[], Awaitable[Any]], coalescible: bool = False) -> Any:
+        """Выполняет call() в очереди чата. Бросает Dropped, если задача не будет выполнена."""
+        async with self.turn(chat_id, coalescible):
+            return await call()
+
+    @asynccontextmanager
+    async def turn(self, chat_id: Hashable, coalescible: bool = False) -> AsyncIterator[None]:
+        """Очередь чата как контекстный менеджер: тело выполняется, когда подошла очередь."""
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = _Lane()
+
+        if lane.busy:
+            await self._wait_turn(chat_id, lane, coalescible)
+        else:
+            lane.busy = True
+
+        try:
+            async with self._semaphore:
+                self._running += 1
+                try:
+                    yield
+                finally:
+                    self._running -= 1
+                    self.completed += 1
+        finally:
+            self._release(chat_id, lane)
+
+    async def _wait_turn(self, chat_id: Hashable, lane: _Lane, coalescible: bool) -> None:
+        if self._pending >= self.max_pending:
+            self.dropped += 1
+            raise Dropped("scheduler queue is full")
+
+        if len(lane.waiting) >= self.queue_limit:
+            victim = None
+            if self.overflow_policy == "coalesce" and coalescible:
+                victim = next((t for t in lane.waiting if t.coalescible), None)
+            if victim is None:
+                self.dropped += 1
+                raise Dropped(f"queue of chat {chat_id} is full")
+            lane.waiting.remove(victim)
+            self._pending -= 1
+            self.coalesced += 1
+            victim.future.set_exception(Superseded("superseded by a newer query"))
+
+        ticket = _Ticket(asyncio.get_running_loop().create_future(), coalescible)
+        lane.waiting.append(ticket)
+        self._pending += 1
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket in lane.waiting:
+                lane.waiting.remove(ticket)
+                self._pending -= 1
+            elif ticket.future.done() and not ticket.future.cancelled() and ticket.future.exception() is None:
+                # Очередь уже передана нам, но мы отменены — отдаем ее следующему
+                self._release(chat_id, lane)
+            raise
+
+    def _release(self, chat_id: Hashable, lane: _Lane) -> None:
+        while lane.waiting:
+            ticket = lane.waiting.popleft()
+            self._pending -= 1
+            if not ticket.future.done():
+                # Передаем очередь следующему, не снимая флаг busy
+                ticket.future.set_result(None)
+                return
+        lane.busy = False
+        if self._lanes.get(chat_id) is lane:
+            del self._lanes[chat_id]
+
+    def stats(self) -> dict:
+        depths = [len(lane.waiting) for lane in self._lanes.values()]
+        return {
+            "pending": self._pending,
+            "running": self._running,
+            "active_chats": len(self._lanes),
+            "max_chat_depth": max(depths, default=0),
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "completed": self.completed,
+        }
+
+    async def report(self, interval: float = 60.0) -> None:
+        """Периодически пишет в лог глубину очередей."""
+        while True:
+            await asyncio.sleep(interval)
+            stats = self.stats()
+            if stats["pending"] or stats["running"] or stats["dropped"]:
+                logger.info(f"Chat scheduler: {stats}")
@@ -0,0 +1,305 @@
+# bot/sender.py
+import asyncio
+import heapq
+import itertools
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.default import Default
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    AnswerCallbackQuery,
+    Response,
+    SendChatAction,
+    SendMessage,
+    TelegramMethod,
+)
+from aiogram.methods.base import TelegramType
+from loguru import logger
+
+# Лимиты Telegram: ~30 сообщений/с на бота, ~1/с в личный чат, ~20/мин в группу
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "30"))
+SEND_PRIVATE_RATE = float(os.getenv("SEND_PRIVATE_RATE", "1"))
+SEND_PRIVATE_BURST = int(os.getenv("SEND_PRIVATE_BURST", "3"))
+SEND_GROUP_RATE = float(os.getenv("SEND_GROUP_RATE", str(20 / 60)))
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+# Индикатор "печатает" теряет смысл, если ждет отправки дольше этого времени
+CHAT_ACTION_MAX_WAIT = float(os.getenv("CHAT_ACTION_MAX_WAIT", "3"))
+MESSAGE_LIMIT = 4096
+
+PRIORITY_HIGH = 0    # ответы на callback-кнопки
+PRIORITY_NORMAL = 1  # ответы пользователю
+PRIORITY_LOW = 2     # send_chat_action
+
+_HTML_TAG = re.compile(r"<(/?)([\w-]+)[^>]*>")
+_HTML_ENTITY = re.compile(r"&#?\w+;")
+
+
+def _find_cut(text: str, limit: int) -> int:
+    cut = -1
+    for separator in ("\n\n", "\n", " "):
+        cut = text.rfind(separator, 0, limit)
+        if cut > limit // 2:
+            break
+    return cut if cut > 0 else limit
+
+
+def _html_safe_cut(text: str, cut: int) -> int:
+    """Сдвигает разрез за пределы тега или сущности (&amp;). Литерал < в HTML Telegram всегда экранирован."""
+    start = text.rfind("<", 0, cut)
+    if start > text.rfind(">", 0, cut):
+        if start > 0:
+            return start
+        # Тег длиннее части целиком не разрезать — берем его полностью
+        end = text.find(">", start)
+        return end + 1 if end >= 0 else len(text)
+    start = text.rfind("&", 0, cut)
+    entity = _HTML_ENTITY.match(text, start) if start >= 0 else None
+    if entity and entity.end() > cut:
+        return start if start > 0 else entity.end()
+    return cut
+
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """Режет длинный текст на части не длиннее limit, по возможности по абзацам и строкам."""
+    parts = []
+    while len(text) > limit:
+        cut = _find_cut(text, limit)
+        parts.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+def split_html(text: str, limit: int = MESSAGE_LIMIT) -> List[str]:
+    """
+    То же для parse_mode=HTML: режет только вне тегов и сущностей (&amp;), незакрытые
+    теги закрывает в конце части и открывает заново в начале следующей.
+    """
+    parts = []
+    opened: List[tuple] = []  # (имя, открывающий тег), действующие на начало text
+    while True:
+        prefix = "".join(tag for _, tag in opened)
+        if len(prefix) + len(text) <= limit:
+            if text.strip():
+                parts.append(prefix + text)
+            return parts
+        budget = limit - len(prefix)
+        while True:
+            cut = _html_safe_cut(text, _find_cut(text, budget))
+            stack = list(opened)
+            for tag in _HTML_TAG.finditer(text, 0, cut):
+                closing, name = tag.group(1), tag.group(2).lower()
+                if not closing:
+                    stack.append((name, tag.group(0)))
+                else:
+                    for i in range(len(stack) - 1, -1, -1):
+                        if stack[i][0] == name:
+                            del stack[i]
+                            break
+            suffix = "".join(f"</{name}>" for name, _ in reversed(stack))
+            overflow = len(prefix) + cut + len(suffix) - limit
+            if overflow <= 0 or budget <= overflow:
+                break
+            budget -= overflow
+        parts.append(prefix + text[:cut].rstrip() + suffix)
+        text = text[cut:].lstrip()
+        opened = stack
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше burst за раз."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Сколько ждать до следующего токена (0 — токен есть)."""
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    async def acquire(self) -> None:
+        while (wait := self.delay()) > 0:
+            await asyncio.sleep(wait)
+        self.take()
+
+    def block(self, seconds: float) -> None:
+        """Flood control от Telegram: ничего не отправляем seconds секунд."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class PriorityGate:
+    """Глобальное ведро токенов, раздающее токены ожидающим в порядке приоритета."""
+
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, burst)
+        self._heap = []
+        self._seq = itertools.count()
+        self._pump_task: Optional[asyncio.Task] = None
+
+    async def acquire(self, priority: int) -> None:
+        if not self._heap and self.bucket.delay() == 0:
+            self.bucket.take()
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self) -> None:
+        while self._heap:
+            wait = self.bucket.delay()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, future = heapq.heappop(self._heap)
+            if future.done():
+                continue
+            self.bucket.take()
+            future.set_result(None)
+
+    def depth(self) -> int:
+        return len(self._heap)
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: все исходящие вызовы Bot API (message.answer,
+    send_chat_action, edit_text и т.д.) проходят через общий лимит и лимит чата.
+    Ответы идут раньше индикаторов набора, TelegramRetryAfter обрабатывается
+    повтором, длинные сообщения делятся на части по 4096 символов.
+    """
+
+    def __init__(self, max_chats: int = 100_000):
+        self.gate = PriorityGate(SEND_GLOBAL_RATE, SEND_GLOBAL_RATE)
+        self._chats: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._max_chats = max_chats
+        self.retries = 0
+        self.dropped_actions = 0
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or int(chat_id) < 0
+            bucket = TokenBucket(SEND_GROUP_RATE, 1) if is_group else TokenBucket(SEND_PRIVATE_RATE, SEND_PRIVATE_BURST)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self._max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    @staticmethod
+    def _priority(method: TelegramMethod) -> int:
+        if isinstance(method, SendChatAction):
+            return PRIORITY_LOW
+        if isinstance(method, AnswerCallbackQuery):
+            return PRIORITY_HIGH
+        return PRIORITY_NORMAL
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if isinstance(method, SendMessage) and len(method.text) > MESSAGE_LIMIT:
+            response = await self._send_split(make_request, bot, method)
+            if response is not None:
+                return response
+
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None and not isinstance(method, AnswerCallbackQuery):
+            # getFile, setWebhook и т.п. — не ограничиваем
+            return await make_request(bot, method)
+
+        priority = self._priority(method)
+        for attempt in range(SEND_MAX_RETRIES + 1):
+            started = time.monotonic()
+            chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+            # Лимит чата касается сообщений; индикатор набора ограничиваем только глобально
+            if chat_bucket is not None and priority == PRIORITY_NORMAL:
+                await chat_bucket.acquire()
+            await self.gate.acquire(priority)
+
+            if priority == PRIORITY_LOW and time.monotonic() - started > CHAT_ACTION_MAX_WAIT:
+                self.dropped_actions += 1
+                return Response(ok=True, result=True)
+
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == SEND_MAX_RETRIES:
+                    raise
+                self.retries += 1
+                logger.warning(f"Flood control on {type(method).__name__} (chat {chat_id}), retry in {e.retry_after}s")
+                if chat_bucket is not None:
+                    chat_bucket.block(e.retry_after)
+                else:
+                    self.gate.bucket.block(e.retry_after)
+                if priority == PRIORITY_LOW:
+                    self.dropped_actions += 1
+                    return Response(ok=True, result=True)
+
+    async def _send_split(self, make_request, bot: Bot, method: SendMessage) -> Optional[Response]:
+        """Длинное сообщение частями. None — резать нельзя, сообщение уходит как есть."""
+        if method.entities:
+            # Смещения entities пришлось бы пересчитывать для каждой части
+            logger.warning(f"Message to chat {method.chat_id} with entities is too long, sending it unsplit.")
+            return None
+        parse_mode = method.parse_mode
+        if isinstance(parse_mode, Default):
+            parse_mode = bot.default[parse_mode.name] if bot is not None else None
+        update = {}
+        if parse_mode == ParseMode.HTML:
+            parts = split_html(method.text)
+        else:
+            parts = split_text(method.text)
+            if parse_mode:
+                # Разметку Markdown по частям не сбалансировать: отправляем как текст
+                logger.warning(f"Sending a long {parse_mode} message to chat {method.chat_id} as plain text.")
+                update["parse_mode"] = None
+        response = None
+        for i, part in enumerate(parts):
+            is_last = i == len(parts) - 1
+            chunk = method.model_copy(update={
+                **update,
+                "text": part,
+                # Клавиатуру прикрепляем только к последней части
+                "reply_markup": method.reply_markup if is_last else None,
+            })
+            response = await self(make_request, bot, chunk)
+        return response
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "queued": self.gate.depth(),
+            "chats": len(self._chats),
+            "retries": self.retries,
+            "dropped_actions": self.dropped_actions,
+        }
@@ -8,9 +8,12 @@ logger = logging.getLogger(__name__)
 import httpx
 import os
 from loguru import logger
+from logging_setup import redact
 import asyncio
 
 API_URL = os.getenv("API_URL", "http://api:8000")
+# Документов на одной странице /docs
+DOCS_PAGE_SIZE = int(os.getenv("DOCS_PAGE_SIZE", "20"))
 
 class AuthManager:
     """Handles authentication for the bot against the API."""
@@ -63,7 +66,7 @@ async def get_rag_response(query: str, user_id: str, assistant: str = "general")
         "assistant": assistant
     }
 
-    logger.info(f"Sending request to RAG API for user {user_id}")
+    logger.debug("Sending request to RAG API for user {user_id}", user_id=user_id)
     auth_header = await auth_manager.get_auth_header()
     if not auth_header:
         return {"response": "Ошибка аутентификации бота. Проверьте конфигурацию сервисного аккаунта."}
@@ -73,7 +76,9 @@ async def get_rag_response(query: str, user_id: str, assistant: str = "general")
             response = await client.post(url, json=payload, headers=auth_header)
             response.raise_for_status()
             data = response.json()
-            logger.info(f"RAG API response: {data}")
+            logger.opt(lazy=True).debug(
+                "RAG API response for user {}: {}", lambda: user_id, lambda: redact(str(data))
+            )
             return data
     except httpx.HTTPStatusError as e:
         logger.error(
@@ -87,32 +92,6 @@ async def get_rag_response(query: str, user_id: str, assistant: str = "general")
         return {"response": "Сервис API временно недоступен."}
 
 
-async def upload_document_to_api(file_name: str, content: str, user_id: str, assistant: str = "general"):
-    """Отправка документа в API для обработки и эмбеддинга."""
-    url = f"{API_URL}/api/documents"
-
-    auth_header = await auth_manager.get_auth_header()
-    if not auth_header:
-        return False, "Ошибка аутентификации бота."
-
-    data = {"assistant": assistant}
-    files = {"file": (file_name, content, "text/plain")}
-
-    logger.info(f"Sending document '{file_name}' to API for assistant '{assistant}'.")
-    try:
-        async with httpx.AsyncClient(timeout=120) as client:
-            response = await client.post(url, data=data, files=files, headers=auth_header)
-            response.raise_for_status()
-            return True, response.json().get("filename", "Успешно")
-    except httpx.HTTPStatusError as e:
-        error_message = e.response.json().get("detail", e.response.text)
-        logger.error(f"API error while uploading document: {error_message}")
-        return False, error_message
-    except Exception as e:
-        logger.exception("Failed to upload document to API.")
-        return False, "Внутренняя ошибка сервера."
-
-
 def _normalize_auth_headers() -> Dict[str, str]:
     """
     Берёт токен из асинхронного AuthManager и возвращает dict для requests.
@@ -141,24 +120,24 @@ def _normalize_auth_headers() -> Dict[str, str]:
         return {}
 
 
-def get_documents() -> Optional[List[Dict[str, Any]]]:
+def get_documents(cursor: Optional[str] = None, limit: int = DOCS_PAGE_SIZE, prefix: Optional[str] = None) -> Optional[Dict[str, Any]]:
     """
-    Получить список документов. Возвращает JSON (список) или None в случае ошибки.
-    Пробует два пути: /documents и /documents/list (на случай различий в API).
+    Получить страницу документов: {"items": [...], "next_cursor": ...} или None в случае ошибки.
+    Следующая страница — тот же вызов с cursor=next_cursor.
     """
-    for suffix in ("/documents", "/documents/list"):
-        url = API_URL.rstrip("/") + suffix
-        try:
-            resp = requests.get(url, headers=_normalize_auth_headers(), timeout=10)
-            if resp.status_code == 200:
-                return resp.json()
-            if resp.status_code == 404:
-                continue
-            logger.error("get_documents: %s %s", resp.status_code, resp.text)
-            return None
-        except Exception:
-            logger.exception("get_documents error")
-            return None
+    url = f"{API_URL.rstrip('/')}/api/documents"
+    params = {"limit": limit}
+    if cursor:
+        params["cursor"] = cursor
+    if prefix:
+        params["prefix"] = prefix
+    try:
+        resp = requests.get(url, params=params, headers=_normalize_auth_headers(), timeout=10)
+        if resp.status_code == 200:
+            return resp.json()
+        logger.error("get_documents: %s %s", resp.status_code, resp.text)
+    except Exception:
+        logger.exception("get_documents error")
     return None
 
 
@@ -166,7 +145,7 @@ def get_document(doc_id: str) -> Optional[Dict[str, Any]]:
     """
     Получить метаданные / информацию по документу.
     """
-    url = f"{API_URL.rstrip('/')}/documents/{doc_id}"
+    url = f"{API_URL.rstrip('/')}/api/documents/{doc_id}"
     try:
         resp = requests.get(url, headers=_normalize_auth_headers(), timeout=10)
         if resp.status_code == 200:
@@ -177,36 +156,11 @@ def get_document(doc_id: str) -> Optional[Dict[str, Any]]:
     return None
 
 
-def upload_document(filepath: str, filename: Optional[str] = None) -> Optional[Dict[str, Any]]:
-    """
-    Загрузить файл в API. Возвращает JSON ответа от сервера или None.
-    Вызов синхронный — в хэндлерах вызывай его через asyncio.to_thread, чтобы не блокировать loop.
-    """
-    url = API_URL.rstrip("/") + "/documents/upload"
-    headers = _normalize_auth_headers()
-    # Не добавляем Content-Type — requests сделает multipart/form-data
-    fileobj = open(filepath, "rb")
-    files = {"file": (filename or os.path.basename(filepath), fileobj)}
-    try:
-        resp = requests.post(url, headers=headers, files=files, timeout=120)
-        if resp.status_code in (200, 201):
-            return resp.json()
-        logger.error("upload_document failed: %s %s", resp.status_code, resp.text)
-    except Exception:
-        logger.exception("upload_document error")
-    finally:
-        try:
-            fileobj.close()
-        except Exception:
-            pass
-    return None
-
-
 def delete_document(doc_id: str) -> bool:
     """
     Удалить документ по ID. Возвращает True при успехе.
     """
-    url = f"{API_URL.rstrip('/')}/documents/{doc_id}"
+    url = f"{API_URL.rstrip('/')}/api/documents/{doc_id}"
     try:
         resp = requests.delete(url, headers=_normalize_auth_headers(), timeout=10)
         if resp.status_code in (200, 204):
@@ -0,0 +1,375 @@
+# bot/storage.py
+import asyncio
+import json
+import os
+import select
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from loguru import logger
+
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_SQLITE_PATH = os.getenv("FSM_SQLITE_PATH", "data/fsm.sqlite3")
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "50000"))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "30"))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.05"))
+FSM_FLUSH_BATCH = int(os.getenv("FSM_FLUSH_BATCH", "500"))
+
+NOTIFY_CHANNEL = "bot_fsm_invalidate"
+
+Record = Tuple[Optional[str], Dict[str, Any]]
+
+
+def build_key(key: StorageKey) -> str:
+    """Строковый ключ записи FSM (тот же набор полей, что у StorageKey)."""
+    parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+    if key.thread_id:
+        parts.append(f"t{key.thread_id}")
+    if key.business_connection_id:
+        parts.append(f"b{key.business_connection_id}")
+    parts.append(key.destiny)
+    return ":".join(parts)
+
+
+class SqliteBackend:
+    """Локальное встроенное хранилище (один хост, переживает рестарт)."""
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm_state (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL)"
+        )
+
+    def load(self, key: str) -> Optional[Record]:
+        with self._lock:
+            row = self._conn.execute("SELECT state, data FROM fsm_state WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def save_many(self, items: Dict[str, Record]) -> None:
+        rows = [(key, state, json.dumps(data, ensure_ascii=False)) for key, (state, data) in items.items()]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO fsm_state (key, state, data) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def listen(self, on_invalidate) -> None:
+        # Один процесс на файл — инвалидация между репликами не нужна
+        pass
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class PostgresBackend:
+    """
+    Общее хранилище для нескольких реплик бота.
+    Запись батчем в одной транзакции + NOTIFY, чтобы соседние реплики сбросили кэш.
+    """
+
+    def __init__(self, dsn: str, pool_size: int = 4):
+        import psycopg2.pool
+
+        self._dsn = dsn
+        self._pool = psycopg2.pool.ThreadedConnectionPool(1, pool_size, dsn)
+        self._listener: Optional[threading.Thread] = None
+        self._closed = threading.Event()
+        conn = self._pool.getconn()
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute(
+                    "CREATE TABLE IF NOT EXISTS bot_fsm_state ("
+                    " key TEXT PRIMARY KEY,"
+                    " state TEXT,"
+                    " data JSONB NOT NULL DEFAULT '{}'::jsonb,"
+                    " updated_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+                )
+        finally:
+            self._pool.putconn(conn)
+
+    def load(self, key: str) -> Optional[Record]:
+        conn = self._pool.getconn()
+        try:
+            with conn, conn.cursor() as cur:
+                cur.execute("SELECT state, data FROM bot_fsm_state WHERE key = %s", (key,))
+                row = cur.fetchone()
+        finally:
+            self._pool.putconn(conn)
+        if row is None:
+            return None
+        return row[0], row[1] or {}
+
+    def save_many(self, items: Dict[str, Record]) -> None:
+        from psycopg2.extras import execute_values
+
+        rows = [(key, state, json.dumps(data, ensure_ascii=False)) for key, (state, data) in items.items()]
+        conn = self._pool.getconn()
+        try:
+            with conn, conn.cursor() as cur:
+                execute_values(
+                    cur,
+                    "INSERT INTO bot_fsm_state (key, state, data) VALUES %s "
+                    "ON CONFLICT (key) DO UPDATE SET state = EXCLUDED.state, data = EXCLUDED.data, updated_at = now()",
+                    rows,
+                    template="(%s, %s, %s::jsonb)",
+                )
+                # payload NOTIFY ограничен ~8000 байт, режем список ключей
+                for payload in _chunk_payload(items.keys(), limit=7000):
+                    cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, payload))
+        finally:
+            self._pool.putconn(conn)
+
+    def listen(self, on_invalidate) -> None:
+        """Запускает поток, который слушает NOTIFY и вызывает on_invalidate(keys)."""
+        self._listener = threading.Thread(target=self._listen_loop, args=(on_invalidate,), daemon=True)
+        self._listener.start()
+
+    def _listen_loop(self, on_invalidate) -> None:
+        import psycopg2
+        import psycopg2.extensions
+
+        while not self._closed.is_set():
+            try:
+                conn = psycopg2.connect(self._dsn)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # После переподключения могли пропустить уведомления — сбрасываем весь кэш
+                on_invalidate(None)
+                while not self._closed.is_set():
+                    if select.select([conn], [], [], 1.0) == ([], [], []):
+                        continue
+                    conn.poll()
+                    keys = []
+                    while conn.notifies:
+                        keys.extend(conn.notifies.pop(0).payload.split("\n"))
+                    if keys:
+                        on_invalidate(keys)
+                conn.close()
+            except Exception as e:
+                logger.warning(f"FSM listener connection lost: {e}")
+                self._closed.wait(1.0)
+
+    def close(self) -> None:
+        self._closed.set()
+        self._pool.closeall()
+
+
+def _chunk_payload(keys: Iterable[str], limit: int):
+    batch, size = [], 0
+    for key in keys:
+        if batch and size + len(key) + 1 > limit:
+            yield "\n".join(batch)
+            batch, size = [], 0
+        batch.append(key)
+        size += len(key) + 1
+    if batch:
+        yield "\n".join(batch)
+
+
+class _CacheEntry:
+    __slots__ = ("state", "data", "loaded_at")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any], loaded_at: float):
+        self.state = state
+        self.data = data
+        self.loaded_at = loaded_at
+
+
+class CachedStorage(BaseStorage):
+    """
+    FSM-хранилище с read-through кэшем в процессе и пакетной отложенной записью.
+
+    Чтение из кэша не ходит в БД; промах или протухшая запись (FSM_CACHE_TTL)
+    читается из бэкенда. Запись сразу видна в кэше, а в бэкенд уходит пачкой
+    фоновой задачей раз в FSM_FLUSH_INTERVAL или при накоплении FSM_FLUSH_BATCH.
+    """
+
+    def __init__(
+        self,
+        backend,
+        cache_size: int = FSM_CACHE_SIZE,
+        cache_ttl: float = FSM_CACHE_TTL,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        flush_batch: int = FSM_FLUSH_BATCH,
+    ):
+        self.backend = backend
+        self._cache: "OrderedDict[str, _CacheEntry]" = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_ttl = cache_ttl
+        self._flush_interval = flush_interval
+        self._flush_batch = flush_batch
+        self._dirty: Dict[str, Record] = {}
+        # Номер последней локальной записи ключа (для ключей в кэше или в процессе чтения)
+        self._write_seq = 0
+        self._written: Dict[str, int] = {}
+        self._loading: Dict[str, int] = {}
+        self._flush_event: Optional[asyncio.Event] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.backend.listen(self._on_remote_invalidate)
+
+    # --- кэш ---
+    async def _entry(self, key: StorageKey) -> _CacheEntry:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        skey = build_key(key)
+        entry = self._cache.get(skey)
+        if entry is not None and (skey in self._dirty or time.monotonic() - entry.loaded_at < self._cache_ttl):
+            self._cache.move_to_end(skey)
+            return entry
+
+        while True:
+            started = self._write_seq
+            self._loading[skey] = self._loading.get(skey, 0) + 1
+            try:
+                record = await asyncio.to_thread(self.backend.load, skey)
+            finally:
+                self._loading[skey] -= 1
+                if not self._loading[skey]:
+                    del self._loading[skey]
+            if self._written.get(skey, 0) <= started:
+                break
+            # Пока ждали БД, ключ записали локально (возможно, уже и сбросили в бэкенд):
+            # прочитанная запись старее кэша
+            entry = self._cache.get(skey)
+            if entry is not None:
+                return entry
+        state, data = record if record is not None else (None, {})
+        entry = _CacheEntry(state, data, time.monotonic())
+        self._put(skey, entry)
+        return entry
+
+    def _put(self, skey: str, entry: _CacheEntry) -> None:
+        self._cache[skey] = entry
+        self._cache.move_to_end(skey)
+        while len(self._cache) > self._cache_size:
+            oldest = next(iter(self._cache))
+            if oldest in self._dirty:
+                # Незаписанные ключи не вытесняем, иначе потеряем изменения
+                self._cache.move_to_end(oldest)
+                break
+            self._cache.popitem(last=False)
+            self._forget_writes(oldest)
+
+    def _forget_writes(self, skey: str) -> None:
+        if skey not in self._loading:
+            self._written.pop(skey, None)
+
+    def _on_remote_invalidate(self, keys) -> None:
+        # Вызывается из потока слушателя
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._invalidate, keys)
+
+    def _invalidate(self, keys) -> None:
+        if keys is None:
+            for skey in [k for k in self._cache if k not in self._dirty]:
+                del self._cache[skey]
+                self._forget_writes(skey)
+            return
+        for skey in keys:
+            if skey not in self._dirty and self._cache.pop(skey, None) is not None:
+                self._forget_writes(skey)
+
+    # --- запись ---
+    def _mark_dirty(self, key: StorageKey, state: Optional[str], data: Dict[str, Any]) -> None:
+        skey = build_key(key)
+        self._write_seq += 1
+        self._written[skey] = self._write_seq
+        self._put(skey, _CacheEntry(state, data, time.monotonic()))
+        self._dirty[skey] = (state, data)
+        self._ensure_flusher()
+        if len(self._dirty) >= self._flush_batch or self._flush_interval <= 0:
+            self._flush_event.set()
+
+    def _ensure_flusher(self) -> None:
+        if self._flush_task is None or self._flush_task.done():
+            self._loop = asyncio.get_running_loop()
+            self._flush_event = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), timeout=self._flush_interval or None)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            await self.flush()
+
+    async def flush(self) -> None:
+        """Пишет накопленные изменения в бэкенд одной транзакцией."""
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        try:
+            await asyncio.to_thread(self.backend.save_many, batch)
+        except Exception as e:
+            logger.error(f"Failed to flush {len(batch)} FSM records: {e}")
+            # Возвращаем в очередь, не затирая более свежие изменения
+            for skey, record in batch.items():
+                self._dirty.setdefault(skey, record)
+            await asyncio.sleep(1.0)
+
+    # --- BaseStorage ---
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        new_state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, new_state, entry.data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._entry(key)
+        self._mark_dirty(key, entry.state, data.copy())
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._entry(key)).data.copy()
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        await asyncio.to_thread(self.backend.close)
+
+
+def create_storage() -> BaseStorage:
+    """Выбирает FSM-хранилище по переменной FSM_STORAGE: memory | sqlite | postgres."""
+    if FSM_STORAGE == "memory":
+        logger.warning("FSM_STORAGE=memory: conversation state will be lost on restart.")
+        return MemoryStorage()
+    if FSM_STORAGE == "postgres":
+        dsn = os.getenv("FSM_DATABASE_URL") or (
+            f"postgresql://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}"
+            f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('POSTGRES_DB')}"
+        )
+        logger.info("Using Postgres FSM storage.")
+        return CachedStorage(PostgresBackend(dsn))
+    logger.info(f"Using SQLite FSM storage at {FSM_SQLITE_PATH}.")
+    return CachedStorage(SqliteBackend(FSM_SQLITE_PATH))
@@ -0,0 +1,83 @@
+# bot/webhook.py
+import asyncio
+import os
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from loguru import logger
+
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный URL балансировщика, например https://bot.example.com
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# При нескольких репликах регистрировать вебхук достаточно одной
+WEBHOOK_REGISTER = os.getenv("WEBHOOK_REGISTER", "1") == "1"
+# Сколько апдейтов реплика держит в обработке, прежде чем отвечать 503
+WEBHOOK_MAX_INFLIGHT = int(os.getenv("WEBHOOK_MAX_INFLIGHT", "4000"))
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """
+    Принимает апдейты от Telegram, проверяет секрет и сразу отвечает 200,
+    обрабатывая апдейт в фоне. Порядок внутри чата и общий лимит параллельности
+    обеспечивает ChatOrderingIsolation диспетчера. Если в обработке уже
+    WEBHOOK_MAX_INFLIGHT апдейтов, отвечает 503 — Telegram повторит доставку позже.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_inflight: int = WEBHOOK_MAX_INFLIGHT, **kwargs: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self.max_inflight = max_inflight
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        if len(self._background_feed_update_tasks) >= self.max_inflight:
+            logger.warning(f"{self.max_inflight} updates in flight, asking Telegram to retry.")
+            return web.Response(status=503, text="Busy")
+        return await super()._handle_request_background(bot=bot, request=request)
+
+    async def close(self) -> None:
+        if self._background_feed_update_tasks:
+            await asyncio.wait(self._background_feed_update_tasks, timeout=30)
+        await super().close()
+
+
+async def health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok", "scheduler": request.app["scheduler"].stats()})
+
+
+async def metrics(request: web.Request) -> web.Response:
+    """Глубина очередей в формате Prometheus."""
+    lines = []
+    for name, value in request.app["scheduler"].stats().items():
+        lines.append(f"bot_chat_scheduler_{name} {value}")
+    return web.Response(text="\n".join(lines) + "\n", content_type="text/plain")
+
+
+def create_app(bot: Bot, dp: Dispatcher) -> web.Application:
+    """aiohttp-приложение для приема вебхуков. Реплики не хранят состояния и ставятся за балансировщик."""
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET must be set in webhook mode.")
+
+    app = web.Application()
+    app["scheduler"] = dp["scheduler"]
+
+    BoundedRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    app.router.add_get("/healthz", health)
+    app.router.add_get("/metrics", metrics)
+
+    async def on_startup(app: web.Application) -> None:
+        if WEBHOOK_REGISTER and WEBHOOK_URL:
+            url = WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH
+            await bot.set_webhook(url, secret_token=WEBHOOK_SECRET, max_connections=100)
+            logger.info(f"Webhook registered at {url}")
+
+    app.on_startup.append(on_startup)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+def run_webhook(bot: Bot, dp: Dispatcher) -> None:
+    logger.info(f"Starting webhook server on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    web.run_app(create_app(bot, dp), host=WEBHOOK_HOST, port=WEBHOOK_PORT, print=None)
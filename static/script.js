@@ -3,19 +3,38 @@ document.addEventListener("DOMContentLoaded", () => {
     const fileInput = document.getElementById("file-input");
     const assistantInput = document.getElementById("assistant-input");
     const documentsList = document.getElementById("documents-list");
+    const filterForm = document.getElementById("filter-form");
+    const loadMoreButton = document.getElementById("load-more");
+    const PAGE_SIZE = 50;
 
-    const fetchDocuments = async () => {
-        const response = await fetch("/api/documents");
-        const documents = await response.json();
-        documentsList.innerHTML = "";
-        documents.forEach(doc => {
+    let nextCursor = null;
+
+    const formatSize = (bytes) => `${(bytes / 1024).toFixed(1)} KB`;
+
+    // Список листается страницами: next_cursor из ответа — ключ следующей страницы
+    const fetchDocuments = async (append = false) => {
+        const params = new URLSearchParams({ limit: PAGE_SIZE });
+        if (append && nextCursor) params.set("cursor", nextCursor);
+        const prefix = document.getElementById("filter-prefix").value.trim();
+        const assistant = document.getElementById("filter-assistant").value.trim();
+        const status = document.getElementById("filter-status").value;
+        if (prefix) params.set("prefix", prefix);
+        if (assistant) params.set("assistant", assistant);
+        if (status) params.set("status", status);
+
+        const response = await fetch(`/api/documents?${params}`);
+        const page = await response.json();
+        if (!append) documentsList.innerHTML = "";
+        page.items.forEach(doc => {
             const li = document.createElement("li");
             li.innerHTML = `
-                <span>${doc.filename} (${doc.status})</span>
+                <span>${doc.filename} (${doc.assistant}, ${doc.status}, ${doc.chunk_count} chunks, ${formatSize(doc.byte_size)})</span>
                 <button data-id="${doc.id}">Delete</button>
             `;
             documentsList.appendChild(li);
         });
+        nextCursor = page.next_cursor;
+        loadMoreButton.hidden = !nextCursor;
     };
 
     uploadForm.addEventListener("submit", async (e) => {
@@ -34,13 +53,20 @@ document.addEventListener("DOMContentLoaded", () => {
         fetchDocuments();
     });
 
+    filterForm.addEventListener("submit", (e) => {
+        e.preventDefault();
+        fetchDocuments();
+    });
+
+    loadMoreButton.addEventListener("click", () => fetchDocuments(true));
+
     documentsList.addEventListener("click", async (e) => {
         if (e.target.tagName === "BUTTON") {
             const docId = e.target.dataset.id;
             await fetch(`/api/documents/${docId}`, {
                 method: "DELETE",
             });
-            fetchDocuments();
+            e.target.closest("li").remove();
         }
     });
 
@@ -10,30 +10,33 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 # --- Моки для OpenAI и зависимостей ---
 
-# Мокаем AsyncOpenAI клиент до его импорта в других модулях
+# Мокаем шлюз LLM и клиент эмбеддингов: сеть в тестах не нужна
 @pytest.fixture(autouse=True)
 def mock_openai_client():
-    with patch('api.llm_client.AsyncOpenAI') as mock_client_llm, \
-         patch('api.retriever.AsyncOpenAI') as mock_client_retriever:
-        
-        # Мок для Chat Completion
-        mock_chat_response = MagicMock()
-        mock_chat_response.choices = [MagicMock()]
-        mock_chat_response.choices[0].message.content = "Mocked OpenAI response"
-        mock_client_llm.return_value.chat.completions.create = AsyncMock(return_value=mock_chat_response)
+    with patch('api.llm_gateway.LLMGateway.complete', new_callable=AsyncMock) as mock_complete, \
+         patch('api.retriever.client') as mock_client_retriever, \
+         patch('api.rag_pipeline.fetch_history', new_callable=AsyncMock, return_value=[]), \
+         patch('api.rag_pipeline.persist_exchange'):
+
+        # Ответ модели через LLMGateway
+        mock_complete.return_value = "Mocked OpenAI response"
 
         # Мок для Embeddings
         mock_embedding_response = MagicMock()
-        mock_embedding_response.data = [MagicMock()]
+        mock_embedding_response.data = [MagicMock(index=0)]
         mock_embedding_response.data[0].embedding = [0.1] * 1536
-        mock_client_retriever.return_value.embeddings.create = AsyncMock(return_value=mock_embedding_response)
-        
-        yield mock_client_llm, mock_client_retriever
+        mock_embedding_response.usage = None
+        mock_client_retriever.embeddings.create = AsyncMock(return_value=mock_embedding_response)
+
+        yield mock_complete, mock_client_retriever
 
 # Устанавливаем переменную окружения до импорта main
 os.environ['OPENAI_API_KEY'] = 'fake-key'
 
+from api import auth
 from api.main import app, get_db
+from api.rag_pipeline import NO_CONTEXT_ANSWER
+from api.retriever import RetrievedChunk
 
 # --- Моки для БД ---
 @pytest.fixture
@@ -43,6 +46,7 @@ def db_session_mock():
 @pytest.fixture(autouse=True)
 def override_get_db(db_session_mock):
     app.dependency_overrides[get_db] = lambda: db_session_mock
+    app.dependency_overrides[auth.get_current_user] = lambda: MagicMock(id=123, email="user@example.com", tariff="free")
     yield
     app.dependency_overrides = {}
 
@@ -53,33 +57,33 @@ client = TestClient(app)
 @patch('api.retriever.Retriever.search', new_callable=AsyncMock) 
 def test_query_with_context(mock_search, mock_os_exists, mock_openai_client):
     """Тест: API находит контекст и генерирует ответ через ChatCompletion."""
-    mock_search.return_value = ["some relevant context"]
+    mock_search.return_value = [RetrievedChunk(1, 1, "some relevant context", 0.1)]
     mock_chat_client, _ = mock_openai_client
 
-    response = client.post("/query", json={"assistant": "shop", "query": "test", "user_id": 123})
+    response = client.post("/query", json={"assistant": "shop", "query": "test", "user_id": "123"})
     
     assert response.status_code == 200
     assert response.json()["response"] == "Mocked OpenAI response"
     # Проверяем, что поиск был вызван
     mock_search.assert_called_once()
-    # Проверяем, что ChatCompletion был вызван
-    mock_chat_client.return_value.chat.completions.create.assert_called_once()
+    # Проверяем, что LLM был вызван
+    mock_chat_client.assert_called_once()
 
 @patch('api.main.os.path.exists', return_value=True)
 @patch('api.retriever.Retriever.search', new_callable=AsyncMock)
 def test_query_no_context_fallback(mock_search, mock_os_exists, mock_openai_client):
-    """Тест: API не находит контекст и возвращает fallback-ответ, не вызывая ChatCompletion."""
-    mock_search.return_value = []  # Ретривер ничего не нашел
+    """Тест: все найденные чанки дальше порога — API отвечает заготовкой, не вызывая LLM."""
+    mock_search.return_value = [RetrievedChunk(1, 1, "unrelated context", 0.95)]  # Ничего близкого
     mock_chat_client, _ = mock_openai_client
 
-    response = client.post("/query", json={"assistant": "shop", "query": "test", "user_id": 123})
+    response = client.post("/query", json={"assistant": "shop", "query": "test", "user_id": "123"})
     
     assert response.status_code == 200
-    assert response.json()["response"] == "К сожалению, я не нашел информации по вашему вопросу."
+    assert response.json()["response"] == NO_CONTEXT_ANSWER
     # Проверяем, что поиск был вызван
     mock_search.assert_called_once()
-    # Убеждаемся, что ChatCompletion НЕ был вызван
-    mock_chat_client.return_value.chat.completions.create.assert_not_called()
+    # Убеждаемся, что LLM НЕ был вызван
+    mock_chat_client.assert_not_called()
 
 @pytest.mark.asyncio
 async def test_embedding_generation(mock_openai_client):
@@ -91,7 +95,8 @@ async def test_embedding_generation(mock_openai_client):
 
     assert embedding == [0.1] * 1536
     # Проверяем, что метод create у embeddings был вызван с нужными параметрами
-    mock_embedding_client.return_value.embeddings.create.assert_called_once_with(
+    mock_embedding_client.embeddings.create.assert_called_once_with(
         model=os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small"),
-        input=["test text"]
+        input=["test text"],
+        dimensions=1536,
     )
\ No newline at end of file
@@ -0,0 +1,68 @@
+# tests/test_batch_query.py
+import io
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("DB_PORT", "5432")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from api import rag_pipeline, retriever
+from api.batch_cli import read_queries
+from api.retriever import RetrievedChunk
+
+
+@pytest.mark.asyncio
+async def test_queries_are_embedded_in_batches(monkeypatch):
+    """Тест: вопросы эмбеддятся пачками по EMBEDDING_BATCH_SIZE, повторы — один раз, порядок сохраняется."""
+    calls = []
+
+    async def create(model, input, **options):
+        calls.append(list(input))
+        # OpenAI не обязан возвращать эмбеддинги в порядке входа
+        data = [SimpleNamespace(index=i, embedding=[float(len(text))]) for i, text in enumerate(input)]
+        return SimpleNamespace(data=data[::-1], usage=None)
+
+    monkeypatch.setattr(retriever, "client", SimpleNamespace(embeddings=SimpleNamespace(create=create)))
+    monkeypatch.setattr(retriever, "EMBEDDING_BATCH_SIZE", 2)
+
+    vectors = await retriever.get_openai_embeddings(["a", "bbb", "a", "cc", "dddd"])
+
+    assert vectors == [[1.0], [3.0], [1.0], [2.0], [4.0]]
+    assert sorted(map(len, calls)) == [2, 2]
+
+
+@pytest.mark.asyncio
+async def test_stateless_query_skips_history(monkeypatch):
+    """Тест: без истории вопрос не читает и не пишет диалог, готовый эмбеддинг не запрашивается заново."""
+    async def no_call(*args):
+        raise AssertionError("must not be called")
+
+    class NearRetriever:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        async def search(self, query, top_k, query_embedding, assistant):
+            assert query_embedding == [0.5] and assistant == "dental"
+            return [RetrievedChunk(1, 1, "Чистка стоит 3000 рублей", 0.1)]
+
+    class LLM:
+        async def get_response(self, query, context, assistant_config, history):
+            assert history == []
+            return {"response": "3000 рублей"}
+
+    monkeypatch.setattr(rag_pipeline, "get_openai_embedding", no_call)
+    monkeypatch.setattr(rag_pipeline, "fetch_history", no_call)
+    monkeypatch.setattr(rag_pipeline, "persist_exchange", lambda *args: pytest.fail("history must not be written"))
+    monkeypatch.setattr(rag_pipeline, "Retriever", NearRetriever)
+    monkeypatch.setattr(rag_pipeline, "load_assistant_config", lambda name: {})
+
+    answer = await rag_pipeline.process_query(
+        "Сколько стоит чистка?", "dental", 1, None, LLM(), query_embedding=[0.5], use_history=False
+    )
+
+    assert answer == "3000 рублей"
+    assert read_queries(io.StringIO('Первый вопрос\n\n{"query": "Второй"}\n')) == ["Первый вопрос", "Второй"]
@@ -0,0 +1,82 @@
+# tests/test_db_routing.py
+import asyncio
+import os
+import sys
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("DB_PORT", "5432")
+
+from api.chunk_shards import _SEARCH_SQL, ChunkShards, RetrievedChunk
+from api.db_routing import DatabaseRouter, Replica, history_key, parse_lsn
+
+
+class _Session:
+    """Сессия основной базы: отдает заданную позицию WAL."""
+
+    def __init__(self, lsn):
+        self.lsn = lsn
+
+    def execute(self, statement):
+        return self
+
+    def scalar(self):
+        return self.lsn
+
+
+def _router(*lags):
+    replicas = []
+    for i, lag in enumerate(lags):
+        replica = Replica(f"replica{i}", create_engine("sqlite://"))
+        replica.healthy, replica.lag, replica.replay_lsn = True, lag, parse_lsn("0/100")
+        replicas.append(replica)
+    return DatabaseRouter(primary_engine=None, primary_session_factory=lambda: "primary", replicas=replicas, max_lag=5)
+
+
+def test_reads_wait_for_replica_to_replay_own_writes():
+    """Тест: после записи диалог читается с основной, пока реплика не проиграла эту позицию WAL."""
+    router = _router(0.1, 30)
+    key = history_key(1, "dental")
+
+    assert router.pick_replica(key) is router.replicas[0]  # отстающая на 30 сек не выбирается
+    router.note_write(_Session("0/200"), key)
+    assert router.pick_replica(key) is None
+    assert router.pick_replica(history_key(2, "dental")) is router.replicas[0]  # чужие записи не мешают
+
+    router.replicas[0].replay_lsn = parse_lsn("0/200")
+    assert router.pick_replica(key) is router.replicas[0]
+    assert parse_lsn("1/0") > parse_lsn("0/FFFFFFFF")
+
+
+def test_search_goes_only_to_the_assistants_chunks(tmp_path):
+    """Тест: вопрос ищет только в шарде своего ассистента (и его документах) или в основной базе с фильтром."""
+    primary = create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    with primary.begin() as connection:
+        connection.execute(text("CREATE TABLE documents (id INTEGER PRIMARY KEY, assistant VARCHAR, status VARCHAR)"))
+        connection.execute(text(
+            "INSERT INTO documents VALUES (1, 'dental', 'ready'), (2, 'legal', 'ready'), (3, 'dental', 'deleted')"
+        ))
+    shared = create_engine("sqlite://")
+    calls = []
+
+    class Shards(ChunkShards):
+        def _search_primary(self, assistant, embedding, top_k, model, shadow):
+            calls.append(("primary", assistant))
+            return [RetrievedChunk(1, 7, "shop", 0.3)]
+
+        def _search_shard(self, shard, assistant, embedding, top_k, model, shadow):
+            assert shard is shared
+            calls.append(("shard", assistant, self._assistant_documents(assistant)))
+            return [RetrievedChunk(2, 1, "dental", 0.1)]
+
+    router = DatabaseRouter(primary_engine=primary, primary_session_factory=lambda: Session(primary), replicas=[])
+    shards = Shards({"dental": shared, "legal": shared}, router=router)
+    assert len(shards.engines()) == 1
+
+    assert [c.content for c in asyncio.run(shards.search("dental", [0.0], 3, "text-embedding-3-small"))] == ["dental"]
+    assert [c.content for c in asyncio.run(shards.search("shop", [0.0], 3, "text-embedding-3-small"))] == ["shop"]
+    # Шард общий с legal, но ищем только в живых документах dental
+    assert calls == [("shard", "dental", [1]), ("primary", "shop")]
+    assert "d.assistant = :assistant" in str(_SEARCH_SQL[(False, False)])
@@ -0,0 +1,91 @@
+# tests/test_document_listing.py
+import os
+import sys
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+
+import pytest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("DB_PORT", "5432")
+
+from api import crud
+from api.db import Base, Document, User
+
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=[User.__table__, Document.__table__])
+    with sessionmaker(bind=engine)() as session:
+        session.add_all([User(id=1, email="a@example.com"), User(id=2, email="b@example.com")])
+        for i in range(1, 8):
+            session.add(Document(
+                id=i, user_id=1, filename=f"{'price' if i % 2 else 'faq'}_{i}.txt",
+                assistant="shop" if i <= 4 else "dental", status="ready", chunk_count=i, byte_size=100 * i,
+            ))
+        session.add(Document(id=8, user_id=1, filename="price_8.txt", status="deleted"))
+        session.add(Document(id=9, user_id=2, filename="price_9.txt", status="ready"))
+        session.commit()
+        yield session
+
+
+def test_keyset_pages_cover_all_documents(session):
+    """Тест: страницы по курсору идут от новых к старым без пропусков и повторов, удаленные и чужие не видны."""
+    seen, cursor = [], None
+    while True:
+        rows, cursor = crud.list_documents(session, user_id=1, limit=3, cursor=cursor)
+        seen += [row.id for row in rows]
+        if cursor is None:
+            break
+    assert seen == [7, 6, 5, 4, 3, 2, 1]
+    assert rows[-1].chunk_count == 1 and rows[-1].byte_size == 100
+
+
+def test_filters(session):
+    """Тест: фильтры по ассистенту и префиксу имени; спецсимволы LIKE в префиксе экранируются."""
+    rows, cursor = crud.list_documents(session, user_id=1, assistant="shop", prefix="price")
+    assert [row.id for row in rows] == [3, 1] and cursor is None
+    assert crud.list_documents(session, user_id=1, prefix="%")[0] == []
+    with pytest.raises(ValueError):
+        crud.list_documents(session, user_id=1, cursor="not-a-cursor")
+
+
+@pytest.mark.asyncio
+async def test_next_page_keeps_long_cyrillic_prefix(monkeypatch):
+    """Тест: длинный кириллический префикс не обрезается — в кнопке только курсор, фильтр в данных FSM."""
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'bot')))
+    import handler_docs
+
+    requests = []
+
+    def get_documents(cursor=None, prefix=None):
+        requests.append(prefix)
+        return {"items": [{"id": 1, "filename": "прайс.txt"}], "next_cursor": "Aw"}
+
+    monkeypatch.setattr(handler_docs.services, "get_documents", get_documents)
+    state = FSMContext(MemoryStorage(), StorageKey(bot_id=1, chat_id=1, user_id=1))
+    prefix = "Прейскурант стоматологических услуг клиники"
+    answers = []
+    message = SimpleNamespace(
+        text=f"/docs {prefix}", message_id=77, answer=AsyncMock(side_effect=lambda *a, **kw: answers.append(kw))
+    )
+
+    await handler_docs.cmd_list_docs(message, state)
+    callback_data = answers[0]["reply_markup"].inline_keyboard[0][0].callback_data
+    assert len(callback_data.encode("utf-8")) <= 64
+
+    callback = SimpleNamespace(data=callback_data, answer=AsyncMock(), message=message)
+    message.edit_reply_markup = AsyncMock()
+    await handler_docs.cq_docs_page(callback, state)
+    assert requests == [prefix, prefix]
+
+    # Фильтр забыт — следующая страница не запрашивается без него
+    await state.set_data({})
+    await handler_docs.cq_docs_page(callback, state)
+    assert requests == [prefix, prefix]
@@ -0,0 +1,72 @@
+# tests/test_document_purge.py
+import os
+import sys
+
+from sqlalchemy import create_engine, event, text
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("DB_PORT", "5432")
+
+from api import document_purge
+from api.document_purge import purge_deleted
+
+
+def _engine(path):
+    engine = create_engine(f"sqlite:///{path}")
+    # В SQLite каскад работает только с включенными внешними ключами
+    event.listen(engine, "connect", lambda connection, _: connection.execute("PRAGMA foreign_keys = ON"))
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE documents (id INTEGER PRIMARY KEY, status VARCHAR)"))
+        connection.execute(text(
+            "CREATE TABLE document_chunks (id INTEGER PRIMARY KEY, "
+            "document_id INTEGER REFERENCES documents (id) ON DELETE CASCADE, content TEXT)"
+        ))
+    return engine
+
+
+def test_purge_removes_tombstoned_documents_in_batches(tmp_path):
+    """Тест: чанки удаленного документа удаляются пачками, живые документы не трогаются."""
+    engine = _engine(tmp_path / "docs.db")
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO documents VALUES (1, 'deleted'), (2, 'ready')"))
+        for document_id, count in ((1, 7), (2, 2)):
+            for i in range(count):
+                connection.execute(
+                    text("INSERT INTO document_chunks (document_id, content) VALUES (:d, :c)"),
+                    {"d": document_id, "c": f"chunk {i}"},
+                )
+
+    assert purge_deleted(engine, batch_size=3) == (1, 7)
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT id FROM documents")).scalars().all() == [2]
+        assert connection.execute(text("SELECT DISTINCT document_id FROM document_chunks")).scalars().all() == [2]
+    assert purge_deleted(engine, batch_size=3) == (0, 0)
+
+
+def test_document_deleted_during_shard_pass_keeps_its_row(tmp_path, monkeypatch):
+    """Тест: документ, удаленный после чтения списка, не теряет строку, пока его чанки в шарде не вычищены."""
+    engine = _engine(tmp_path / "docs.db")
+    shard = create_engine(f"sqlite:///{tmp_path / 'shard.db'}")
+    with shard.begin() as connection:
+        connection.execute(text("CREATE TABLE document_chunks (id INTEGER PRIMARY KEY, document_id INTEGER, content TEXT)"))
+        connection.execute(text("INSERT INTO document_chunks (document_id, content) VALUES (1, 'a'), (2, 'b'), (2, 'c')"))
+    with engine.begin() as connection:
+        connection.execute(text("INSERT INTO documents VALUES (1, 'deleted'), (2, 'ready')"))
+
+    def purge_shard_batch(connection, document_ids, batch_size):
+        # В SQLite нет массивов; заодно документ 2 удаляют, пока идет проход по шарду
+        with engine.begin() as primary:
+            primary.execute(text("UPDATE documents SET status = 'deleted' WHERE id = 2"))
+        return connection.execute(
+            text("DELETE FROM document_chunks WHERE document_id IN (%s)" % ",".join(map(str, document_ids)))
+        ).rowcount
+
+    monkeypatch.setattr(document_purge, "purge_shard_batch", purge_shard_batch)
+
+    assert purge_deleted(engine, batch_size=3, shards=[shard]) == (1, 1)
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT id, status FROM documents")).all() == [(2, "deleted")]
+
+    assert purge_deleted(engine, batch_size=3, shards=[shard]) == (1, 2)
+    with shard.connect() as connection:
+        assert connection.execute(text("SELECT count(*) FROM document_chunks")).scalar() == 0
@@ -0,0 +1,66 @@
+# tests/test_embedding_migration.py
+import asyncio
+import os
+import sys
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("DB_PORT", "5432")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from api.db import EmbeddingState
+from api.embedding_migration import EmbeddingMigration
+from api.retriever import embedding_models
+
+
+def _engine(path):
+    engine = create_engine(f"sqlite:///{path}")
+    EmbeddingState.__table__.create(engine)
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE document_chunks (id INTEGER PRIMARY KEY, document_id INTEGER, content TEXT, "
+            "embedding TEXT, embedding_model VARCHAR, embedding_next TEXT, embedding_next_model VARCHAR)"
+        ))
+        for i in range(5):
+            connection.execute(
+                text("INSERT INTO document_chunks (document_id, content, embedding, embedding_model) "
+                     "VALUES (1, :content, '[0]', 'old-model')"),
+                {"content": f"chunk {i}"},
+            )
+        # Эту пачку прошлый запуск уже успел посчитать
+        connection.execute(text(
+            "UPDATE document_chunks SET embedding_next = '[1]', embedding_next_model = 'new-model' WHERE id = 1"
+        ))
+        connection.execute(text(
+            "INSERT INTO embedding_state (id, active_model, target_model, phase, total, done) "
+            "VALUES (1, 'old-model', 'new-model', 'reembedding', 5, 1)"
+        ))
+    return engine
+
+
+def test_migration_resumes_switches_and_promotes(tmp_path, monkeypatch):
+    """Тест: миграция продолжает с места остановки, переключает модель и переносит векторы в основную колонку."""
+    monkeypatch.setattr(embedding_models, "active", "old-model")
+    monkeypatch.setattr(embedding_models, "migrating", True)
+    engine = _engine(tmp_path / "chunks.db")
+    embedded = []
+
+    async def embed(texts, model):
+        assert model == "new-model"
+        embedded.extend(texts)
+        return [[0.5] * 1536 for _ in texts]
+
+    migration = EmbeddingMigration(engine, batch_size=2, rate=0, grace=0, embed=embed)
+    asyncio.run(migration._migrate(migration._state()))
+
+    assert sorted(embedded) == ["chunk 1", "chunk 2", "chunk 3", "chunk 4"]
+    with engine.connect() as connection:
+        rows = connection.execute(text(
+            "SELECT embedding_model, embedding_next, embedding_next_model FROM document_chunks"
+        )).all()
+        state = connection.execute(text("SELECT active_model, target_model, phase, done FROM embedding_state")).one()
+    assert rows == [("new-model", None, None)] * 5
+    assert tuple(state) == ("new-model", None, "idle", 5)
+    assert embedding_models.active == "new-model" and not embedding_models.migrating
+    assert migration.progress()["done"] == 5
@@ -0,0 +1,92 @@
+# tests/test_history_cache.py
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("DB_PORT", "5432")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from api.db import ConversationSummary, User
+from api.history_cache import HistoryCache
+from api.message_log import MessageLog
+from api.rag_pipeline import _load_history
+
+
+def test_window_keeps_last_turns():
+    """Тест: окно диалога хранит только последние turns сообщений."""
+    cache = HistoryCache(turns=3)
+    cache.put((1, "dental"), [])
+    for n in range(5):
+        cache.append((1, "dental"), "user", f"m{n}")
+
+    assert [m["content"] for m in cache.get((1, "dental"))] == ["m2", "m3", "m4"]
+
+
+def test_idle_conversations_are_evicted():
+    """Тест: при переполнении вытесняется диалог, к которому дольше всех не обращались."""
+    cache = HistoryCache(turns=3, max_conversations=2)
+    cache.put((1, "dental"), [])
+    cache.put((2, "dental"), [])
+    cache.get((1, "dental"))
+    cache.put((3, "dental"), [])
+
+    assert cache.get((2, "dental")) is None
+    assert cache.get((1, "dental")) == []
+    assert cache.stats()["conversations"] == 2
+
+
+def test_summary_is_pinned_before_window():
+    """Тест: сводка диалога не вытесняется новыми сообщениями."""
+    cache = HistoryCache(turns=2)
+    summary = {"role": "system", "content": "сводка"}
+    cache.put((1, "dental"), [], summary)
+    for n in range(3):
+        cache.append((1, "dental"), "user", f"m{n}")
+
+    assert [m["content"] for m in cache.get((1, "dental"))] == ["сводка", "m1", "m2"]
+
+
+def test_append_ignores_unloaded_conversation():
+    """Тест: сообщение не создает неполное окно для диалога, которого нет в кэше."""
+    cache = HistoryCache(turns=3)
+    cache.append((1, "dental"), "user", "привет")
+
+    assert cache.get((1, "dental")) is None
+
+
+@pytest.mark.asyncio
+async def test_history_is_read_per_conversation():
+    """Тест: журнал пишет сообщения с ассистентом, история читается по паре (user_id, assistant)."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    User.__table__.create(engine)
+    ConversationSummary.__table__.create(engine)
+    # В SQLite нет автоинкремента для составного ключа (id, created_at) секционированной таблицы
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            "CREATE TABLE messages (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, "
+            "assistant VARCHAR NOT NULL, role VARCHAR, content TEXT, created_at DATETIME NOT NULL)"
+        )
+    Session = sessionmaker(bind=engine)
+    with Session() as session:
+        session.add(User(id=1, telegram_id="42"))
+        session.commit()
+
+    log = MessageLog(session_factory=Session, batch_size=100, flush_interval=5)
+    log.append(1, "dental", "user", "болит зуб")
+    log.append(1, "dental", "assistant", "запишитесь на прием")
+    log.append(1, "shop", "user", "где мой заказ")
+    await log.close()
+
+    with Session() as session:
+        summary, history = _load_history(session, 1, "dental")
+
+    assert summary is None
+    assert history == [
+        {"role": "user", "content": "болит зуб"},
+        {"role": "assistant", "content": "запишитесь на прием"},
+    ]
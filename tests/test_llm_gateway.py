@@ -0,0 +1,123 @@
+# tests/test_llm_gateway.py
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+from aiohttp import web
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from api.llm_client import LLMClient
+from api.llm_gateway import AllProvidersFailed, LLMGateway, Provider
+from benchmarks.fake_openai import create_app
+
+MESSAGES = [{"role": "user", "content": "Сколько стоит чистка зубов?"}]
+
+
+class _Sequence:
+    """Подменяет random у фейка: первый запрос медленный, остальные быстрые."""
+
+    def __init__(self, *values):
+        self._values = list(values)
+
+    def random(self):
+        return self._values.pop(0) if self._values else 1.0
+
+
+async def _serve(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/v1"
+
+
+@pytest.mark.asyncio
+async def test_slow_request_is_hedged():
+    """Тест: если ответа нет дольше p95, дубликат отвечает раньше медленного запроса."""
+    app = create_app(latency=0.01, slow_rate=1.0, slow_latency=1.0)
+    app["random"] = _Sequence(0.0)
+    runner, url = await _serve(app)
+    try:
+        provider = Provider("primary", "gpt-4o-mini", api_key="fake", base_url=url)
+        for _ in range(50):
+            provider.latency.add(0.02)
+        gateway = LLMGateway([provider], deadline=5)
+
+        answer = await gateway.complete(MESSAGES)
+
+        assert "чистка" in answer
+        assert gateway.hedged == 1 and gateway.hedge_wins == 1
+        assert app["calls"]["chat"] == 2
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_breaker_opens_and_falls_back():
+    """Тест: упавший провайдер отключается breaker'ом, запросы идут в запасную модель."""
+    broken = create_app(error_rate=1.0)
+    backup = create_app(name="backup")
+    broken_runner, broken_url = await _serve(broken)
+    backup_runner, backup_url = await _serve(backup)
+    try:
+        primary = Provider("primary", "gpt-4o", api_key="fake", base_url=broken_url)
+        primary.breaker.max_failures = 2
+        fallback = Provider("cheap", "gpt-4o-mini", api_key="fake", base_url=backup_url)
+        gateway = LLMGateway([primary, fallback], deadline=5, hedge=False)
+
+        answers = [await gateway.complete(MESSAGES) for _ in range(5)]
+
+        assert all(answer.startswith("Ответ backup") for answer in answers)
+        assert primary.breaker.state == "open"
+        assert broken["calls"]["chat"] == 2
+        assert gateway.fallbacks == 5
+    finally:
+        await broken_runner.cleanup()
+        await backup_runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_retrieval_only_answer_when_all_providers_fail():
+    """Тест: если LLM недоступна, клиент отвечает найденным контекстом."""
+    app = create_app(latency=1.0)
+    runner, url = await _serve(app)
+    try:
+        gateway = LLMGateway([Provider("primary", "gpt-4o-mini", api_key="fake", base_url=url)],
+                             deadline=0.1, hedge=False)
+        with pytest.raises(AllProvidersFailed):
+            await gateway.complete(MESSAGES)
+
+        result = await LLMClient(gateway).get_response("Цена чистки?", context="Чистка зубов стоит 3000 рублей.")
+
+        assert "3000 рублей" in result["response"]
+        assert result["confidence"] == 0.0
+    finally:
+        await runner.cleanup()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_probe_does_not_block_breaker():
+    """Тест: отмена пробного запроса в half_open не оставляет breaker закрытым навсегда."""
+    provider = Provider("primary", "gpt-4o", api_key="fake")
+    started = asyncio.Event()
+
+    async def hang(messages, **params):
+        started.set()
+        await asyncio.sleep(60)
+
+    provider.complete = hang
+    provider.breaker.opened_at = time.monotonic() - provider.breaker.reset_timeout
+    gateway = LLMGateway([provider], deadline=30, hedge=False)
+
+    call = asyncio.create_task(gateway.complete(MESSAGES))
+    await started.wait()
+    call.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await call
+
+    assert provider.breaker.state == "half_open"
+    assert provider.breaker.allow()
@@ -0,0 +1,82 @@
+# tests/test_logging_setup.py
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from loguru import logger
+
+from api.logging_setup import LogFilter, redact
+
+
+def _capture(log_filter):
+    lines = []
+    handler_id = logger.add(lambda m: lines.append(m.record), filter=log_filter, format="{message}")
+    return lines, handler_id
+
+
+def _capture_text(log_filter):
+    """Sink с форматом фильтра: строки в том виде, в каком их запишет sink."""
+    texts = []
+    handler_id = logger.add(lambda m: texts.append(str(m)), filter=log_filter, format=log_filter.format)
+    return texts, handler_id
+
+
+def _hot(i):
+    logger.info("hot {i}", i=i)
+
+
+def test_rate_limit_per_callsite():
+    """Тест: с одной строки кода проходит не больше rate_limit записей в окне, предупреждения — всегда."""
+    log_filter = LogFilter(rate_limit=3)
+    texts, handler_id = _capture_text(log_filter)
+    try:
+        for i in range(10):
+            _hot(i)
+        for _ in range(5):
+            logger.warning("always")
+        # Новое окно: первая запись несет число подавленных
+        for window in log_filter._windows.values():
+            window[0] -= 1.0
+        for i in range(2):
+            _hot(i)
+    finally:
+        logger.remove(handler_id)
+    hot = [t.rstrip().split(" - ")[-1] for t in texts if " - hot" in t]
+    assert hot == ["hot 0", "hot 1", "hot 2", "hot 0 [+7 suppressed]", "hot 1"]
+    assert sum(t.rstrip().endswith(" - always") for t in texts) == 5
+
+
+def test_suppressed_note_does_not_leak_into_other_sinks():
+    """Тест: пометка одного sink'а не меняет запись, которую получают остальные sink'и."""
+    limited = LogFilter(rate_limit=1)
+    texts, limited_id = _capture_text(limited)
+    lines, other_id = _capture(LogFilter(rate_limit=0))
+    try:
+        for i in range(3):
+            _hot(i)
+        for window in limited._windows.values():
+            window[0] -= 1.0
+        _hot(3)
+    finally:
+        logger.remove(limited_id)
+        logger.remove(other_id)
+    assert texts[-1].rstrip().endswith("hot 3 [+2 suppressed]")
+    assert [r["message"] for r in lines] == ["hot 0", "hot 1", "hot 2", "hot 3"]
+    assert all("suppressed" not in r["extra"] for r in lines)
+
+
+def test_sampling_and_redaction():
+    """Тест: запись с sample=0 не пишется, тексты пользователей заменяются длиной и хешем."""
+    lines, handler_id = _capture(LogFilter(rate_limit=0, seed=1))
+    try:
+        for _ in range(5):
+            logger.info("sampled", sample=0.0)
+        logger.info("kept", sample=1.0)
+    finally:
+        logger.remove(handler_id)
+    assert [r["message"] for r in lines] == ["kept"]
+
+    masked = redact("Мой номер +77001234567")
+    assert "7700" not in masked and masked.startswith("<22 chars #")
+    assert masked == redact("Мой номер +77001234567")
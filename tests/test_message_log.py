@@ -0,0 +1,105 @@
+# tests/test_message_log.py
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("DB_PORT", "5432")
+
+from api.message_log import MessageLog
+
+
+class RecordingSession:
+    """Сессия, которая запоминает вставленные пачки вместо записи в Postgres."""
+
+    def __init__(self, batches, fail=False):
+        self.batches = batches
+        self.fail = fail
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, rows):
+        if self.fail:
+            raise RuntimeError("database is down")
+        self.batches.append(list(rows))
+
+    def commit(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_messages_are_written_in_batches():
+    """Тест: сообщения копятся в памяти и пишутся одной пачкой по размеру."""
+    batches = []
+    log = MessageLog(session_factory=lambda: RecordingSession(batches), batch_size=10, flush_interval=5)
+
+    for n in range(10):
+        log.append("42", "dental", "user", f"вопрос {n}")
+    await asyncio.sleep(0.05)
+
+    assert len(batches) == 1 and len(batches[0]) == 10
+    assert log.stats()["buffered"] == 0
+
+
+@pytest.mark.asyncio
+async def test_pending_messages_are_readable_and_flushed_on_close():
+    """Тест: незаписанные сообщения видны истории и дописываются при остановке."""
+    batches = []
+    log = MessageLog(session_factory=lambda: RecordingSession(batches), batch_size=100, flush_interval=5)
+
+    log.append("42", "dental", "user", "привет")
+    log.append("42", "dental", "assistant", "здравствуйте")
+    log.append("7", "shop", "user", "чужой диалог")
+
+    assert [row["content"] for row in log.pending("42", "dental")] == ["привет", "здравствуйте"]
+    assert batches == []
+
+    await log.close()
+    assert len(batches) == 1 and len(batches[0]) == 3
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_kept_for_retry():
+    """Тест: при ошибке базы пачка остается в буфере и пишется следующей попыткой."""
+    batches = []
+    session = RecordingSession(batches, fail=True)
+    log = MessageLog(session_factory=lambda: session, batch_size=100, flush_interval=5)
+
+    log.append("42", "dental", "user", "привет")
+    assert await log.flush() is False
+    assert len(log.pending("42", "dental")) == 1
+
+    session.fail = False
+    assert await log.flush() is True
+    assert len(batches) == 1
+    await log.close()
+
+
+@pytest.mark.asyncio
+async def test_history_read_does_not_race_with_flush():
+    """Тест: пачка, записанная во время чтения истории, не теряется и не дублируется."""
+    batches = []
+    log = MessageLog(session_factory=lambda: RecordingSession(batches), batch_size=100, flush_interval=5)
+    log.append("42", "dental", "user", "привет")
+
+    def load():
+        stored = [row["content"] for batch in batches for row in batch]
+        # База уже прочитана, а фоновая запись пытается закоммитить пачку до pending()
+        asyncio.run_coroutine_threadsafe(log.flush(), loop)
+        time.sleep(0.05)
+        return stored
+
+    loop = asyncio.get_running_loop()
+    stored, pending = await log.read_with_pending("42", "dental", load)
+    await asyncio.sleep(0.05)
+
+    assert stored + [row["content"] for row in pending] == ["привет"]
+    assert len(batches) == 1
+    await log.close()
@@ -0,0 +1,81 @@
+# tests/test_openai_scheduler.py
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from api.openai_scheduler import BACKGROUND, INTERACTIVE, OpenAIScheduler, scheduling
+
+
+async def _call(scheduler, order, label, priority, assistant="general", tariff="default", tokens=100):
+    with scheduling(priority, assistant, tariff):
+        async with scheduler.slot(tokens):
+            order.append(label)
+
+
+@pytest.mark.asyncio
+async def test_interactive_overtakes_background_queue():
+    """Тест: вопрос из чата обгоняет очередь эмбеддингов загрузки."""
+    scheduler = OpenAIScheduler(rpm=6000, tpm=0, reserve=0.0)
+    scheduler.requests.available = 0
+    order = []
+
+    background = [asyncio.create_task(_call(scheduler, order, f"bg{n}", BACKGROUND)) for n in range(5)]
+    await asyncio.sleep(0)
+    interactive = asyncio.create_task(_call(scheduler, order, "query", INTERACTIVE))
+    await asyncio.gather(*background, interactive)
+
+    assert order[0] == "query"
+    assert scheduler.stats()["dispatched_interactive"] == 1
+
+
+@pytest.mark.asyncio
+async def test_fair_share_follows_tariff_weights():
+    """Тест: при конкуренции потоки получают бюджет пропорционально весам тарифов."""
+    scheduler = OpenAIScheduler(rpm=0, tpm=600_000, weights={"default": 1, "premium": 3}, reserve=0.0)
+    scheduler.tokens.available = 0
+    order = []
+
+    tasks = [
+        asyncio.create_task(_call(scheduler, order, assistant, BACKGROUND, assistant, tariff))
+        for _ in range(8)
+        for assistant, tariff in (("shop", "default"), ("legal", "premium"))
+    ]
+    await asyncio.gather(*tasks)
+
+    first = order[:8]
+    assert first.count("legal") == 6
+    assert first.count("shop") == 2
+
+
+@pytest.mark.asyncio
+async def test_background_cannot_use_interactive_reserve():
+    """Тест: фоновые вызовы оставляют резерв бюджета для интерактивных."""
+    scheduler = OpenAIScheduler(rpm=100, tpm=0, reserve=0.2)
+    order = []
+
+    with scheduling(BACKGROUND):
+        for n in range(80):
+            async with scheduler.slot(1):
+                order.append(n)
+        assert scheduler.requests.delay(1, scheduler.reserve) > 0
+
+    await asyncio.wait_for(_call(scheduler, order, "query", INTERACTIVE), timeout=0.1)
+    assert order[-1] == "query"
+
+
+@pytest.mark.asyncio
+async def test_background_call_larger_than_budget_is_dispatched():
+    """Тест: фоновый вызов с оценкой больше доли без резерва не застревает во главе очереди."""
+    scheduler = OpenAIScheduler(rpm=0, tpm=600_000, reserve=0.2)
+    scheduler.tokens.available = 599_000  # почти полное ведро: вызов встает в очередь
+    order = []
+
+    # Пачка эмбеддингов дороже 80% TPM проходит, как только ведро заполнится
+    await asyncio.wait_for(_call(scheduler, order, "batch", BACKGROUND, tokens=550_000), timeout=1)
+
+    assert order == ["batch"]
+    assert scheduler.stats()["queued"] == 0
@@ -0,0 +1,73 @@
+# tests/test_partitions.py
+import os
+import re
+import sys
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("DB_PORT", "5432")
+
+from api.partitions import ensure_partitions
+
+
+class _Result:
+    def __init__(self, value=None, rowcount=0):
+        self.value = value
+        self.rowcount = rowcount
+
+    def scalar(self):
+        return self.value
+
+
+class PartitionedMessages:
+    """Соединение, которое ведет себя как секционированная messages в Postgres: секции, строки, DEFAULT."""
+
+    def __init__(self, default_rows):
+        self.partitions = {}  # имя -> (начало, конец)
+        self.rows = {"messages_default": list(default_rows)}
+        self.default_attached = True
+
+    def execute(self, statement, params=None):
+        sql = str(statement)
+        params = params or {}
+        if "to_regclass(:name)" in sql:
+            return _Result(params["name"] in self.partitions)
+        if "to_regclass('messages_default')" in sql:
+            return _Result("messages_default" in self.rows)
+        if sql.startswith("SELECT EXISTS"):
+            return _Result(any(self._in(row, params) for row in self.rows["messages_default"]))
+        if "DETACH PARTITION messages_default" in sql:
+            self.default_attached = False
+        elif "ATTACH PARTITION messages_default" in sql:
+            assert not any(self._in(row, {"start": s, "end": e}) for row in self.rows["messages_default"]
+                           for s, e in self.partitions.values())
+            self.default_attached = True
+        elif match := re.match(r"CREATE TABLE (messages_\d{4}_\d{2}) .* FROM \('(.+?)'\) TO \('(.+?)'\)", sql):
+            bounds = {"start": date.fromisoformat(match.group(2)), "end": date.fromisoformat(match.group(3))}
+            if self.default_attached and any(self._in(row, bounds) for row in self.rows["messages_default"]):
+                raise RuntimeError("updated partition constraint for default partition would be violated")
+            self.partitions[match.group(1)] = (bounds["start"], bounds["end"])
+            self.rows[match.group(1)] = []
+        elif sql.startswith("WITH moved"):
+            name = re.search(r"INSERT INTO (\w+)", sql).group(1)
+            moved = [row for row in self.rows["messages_default"] if self._in(row, params)]
+            self.rows["messages_default"] = [row for row in self.rows["messages_default"] if row not in moved]
+            self.rows[name] += moved
+            return _Result(rowcount=len(moved))
+        return _Result()
+
+    @staticmethod
+    def _in(row, bounds):
+        return bounds["start"] <= row.date() < bounds["end"]
+
+
+def test_month_with_rows_in_default_partition_is_created():
+    """Тест: строки месяца из секции по умолчанию переносятся в новую секцию, а не ломают ее создание."""
+    connection = PartitionedMessages([datetime(2026, 11, 3, 12), datetime(2026, 11, 20), datetime(2027, 5, 1)])
+
+    created = ensure_partitions(connection, ahead=1, today=date(2026, 10, 19))
+
+    assert created == ["messages_2026_10", "messages_2026_11"]
+    assert connection.rows["messages_2026_11"] == [datetime(2026, 11, 3, 12), datetime(2026, 11, 20)]
+    assert connection.rows["messages_default"] == [datetime(2027, 5, 1)]
+    assert connection.default_attached
@@ -0,0 +1,54 @@
+# tests/test_profiling.py
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+pytest.importorskip("pyinstrument")
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.profiling import ProfilingMiddleware, RequestProfiler
+
+
+def _client(profiler: RequestProfiler) -> TestClient:
+    app = FastAPI()
+
+    @app.get("/slow")
+    async def slow():
+        await asyncio.sleep(0.02)
+        return {"ok": True}
+
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+    return TestClient(app)
+
+
+def test_profile_by_token(tmp_path):
+    """Тест: запрос с верным X-Profile сохраняет speedscope-профиль, без токена — нет."""
+    profiler = RequestProfiler(directory=str(tmp_path), token="secret", sample_rate=0)
+    client = _client(profiler)
+
+    assert "x-profile-id" not in client.get("/slow").headers
+    assert "x-profile-id" not in client.get("/slow", headers={"X-Profile": "wrong"}).headers
+
+    response = client.get("/slow", headers={"X-Profile": "secret"})
+    name = response.headers["x-profile-id"]
+    assert response.json() == {"ok": True}
+    assert [p["name"] for p in profiler.list()] == [name]
+    with open(profiler.path(name), encoding="utf-8") as fh:
+        assert "speedscope" in fh.read()
+
+
+def test_sampling_keeps_latest(tmp_path):
+    """Тест: профили по сэмплированию, на диске остаются только последние keep."""
+    profiler = RequestProfiler(directory=str(tmp_path), sample_rate=1.0, keep=2)
+    client = _client(profiler)
+    for _ in range(4):
+        client.get("/slow")
+    assert profiler.taken == 4
+    assert len(profiler.list()) == 2
+    assert profiler.path("../secret") is None
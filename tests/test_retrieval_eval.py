@@ -0,0 +1,32 @@
+# tests/test_retrieval_eval.py
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.retrieval_eval import build_index, current_config, evaluate, load_golden, recommend
+
+
+@pytest.mark.parametrize("assistant", ["dental", "legal", "shop"])
+def test_golden_sets_match_data(assistant):
+    """Тест: ожидаемые фрагменты golden-наборов есть в данных, а текущий конфиг что-то находит."""
+    golden = load_golden(assistant)
+    size, overlap, top_k = current_config(assistant)
+    index = build_index(golden["documents"], size, overlap, dimensions=256)
+    metrics = evaluate(index, golden["questions"], top_k, dimensions=256, repeat=1)
+    assert metrics["chunks"] == len(index.chunks) > 0
+    assert metrics["index_bytes"] >= metrics["chunks"] * 256 * 4
+    assert 0 < metrics["mrr"] <= metrics["recall"] <= 1
+
+
+def test_recommend_picks_fastest_passing():
+    """Тест: из конфигураций с нужным recall выбирается самая быстрая."""
+    results = [
+        {"recall": 0.95, "search_p95_ms": 0.5, "context_chars": 100, "index_bytes": 10},
+        {"recall": 0.80, "search_p95_ms": 0.1, "context_chars": 100, "index_bytes": 10},
+        {"recall": 0.90, "search_p95_ms": 0.3, "context_chars": 100, "index_bytes": 10},
+    ]
+    assert recommend(results, 0.9) is results[2]
+    assert recommend(results, 0.99) is None
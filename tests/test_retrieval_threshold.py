@@ -0,0 +1,59 @@
+# tests/test_retrieval_threshold.py
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("DB_PORT", "5432")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from api import rag_pipeline
+from api.retriever import RetrievedChunk, select_chunks
+
+
+def _chunks(*distances):
+    return [RetrievedChunk(n, 1, f"chunk {n}", distance) for n, distance in enumerate(distances)]
+
+
+def test_distant_chunks_are_dropped():
+    """Тест: чанки дальше порога не попадают в контекст."""
+    selected = select_chunks(_chunks(0.3, 0.5, 0.8), max_distance=0.6, adaptive_margin=None)
+    assert [c.distance for c in selected] == [0.3, 0.5]
+
+
+def test_strong_hit_narrows_k():
+    """Тест: при сильном лучшем совпадении остаются только близкие к нему чанки."""
+    selected = select_chunks(_chunks(0.1, 0.15, 0.45, 0.5), max_distance=0.6, adaptive_margin=0.1)
+    assert [c.distance for c in selected] == [0.1, 0.15]
+
+
+@pytest.mark.asyncio
+async def test_no_context_skips_llm(monkeypatch):
+    """Тест: если ничего не прошло порог, LLM не вызывается и возвращается заготовка."""
+    async def embed(query, model=None):
+        return [0.0]
+
+    async def history(user_id, assistant):
+        return []
+
+    class FarRetriever:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        async def search(self, query, top_k, query_embedding, assistant):
+            return _chunks(0.9, 0.95)
+
+    class NoLLM:
+        async def get_response(self, **kwargs):
+            raise AssertionError("LLM must not be called")
+
+    monkeypatch.setattr(rag_pipeline, "get_openai_embedding", embed)
+    monkeypatch.setattr(rag_pipeline, "fetch_history", history)
+    monkeypatch.setattr(rag_pipeline, "Retriever", FarRetriever)
+    monkeypatch.setattr(rag_pipeline, "persist_exchange", lambda *args: None)
+    monkeypatch.setattr(rag_pipeline, "load_assistant_config", lambda name: {})
+
+    answer = await rag_pipeline.process_query("Какая погода на Марсе?", "dental", 1, None, NoLLM())
+
+    assert answer == rag_pipeline.NO_CONTEXT_ANSWER
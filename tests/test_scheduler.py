@@ -0,0 +1,126 @@
+# tests/test_scheduler.py
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+import pytest
+from aiogram import Bot, Dispatcher
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Chat, Message, Update, User
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bot.scheduler import ChatScheduler, Dropped, Superseded
+
+
+@pytest.mark.asyncio
+async def test_per_chat_order_and_parallel_chats():
+    """Тест: внутри чата порядок сохраняется, разные чаты — параллельно до общего лимита."""
+    scheduler = ChatScheduler(max_concurrency=3, queue_limit=10)
+    seen = {}
+    active, peak = 0, 0
+
+    def job(chat_id, n):
+        async def _run():
+            nonlocal active, peak
+            active += 1
+            peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            seen.setdefault(chat_id, []).append(n)
+            active -= 1
+        return _run
+
+    await asyncio.gather(*(
+        scheduler.run(chat_id, job(chat_id, n)) for n in range(5) for chat_id in range(4)
+    ))
+
+    assert all(seen[chat_id] == list(range(5)) for chat_id in range(4))
+    assert peak == 3
+    assert scheduler.stats()["pending"] == 0
+
+
+@pytest.mark.asyncio
+async def test_flood_is_coalesced():
+    """Тест: при переполнении очереди чата старый ожидающий вопрос вытесняется новым."""
+    scheduler = ChatScheduler(queue_limit=1, overflow_policy="coalesce")
+    done = []
+
+    def job(n):
+        async def _run():
+            await asyncio.sleep(0.01)
+            done.append(n)
+        return _run
+
+    results = await asyncio.gather(
+        *(scheduler.run(1, job(n), coalescible=True) for n in range(4)),
+        return_exceptions=True,
+    )
+
+    assert done == [0, 3]
+    assert [type(r) for r in results[1:3]] == [Superseded, Superseded]
+    assert scheduler.coalesced == 2
+
+
+@pytest.mark.asyncio
+async def test_flood_is_dropped():
+    """Тест: политика drop отклоняет новые вопросы при полной очереди."""
+    scheduler = ChatScheduler(queue_limit=1, overflow_policy="drop")
+
+    async def noop():
+        await asyncio.sleep(0.01)
+
+    results = await asyncio.gather(
+        *(scheduler.run(1, noop, coalescible=True) for _ in range(3)),
+        return_exceptions=True,
+    )
+
+    assert results[:2] == [None, None]
+    assert isinstance(results[2], Dropped)
+    assert scheduler.dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_queued_update_sees_state_set_by_previous_handler():
+    """Тест: апдейт, ждавший очереди чата, маршрутизируется по состоянию, выставленному предыдущим хендлером."""
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'bot')))
+    from middlewares import ChatOrderingIsolation, ChatOrderingMiddleware
+    from scheduler import ChatScheduler as BotChatScheduler
+
+    class Upload(StatesGroup):
+        waiting = State()
+
+    dp = Dispatcher(
+        storage=MemoryStorage(), events_isolation=ChatOrderingIsolation(BotChatScheduler()), disable_fsm=True
+    )
+    dp.update.outer_middleware(ChatOrderingMiddleware())
+    dp.update.outer_middleware(dp.fsm)
+    routed = []
+
+    @dp.message(Command("upload"))
+    async def upload(message: Message, state: FSMContext):
+        await asyncio.sleep(0.05)
+        await state.set_state(Upload.waiting)
+
+    @dp.message(Upload.waiting)
+    async def file(message: Message):
+        routed.append("upload")
+
+    @dp.message()
+    async def other(message: Message):
+        routed.append("other")
+
+    def update(update_id, text):
+        chat, user = Chat(id=1, type="private"), User(id=1, is_bot=False, first_name="Test")
+        return Update(update_id=update_id, message=Message(
+            message_id=update_id, date=datetime.now(), chat=chat, from_user=user, text=text
+        ))
+
+    bot = Bot(token="42:TEST")
+    await asyncio.gather(dp.feed_update(bot, update(1, "/upload")), dp.feed_update(bot, update(2, "price.txt")))
+    await bot.session.close()
+
+    assert routed == ["upload"]
@@ -0,0 +1,109 @@
+# tests/test_sender.py
+import asyncio
+import os
+import re
+import sys
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, SendChatAction, SendMessage
+from aiogram.types import MessageEntity
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bot.sender import MESSAGE_LIMIT, OutboundLimiter, split_html, split_text
+
+
+def test_split_text_respects_limit():
+    """Тест: длинный текст делится по строкам, без потерь и не длиннее лимита."""
+    text = "\n".join(f"📄 {i}: document_{i}.txt" for i in range(1000))
+    parts = split_text(text)
+
+    assert len(parts) > 1
+    assert all(len(p) <= MESSAGE_LIMIT for p in parts)
+    assert "\n".join(parts) == text
+
+
+@pytest.mark.asyncio
+async def test_long_message_is_split():
+    """Тест: sendMessage длиннее 4096 символов уходит несколькими сообщениями."""
+    limiter = OutboundLimiter()
+    sent = []
+
+    async def make_request(bot, method):
+        sent.append(method.text)
+        return Response(ok=True, result=True)
+
+    await limiter(make_request, None, SendMessage(chat_id=1, text="слово " * 2000))
+
+    assert len(sent) == 3
+    assert all(len(t) <= MESSAGE_LIMIT for t in sent)
+
+
+@pytest.mark.asyncio
+async def test_long_html_message_keeps_markup_valid():
+    """Тест: HTML режется вне тегов и сущностей, открытые теги закрываются и открываются заново."""
+    limiter = OutboundLimiter()
+    sent = []
+
+    async def make_request(bot, method):
+        sent.append(method)
+        return Response(ok=True, result=True)
+
+    text = "<b>Прайс</b>\n<i>" + "чистка&amp;отбеливание " * 300 + '<a href="https://example.com">' + "запись " * 500 + "</a></i>"
+    await limiter(make_request, None, SendMessage(chat_id=1, text=text, parse_mode="HTML"))
+
+    parts = [method.text for method in sent]
+    assert len(parts) > 1 and all(len(p) <= MESSAGE_LIMIT for p in parts)
+    for part in parts:
+        assert part.count("<i>") == part.count("</i>") == 1
+        assert part.count("<a ") == part.count("</a>")
+        assert part.count("&") == part.count("&amp;")
+    visible = lambda html: re.sub(r"<[^>]+>", "", html).split()
+    assert [word for p in parts for word in visible(p)] == visible(text)
+    assert split_html("<b>" + "x" * 10 + "</b>", limit=12) == ["<b>xxxxx</b>", "<b>xxxxx</b>"]
+
+    sent.clear()
+    entities = [MessageEntity(type="bold", offset=0, length=5)]
+    await limiter(make_request, None, SendMessage(chat_id=1, text="слово " * 1000, entities=entities))
+    assert len(sent) == 1  # со смещениями entities сообщение не режется
+
+
+@pytest.mark.asyncio
+async def test_retry_after_is_retried():
+    """Тест: при TelegramRetryAfter сообщение отправляется повторно."""
+    limiter = OutboundLimiter()
+    calls = []
+
+    async def make_request(bot, method):
+        calls.append(method)
+        if len(calls) == 1:
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0)
+        return Response(ok=True, result=True)
+
+    response = await limiter(make_request, None, SendMessage(chat_id=1, text="ответ"))
+
+    assert response.ok
+    assert len(calls) == 2
+    assert limiter.retries == 1
+
+
+@pytest.mark.asyncio
+async def test_answers_go_before_chat_actions():
+    """Тест: при исчерпанном глобальном лимите ответы обгоняют индикаторы набора."""
+    limiter = OutboundLimiter()
+    limiter.gate.bucket.tokens = 0
+    limiter.gate.bucket.rate = 50
+    order = []
+
+    async def make_request(bot, method):
+        order.append(type(method).__name__)
+        return Response(ok=True, result=True)
+
+    await asyncio.gather(
+        limiter(make_request, None, SendChatAction(chat_id=1, action="typing")),
+        limiter(make_request, None, SendChatAction(chat_id=2, action="typing")),
+        limiter(make_request, None, SendMessage(chat_id=3, text="ответ")),
+    )
+
+    assert order[0] == "SendMessage"
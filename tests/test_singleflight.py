@@ -0,0 +1,71 @@
+# tests/test_singleflight.py
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from api.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_identical_calls_share_one_flight():
+    """Тест: одновременные вызовы с одним ключом выполняют функцию один раз."""
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    results = await asyncio.gather(*(flight.do("q", work) for _ in range(10)))
+
+    assert results == ["answer"] * 10
+    assert calls == 1
+    assert flight.shared == 9
+    assert flight.inflight() == 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_cancel_shared_call():
+    """Тест: отмена одного ожидающего не отменяет общий вызов для остальных."""
+    flight = SingleFlight()
+    started = asyncio.Event()
+
+    async def work():
+        started.set()
+        await asyncio.sleep(0.02)
+        return 42
+
+    first = asyncio.create_task(flight.do("q", work))
+    second = asyncio.create_task(flight.do("q", work))
+    await started.wait()
+    first.cancel()
+
+    assert await second == 42
+    with pytest.raises(asyncio.CancelledError):
+        await first
+
+
+@pytest.mark.asyncio
+async def test_call_is_cancelled_when_nobody_waits():
+    """Тест: если все ожидающие ушли, вызов отменяется, а следующий начинается заново."""
+    flight = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return len(runs)
+
+    waiter = asyncio.create_task(flight.do("q", work))
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.gather(waiter, return_exceptions=True)
+
+    assert await flight.do("q", work) == 2
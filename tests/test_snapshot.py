@@ -0,0 +1,88 @@
+# tests/test_snapshot.py
+import os
+import sys
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.environ.setdefault("DB_PORT", "5432")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from api.chunk_shards import ChunkShards
+from api.db import Document, DocumentChunk, EmbeddingState, User
+from api.retriever import embedding_models
+from api.snapshot import Snapshot, export_snapshot, import_snapshot
+
+
+def _database(path):
+    engine = create_engine(f"sqlite:///{path}")
+    for model in (User, Document, DocumentChunk, EmbeddingState):
+        model.__table__.create(engine)
+    session_factory = sessionmaker(bind=engine)
+    with session_factory() as session:
+        session.add(EmbeddingState(id=1, active_model="test-model", phase="idle", total=0, done=0))
+        session.commit()
+    return session_factory
+
+
+def _vector(seed):
+    return np.random.default_rng(seed).random(1536, dtype=np.float32)
+
+
+def test_snapshot_round_trip(tmp_path, monkeypatch):
+    """Тест: снапшот переносит документы, тексты и векторы; повторный импорт ничего не дублирует."""
+    monkeypatch.setattr(embedding_models, "active", "test-model")
+    monkeypatch.setattr(embedding_models, "migrating", False)
+    shards = ChunkShards({})
+    source = _database(tmp_path / "source.db")
+    with source() as session:
+        for doc_id, (filename, owner) in enumerate((("prices.txt", None), ("faq.txt", None), ("mine.txt", 1)), 1):
+            session.add(Document(id=doc_id, filename=filename, user_id=owner, assistant="dental", status="ready", byte_size=10))
+        session.add_all([
+            DocumentChunk(document_id=1, content="Чистка — 3000 ₽", embedding=_vector(1), embedding_model="test-model"),
+            DocumentChunk(document_id=2, content="Работаем с 9:00", embedding=_vector(2), embedding_model="test-model"),
+            DocumentChunk(document_id=2, content="В субботу до 15:00", embedding=_vector(3), embedding_model="test-model"),
+            DocumentChunk(document_id=3, content="чужой документ", embedding=_vector(4), embedding_model="test-model"),
+        ])
+        session.commit()
+
+    path = str(tmp_path / "dental.snap")
+    header = export_snapshot(path, "dental", session_factory=source, shards=shards)
+    assert header["chunks"] == 3 and [d["chunk_count"] for d in header["documents"]] == [1, 2]
+
+    snapshot = Snapshot(path)
+    snapshot.verify()
+    assert snapshot.vectors.shape == (3, 1536)
+    assert snapshot.content(2) == "В субботу до 15:00"
+    assert np.array_equal(snapshot.vectors[1], _vector(2))
+
+    target = _database(tmp_path / "target.db")
+    assert import_snapshot(path, session_factory=target, shards=shards) == (2, 3, 0)
+    assert import_snapshot(path, session_factory=target, shards=shards) == (0, 0, 2)
+    with target() as session:
+        chunks = session.query(DocumentChunk).order_by(DocumentChunk.id).all()
+        assert [c.content for c in chunks] == ["Чистка — 3000 ₽", "Работаем с 9:00", "В субботу до 15:00"]
+        assert np.array_equal(chunks[2].embedding, _vector(3))
+        assert {d.filename: d.chunk_count for d in session.query(Document)} == {"prices.txt": 1, "faq.txt": 2}
+
+
+def test_corrupted_snapshot_is_rejected(tmp_path, monkeypatch):
+    """Тест: поврежденный снапшот не проходит проверку контрольных сумм."""
+    monkeypatch.setattr(embedding_models, "active", "test-model")
+    monkeypatch.setattr(embedding_models, "migrating", False)
+    source = _database(tmp_path / "source.db")
+    with source() as session:
+        session.add(Document(id=1, filename="prices.txt", assistant="dental", status="ready", byte_size=10))
+        session.add(DocumentChunk(document_id=1, content="Чистка", embedding=_vector(1), embedding_model="test-model"))
+        session.commit()
+    path = str(tmp_path / "dental.snap")
+    header = export_snapshot(path, "dental", session_factory=source, shards=ChunkShards({}))
+
+    with open(path, "r+b") as fh:
+        fh.seek(header["sections"]["vectors"]["offset"] + 100)
+        fh.write(b"\xff")
+    with pytest.raises(ValueError, match="checksum mismatch in section 'vectors'"):
+        import_snapshot(path, session_factory=_database(tmp_path / "target.db"), shards=ChunkShards({}))
@@ -0,0 +1,78 @@
+# tests/test_storage.py
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bot.storage import CachedStorage, SqliteBackend, build_key
+
+KEY = StorageKey(bot_id=1, chat_id=123, user_id=123)
+
+
+@pytest.mark.asyncio
+async def test_state_survives_restart(tmp_path):
+    """Тест: состояние и данные переживают пересоздание хранилища."""
+    path = str(tmp_path / "fsm.sqlite3")
+    storage = CachedStorage(SqliteBackend(path), flush_interval=10)
+    await storage.set_state(KEY, "OrderState:waiting_for_query")
+    await storage.update_data(KEY, {"assistant": "dental"})
+    assert await storage.get_state(KEY) == "OrderState:waiting_for_query"
+    await storage.close()
+
+    restarted = CachedStorage(SqliteBackend(path))
+    assert await restarted.get_state(KEY) == "OrderState:waiting_for_query"
+    assert await restarted.get_data(KEY) == {"assistant": "dental"}
+    await restarted.close()
+
+
+@pytest.mark.asyncio
+async def test_writes_are_batched(tmp_path):
+    """Тест: записи копятся в памяти и уходят в бэкенд одной пачкой."""
+    backend = SqliteBackend(str(tmp_path / "fsm.sqlite3"))
+    calls = []
+    save_many = backend.save_many
+    backend.save_many = lambda items: (calls.append(len(items)), save_many(items))
+
+    storage = CachedStorage(backend, flush_interval=10)
+    for chat_id in range(20):
+        await storage.set_state(StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id), "s")
+    assert calls == []
+
+    await storage.flush()
+    assert calls == [20]
+    await storage.close()
+
+
+@pytest.mark.asyncio
+async def test_stale_backend_read_does_not_overwrite_newer_write(tmp_path):
+    """Тест: запись, сделанная и сброшенная, пока шло чтение из БД, не затирается старым результатом."""
+    backend = SqliteBackend(str(tmp_path / "fsm.sqlite3"))
+    backend.save_many({build_key(KEY): ("old", {})})
+    load, release, reads = backend.load, threading.Event(), []
+
+    def slow_load(skey):
+        record = load(skey)
+        reads.append(record)
+        if len(reads) == 1:
+            # Первое чтение уже прочитало "old" и задерживается
+            release.wait(5)
+        return record
+
+    backend.load = slow_load
+    storage = CachedStorage(backend, flush_interval=10)
+
+    reader = asyncio.create_task(storage.get_state(KEY))
+    while not reads:
+        await asyncio.sleep(0.01)
+    await storage.set_state(KEY, "new")
+    await storage.flush()
+    release.set()
+
+    assert await reader == "new"
+    assert await storage.get_state(KEY) == "new"
+    await storage.close()
@@ -0,0 +1,54 @@
+# tests/test_text_splitter.py
+import json
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from api.loaders import load_documents
+from api.text_splitter import RecursiveCharacterTextSplitter
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), 'golden', 'chunks.json')
+
+with open(GOLDEN_PATH, encoding='utf-8') as fh:
+    GOLDEN = json.load(fh)
+
+
+@pytest.mark.parametrize("key", sorted(GOLDEN))
+def test_chunks_match_golden(key):
+    """Тест: нативный сплиттер выдает те же чанки, что и langchain на data/."""
+    assistant, file_name = key.split('/', 1)
+    expected = GOLDEN[key]
+    docs = {
+        os.path.basename(doc.source): doc.content
+        for doc in load_documents(os.path.join(ROOT, 'data', assistant))
+    }
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=expected["chunk_size"],
+        chunk_overlap=expected["chunk_overlap"],
+    )
+
+    assert splitter.split_text(docs[file_name]) == expected["chunks"]
+
+
+def test_matches_langchain_on_random_text():
+    """Тест: совпадение с langchain на случайных текстах с разными разделителями."""
+    lc = pytest.importorskip("langchain_text_splitters")
+    rnd = random.Random(42)
+    words = ["альфа", "beta", "гамма", "delta", "x" * 40, "\n", "\n\n", "  "]
+    for _ in range(50):
+        text = " ".join(rnd.choice(words) for _ in range(rnd.randint(0, 400)))
+        size = rnd.randint(10, 300)
+        overlap = rnd.randint(0, size // 2)
+        ours = RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=overlap)
+        theirs = lc.RecursiveCharacterTextSplitter(chunk_size=size, chunk_overlap=overlap, length_function=len)
+        assert ours.split_text(text) == theirs.split_text(text)
+
+
+def test_invalid_overlap():
+    with pytest.raises(ValueError):
+        RecursiveCharacterTextSplitter(chunk_size=100, chunk_overlap=200)